@@ -0,0 +1,81 @@
+"""
+Construction et interrogation de l'index local d'adresses sur un export BAN généré
+(même format que adresses-XX.csv.gz).
+
+    python -m benchmarks.bench_address_search [--addresses 1000000] [--repeat 20]
+"""
+import argparse
+import csv
+import gzip
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import benchmarks.common  # noqa: F401  (configuration de Django)
+
+from django_api.addresses import AddressIndex, build_address_index
+
+BAN_HEADER = ['id', 'id_fantoir', 'numero', 'rep', 'nom_voie', 'code_postal', 'code_insee', 'nom_commune',
+              'code_insee_ancienne_commune', 'nom_ancienne_commune', 'x', 'y', 'lon', 'lat', 'type_position',
+              'alias', 'nom_ld', 'libelle_acheminement', 'nom_afnor', 'source_position', 'source_nom_voie',
+              'certification_commune', 'cad_parcelles']
+STREET_TYPES = ['Rue', 'Avenue', 'Boulevard', 'Impasse', 'Chemin', 'Place', 'Allée', 'Route']
+STREET_NAMES = ['de la Paix', 'Victor Hugo', 'Jean Jaurès', 'de l\'Église', 'des Écoles', 'du Moulin', 'Pasteur',
+                'de la République', 'Gambetta', 'du Général de Gaulle', 'des Lilas', 'Saint-Exupéry', 'de Verdun',
+                'Émile Zola', 'du Château', 'de la Gare', 'des Peupliers', 'Foch', 'Voltaire', 'Molière']
+QUERIES = ['8 rue de la paix', 'rue victor hu', 'jaures', 'avenue du general de gau', '12 bis', 'chemin du moul',
+           'place de la rep', 'allee des lilas 7']
+
+
+def write_ban_file(path, count, rng):
+    cities = [(f'Commune {index}', f'{rng.randrange(1, 96):02d}{rng.randrange(0, 1000):03d}',
+               rng.uniform(42.5, 50.5), rng.uniform(-4.5, 7.5)) for index in range(count // 400 + 1)]
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as handle:
+        writer = csv.writer(handle, delimiter=';')
+        writer.writerow(BAN_HEADER)
+        written = 0
+        while written < count:
+            city, postcode, lat, lon = rng.choice(cities)
+            street = f'{rng.choice(STREET_TYPES)} {rng.choice(STREET_NAMES)}'
+            for number in range(1, rng.randrange(5, 80)):
+                row = dict.fromkeys(BAN_HEADER, '')
+                row.update(numero=number, rep=rng.choice(['', '', '', '', 'bis']), nom_voie=street, code_postal=postcode,
+                           nom_commune=city, lat=f'{lat + rng.uniform(-0.02, 0.02):.6f}',
+                           lon=f'{lon + rng.uniform(-0.02, 0.02):.6f}')
+                writer.writerow([row[name] for name in BAN_HEADER])
+                written += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'adresses-bench.csv.gz')
+        write_ban_file(source, args.addresses, rng)
+        meta = build_address_index([source], os.path.join(directory, 'index'))
+        size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, 'index')))
+        print(f"Index : {meta['addresses']} adresses, {meta['streets']} voies, {meta['tokens']} mots, "
+              f"{size / 2**20:.0f} Mo, construit en {meta['elapsed_seconds']} s")
+
+        start = time.perf_counter()
+        index = AddressIndex(os.path.join(directory, 'index'), version=0)
+        print(f"Ouverture (mmap) : {(time.perf_counter() - start) * 1e3:.2f} ms")
+        for query in QUERIES:
+            durations = []
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                results = index.search(query, 48.866667, 2.333333, 5)
+                durations.append(time.perf_counter() - began)
+            first = results[0]['label'] if results else '-'
+            print(f"  {query!r:<28} médiane {statistics.median(durations) * 1e3:6.2f} ms, "
+                  f"max {max(durations) * 1e3:6.2f} ms  ({first})")
+
+
+if __name__ == '__main__':
+    main()
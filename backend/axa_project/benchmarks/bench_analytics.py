@@ -0,0 +1,58 @@
+"""
+Analyses du portefeuille lues dans les tables de synthèse, comparées au calcul des
+mêmes totaux directement sur les devis (un GROUP BY sur toute la table), selon la
+taille du portefeuille. Mesure aussi le coût de la reconstruction complète.
+
+    python -m benchmarks.bench_analytics [--sizes 10000 100000] [--months 36] [--repeat 10]
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from benchmarks.common import seed_proposals, test_database, timed
+
+from django.utils import timezone
+
+from django_api.analytics import grouped_totals, portfolio_analytics, rebuild_summaries
+from django_api.bulk import bulk_update_rows
+from django_api.models import Proposal, ProposalSummary
+
+
+def spread_creation_dates(months, seed=42):
+    # Devis répartis sur plusieurs mois, pour une tendance mensuelle réaliste
+    rng = random.Random(seed)
+    now = timezone.now()
+    rows = [(pk, {'created_at': now - timedelta(days=rng.randrange(months * 30))})
+            for pk in Proposal.objects.values_list('id', flat=True)]
+    bulk_update_rows(Proposal, rows, ['created_at'])
+
+
+def bench_size(size, months, repeat):
+    Proposal.objects.all().delete()
+    seed_proposals(size)
+    spread_creation_dates(months)
+    start = time.perf_counter()
+    report = rebuild_summaries()
+    rebuild = time.perf_counter() - start
+    print(f"{size:>7} devis, {report['groups']} groupes (reconstruction : {rebuild * 1e3:7.1f} ms)")
+
+    summaries = timed(lambda: portfolio_analytics(ProposalSummary.objects.all()), repeat)
+    direct = timed(lambda: list(grouped_totals(Proposal.objects.all())), repeat)
+    print(f"  tables de synthèse {summaries * 1e3:7.2f} ms, GROUP BY sur les devis {direct * 1e3:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with test_database():
+        for size in args.sizes:
+            bench_size(size, args.months, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
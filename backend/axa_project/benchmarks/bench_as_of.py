@@ -0,0 +1,67 @@
+"""
+Coût d'une reconstruction `as_of` selon la longueur de l'historique du devis.
+
+    python -m benchmarks.bench_as_of [--lengths 100 1000 10000] [--queries 200]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.common import quiet, random_proposal_values, test_database
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from django_api.as_of import proposal_as_of
+from django_api.models import Proposal
+
+
+def seed_history(length, rng):
+    # Vraies sauvegardes : chaque entrée passe par Proposal.save (différence + instantané périodique)
+    proposal = Proposal(**random_proposal_values(length, rng))
+    with quiet():
+        proposal.save()
+        for _ in range(length - 1):
+            proposal.ouvrage_cost = Decimal(rng.randrange(10_000_00, 5_000_000_00)) / 100
+            proposal.client_name = f'Client {rng.randrange(5000)}'
+            proposal.save()
+    return proposal
+
+
+def bench_length(length, queries, rng):
+    proposal = seed_history(length, rng)
+    # Le journal des requêtes est borné : on le vide pour que le comptage reste juste
+    connection.queries_log.clear()
+    start, end = proposal.created_at, timezone.now()
+    span = (end - start).total_seconds()
+    durations = []
+    query_counts = []
+    for _ in range(queries):
+        moment = start + timedelta(seconds=rng.random() * span)
+        with CaptureQueriesContext(connection) as ctx:
+            began = time.perf_counter()
+            proposal_as_of(proposal, moment)
+            durations.append(time.perf_counter() - began)
+        query_counts.append(len(ctx.captured_queries))
+    print(f"{length:>6} entrées : médiane {statistics.median(durations) * 1e3:5.2f} ms, "
+          f"max {max(durations) * 1e3:5.2f} ms, {statistics.mean(query_counts):.1f} requêtes")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with test_database():
+        for length in args.lengths:
+            bench_length(length, args.queries, rng)
+
+
+if __name__ == '__main__':
+    main()
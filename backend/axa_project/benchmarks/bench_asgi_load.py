@@ -0,0 +1,196 @@
+"""
+Débit et latence sous charge concurrente : service WSGI actuel (`runserver`, un
+thread par connexion) contre service ASGI (`uvicorn`) et vues asynchrones.
+
+    python -m benchmarks.bench_asgi_load [--proposals 10000] [--concurrency 1 16 64] [--seconds 5]
+
+Chaque serveur tourne dans son propre processus sur une même base de test (un
+fichier, cf. SQLITE_PATH), avec le cache de réponses désactivé (PROPOSAL_CACHE_BACKEND
+'dummy') pour mesurer la lecture en base. Les documents sont rendus une première fois
+avant la mesure : le scénario 'document' mesure l'envoi depuis le cache disque. Les
+clients (asyncio, connexions keep-alive) tournent dans ce processus-ci et partagent
+donc le processeur avec le serveur : sur une petite machine, les chiffres comptent
+surtout les uns par rapport aux autres.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.common import BASE_DIR, seed_proposals, test_database
+
+from django.db import connections
+
+from django_api.models import Proposal
+
+# (serveur, préfixe des vues) : 'asgi+sync' sépare l'effet du serveur de celui des vues
+TARGETS = {
+    'wsgi': ('runserver', 'sync'),
+    'asgi+sync': ('uvicorn', 'sync'),
+    'asgi': ('uvicorn', 'async'),
+}
+SCENARIOS = {
+    'page de 50': {
+        'sync': ('GET', '/api/proposals/?page_size=50', None),
+        'async': ('GET', '/api/async/proposals/?page_size=50', None),
+    },
+    'détail': {
+        'sync': ('GET', '/api/proposals/{pk}/', None),
+        'async': ('GET', '/api/async/proposals/{pk}/', None),
+    },
+    'document': {
+        'sync': ('POST', '/api/proposals/{pk}/generate-document/', {'doc_type': 'pdf'}),
+        'async': ('GET', '/api/async/proposals/{pk}/document/?doc_type=pdf', None),
+    },
+}
+DOCUMENT_PROPOSALS = 20
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, env):
+    if kind == 'runserver':
+        command = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'django_main.asgi:application', '--port', str(port),
+                   '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Le serveur {kind} n'a pas démarré")
+
+
+async def fetch(reader, writer, method, path, body):
+    """Une requête HTTP/1.1 ; renvoie (statut, connexion réutilisable)."""
+    payload = json.dumps(body).encode() if body is not None else b''
+    head = f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+    if payload:
+        head += f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n'
+    writer.write(head.encode() + b'\r\n' + payload)
+    await writer.drain()
+
+    lines = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status_code = int(lines[0].split(' ', 2)[1])
+    headers = dict((name.strip().lower(), value.strip()) for name, _, value in
+                   (line.partition(':') for line in lines[1:] if line))
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readuntil(b'\r\n')
+    else:
+        await reader.read()
+        return status_code, False
+    return status_code, headers.get('connection', '').lower() != 'close'
+
+
+async def client(port, requests, deadline, latencies, errors):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        start = time.perf_counter()
+        try:
+            status_code, keep_alive = await fetch(reader, writer, *random.choice(requests))
+        except (OSError, asyncio.IncompleteReadError):
+            status_code, keep_alive = None, False
+        latencies.append(time.perf_counter() - start)
+        if status_code is None or status_code >= 400:
+            errors.append(status_code)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port, requests, concurrency, seconds):
+    latencies, errors = [], []
+    deadline = time.monotonic() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, requests, deadline, latencies, errors) for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def warm_up(port, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        await fetch(reader, writer, *request)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] * 1e3
+
+
+def scenario_requests(scenario, views, ids):
+    method, path, body = SCENARIOS[scenario][views]
+    pks = ids[:DOCUMENT_PROPOSALS] if scenario == 'document' else ids
+    return [(method, path.format(pk=pk), body) for pk in pks]
+
+
+def bench_target(target, args, env, ids):
+    kind, views = TARGETS[target]
+    port = free_port()
+    process = start_server(kind, port, env)
+    try:
+        for scenario in SCENARIOS:
+            requests = scenario_requests(scenario, views, ids)
+            if scenario == 'document':
+                # Remplit le cache disque des documents avant la mesure
+                for request in requests:
+                    asyncio.run(warm_up(port, request))
+            for concurrency in args.concurrency:
+                latencies, errors, elapsed = asyncio.run(run_load(port, requests, concurrency, args.seconds))
+                print(f"{target:<10} {scenario:<11} x{concurrency:<4}: {len(latencies) / elapsed:7.1f} req/s, "
+                      f"p50 {percentile(latencies, 0.5):7.1f} ms, p95 {percentile(latencies, 0.95):7.1f} ms, "
+                      f"p99 {percentile(latencies, 0.99):7.1f} ms, erreurs {len(errors)} (dont 503 : {errors.count(503)})")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proposals', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS))
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-asgi-')
+    database = os.path.join(directory, 'bench.sqlite3')
+    connections['default'].settings_dict['TEST']['NAME'] = database
+    with test_database():
+        seed_proposals(args.proposals)
+        ids = list(Proposal.objects.order_by('pk').values_list('pk', flat=True))
+        connections.close_all()
+        env = dict(os.environ, SQLITE_PATH=database, PROPOSAL_CACHE_BACKEND='dummy', LOG_LEVEL='WARNING')
+        for target in args.targets:
+            bench_target(target, args, env, ids)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
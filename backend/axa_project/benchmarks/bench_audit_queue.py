@@ -0,0 +1,75 @@
+"""
+Débit de sauvegardes concurrentes selon le mode d'écriture de l'historique
+(HISTORY_AUDIT_MODE 'sync' ou 'queue').
+
+    python -m benchmarks.bench_audit_queue [--threads 4] [--saves 200]
+
+La base de test est un fichier (et non la base en mémoire habituelle des tests) :
+c'est le verrou d'écriture de SQLite sur fichier que l'on mesure.
+"""
+import argparse
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks.common import quiet, seed_proposals, test_database
+
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from django_api import audit
+from django_api.models import Proposal, ProposalHistory
+
+
+def worker(proposal_ids, durations, errors):
+    try:
+        for pk in proposal_ids:
+            proposal = Proposal.objects.get(pk=pk)
+            proposal.ouvrage_cost += Decimal('100.00')
+            start = time.perf_counter()
+            proposal.save(user_ip='127.0.0.1')
+            durations.append(time.perf_counter() - start)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        connection.close()
+
+
+def bench_mode(mode, threads, saves):
+    ids = list(Proposal.objects.order_by('id').values_list('pk', flat=True)[:threads * saves])
+    history_before = ProposalHistory.objects.count()
+    durations = []
+    errors = []
+    with override_settings(HISTORY_AUDIT_MODE=mode), quiet():
+        start = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(ids[index::threads], durations, errors)) for index in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        audit.flush_history()
+    durations.sort()
+    written = ProposalHistory.objects.count() - history_before
+    p95 = durations[int(len(durations) * 0.95) - 1] if durations else 0
+    print(f"{mode:<5}: {len(durations) / elapsed:6.0f} saves/s, médiane {statistics.median(durations) * 1e3:5.2f} ms, "
+          f"p95 {p95 * 1e3:6.2f} ms, {len(errors)} erreurs, {written} entrées d'historique")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--saves', type=int, default=200)
+    args = parser.parse_args()
+
+    connections['default'].settings_dict['TEST']['NAME'] = 'bench_audit_queue.sqlite3'
+    with test_database():
+        seed_proposals(args.threads * args.saves * 2)
+        bench_mode('sync', args.threads, args.saves)
+        bench_mode('queue', args.threads, args.saves)
+        audit.shutdown_writer()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Créations et modifications de devis : une requête HTTP par devis (API unitaire)
+contre un seul lot (`POST /api/proposals/bulk/`).
+
+    python -m benchmarks.bench_bulk_api [--rows 5000] [--items 200]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import quiet, random_proposal_values, seed_proposals, test_database
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django_api.models import Proposal
+
+FORM_FIELDS = ('opportunity_number', 'client_name', 'guarantee_type', 'ouvrage_destination', 'work_type',
+               'ouvrage_cost', 'existing_presence', 'is_vip_client', 'rcmo_desired', 'do_rate', 'trc_rate')
+
+
+def payload(values):
+    return {name: str(values[name]) if values[name] is not None else None for name in FORM_FIELDS}
+
+
+def measure(label, calls):
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as ctx, quiet():
+        for call in calls:
+            response = call()
+            assert response.status_code in (200, 201, 204), response.content[:500]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32}: {elapsed * 1e3:8.1f} ms, {len(ctx.captured_queries):5d} requêtes SQL, {len(calls)} requête(s) HTTP")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--items', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    client = APIClient()
+    with test_database():
+        seed_proposals(args.rows)
+        ids = list(Proposal.objects.order_by('?').values_list('pk', flat=True)[:args.items * 2])
+        unit_ids, batch_ids = ids[:args.items], ids[args.items:]
+        creates = [payload(random_proposal_values(args.rows + index, rng)) for index in range(args.items * 2)]
+
+        measure(f"{args.items} POST unitaires", [
+            lambda values=values: client.post('/api/proposals/', values, format='json') for values in creates[:args.items]])
+        measure(f"1 lot de {args.items} créations", [
+            lambda: client.post('/api/proposals/bulk/', {'create': creates[args.items:]}, format='json')])
+
+        measure(f"{args.items} PATCH unitaires", [
+            lambda pk=pk: client.patch(f'/api/proposals/{pk}/', {'ouvrage_cost': str(rng.randrange(10_000, 5_000_000))}, format='json')
+            for pk in unit_ids])
+        measure(f"1 lot de {args.items} modifications", [
+            lambda: client.post('/api/proposals/bulk/', {'update': [
+                {'id': pk, 'ouvrage_cost': str(rng.randrange(10_000, 5_000_000))} for pk in batch_ids]}, format='json')])
+
+        measure(f"{args.items} DELETE unitaires", [
+            lambda pk=pk: client.delete(f'/api/proposals/{pk}/') for pk in unit_ids])
+        measure(f"1 lot de {args.items} suppressions", [
+            lambda: client.post('/api/proposals/bulk/', {'delete': batch_ids}, format='json')])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Mise à jour d'un tableau de bord après des modifications : relecture de la liste
+entière (colonnes du tableau) contre lecture des seuls changements depuis le
+dernier curseur (`GET /api/proposals/changes/?since=...`). Mesure aussi le délai
+entre une écriture et le réveil de clients asynchrones en attente sur le flux.
+
+    python -m benchmarks.bench_change_feed [--proposals 10000] [--edits 1 10 100] [--listeners 100 1000]
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+from benchmarks.bench_list_serialization import TABLE_FIELDS
+from benchmarks.common import quiet, seed_proposals, test_database
+
+from rest_framework.test import APIClient
+
+from django_api.changes import get_feed
+from django_api.models import Proposal
+
+LIST_URL = '/api/proposals/?fields=' + ','.join(TABLE_FIELDS)
+
+
+def timed_get(client, url, params=None):
+    start = time.perf_counter()
+    with quiet():
+        response = client.get(url, params)
+    assert response.status_code == 200, response.content[:500]
+    return time.perf_counter() - start, response
+
+
+def bench_refresh(client, ids, edits, rng):
+    cursor = client.get('/api/proposals/changes/').json()['cursor']
+    for pk in rng.sample(ids, edits):
+        proposal = Proposal.objects.get(pk=pk)
+        proposal.ouvrage_cost = rng.randrange(10_000, 5_000_000)
+        proposal.save()
+    reload_time, reload = timed_get(client, LIST_URL)
+    delta_time, delta = timed_get(client, '/api/proposals/changes/', {'since': cursor})
+    assert len(delta.json()['results']) == edits
+    print(f"{edits:4d} modification(s) : liste entière {reload_time * 1e3:7.1f} ms, {len(reload.content) / 1e3:8.1f} ko"
+          f" ; changements {delta_time * 1e3:6.1f} ms, {len(delta.content) / 1e3:6.1f} ko")
+
+
+async def bench_listeners(listeners, rounds=20):
+    feed = get_feed()
+    latencies = []
+    for _ in range(rounds):
+        since = feed.cursor(feed.sequence)
+        woken = []
+
+        async def listen():
+            await feed.await_changes(since, 5)
+            woken.append(time.perf_counter())
+
+        tasks = [asyncio.create_task(listen()) for _ in range(listeners)]
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        # Écriture depuis un autre thread, comme une vue synchrone
+        threading.Thread(target=feed.publish, args=('updated', 0, {})).start()
+        await asyncio.gather(*tasks)
+        latencies.append(max(woken) - start)
+    latencies.sort()
+    print(f"{listeners:5d} clients en attente : tous réveillés en {latencies[len(latencies) // 2] * 1e3:6.2f} ms"
+          f" (médiane), {latencies[-1] * 1e3:6.2f} ms (max)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proposals', type=int, default=10000)
+    parser.add_argument('--edits', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--listeners', type=int, nargs='+', default=[100, 1000])
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    client = APIClient()
+    with test_database():
+        seed_proposals(args.proposals)
+        ids = list(Proposal.objects.values_list('pk', flat=True))
+        for edits in args.edits:
+            bench_refresh(client, ids, edits, rng)
+    for listeners in args.listeners:
+        asyncio.run(bench_listeners(listeners))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Latence de rendu d'un document (PDF et Word), hors cache disque.
+
+    python -m benchmarks.bench_document_render [--renders 200]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.common import quiet, random_proposal_values
+
+from django_api.documents import render_document
+from django_api.models import Proposal
+
+
+def bench_format(doc_type, proposals, generated_at):
+    # Premier rendu à part : il paie les initialisations propres au processus
+    durations = []
+    sizes = []
+    with quiet():
+        start = time.perf_counter()
+        render_document(proposals[0], doc_type, generated_at)
+        first = time.perf_counter() - start
+
+        for proposal in proposals:
+            start = time.perf_counter()
+            content = render_document(proposal, doc_type, generated_at)
+            durations.append(time.perf_counter() - start)
+            sizes.append(len(content))
+    durations.sort()
+    p95 = durations[int(len(durations) * 0.95) - 1]
+    print(f"{doc_type:<5}: 1er rendu {first * 1e3:6.1f} ms | médiane {statistics.median(durations) * 1e3:5.2f} ms, "
+          f"p95 {p95 * 1e3:5.2f} ms, moyenne {statistics.mean(durations) * 1e3:5.2f} ms "
+          f"({statistics.mean(sizes) / 1024:.1f} Kio/document)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--renders', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    proposals = [Proposal(**random_proposal_values(index, rng)) for index in range(args.renders)]
+    generated_at = datetime(2025, 1, 1, 12, 0)
+    for doc_type in ('pdf', 'word'):
+        bench_format(doc_type, proposals, generated_at)
+
+
+if __name__ == '__main__':
+    main()
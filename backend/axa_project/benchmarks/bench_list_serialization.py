@@ -0,0 +1,55 @@
+"""
+Liste des devis : sérialisation par ProposalSerializer (une instance et un passage
+de sérialiseur par ligne) contre la lecture par `.values()` de projection.py, avec
+tous les champs puis avec les seules colonnes du tableau (`fields=`).
+
+    python -m benchmarks.bench_list_serialization [--rows 10000 100000] [--repeat 3]
+
+Le temps compte la lecture en base, la conversion et le rendu JSON, sans HTTP.
+"""
+import argparse
+
+from benchmarks.common import seed_proposals, test_database, timed
+
+from rest_framework.renderers import JSONRenderer
+
+from django_api.models import Proposal
+from django_api.projection import LIST_FIELDS, project_rows, proposal_values
+from django_api.serializers import ProposalSerializer
+
+TABLE_FIELDS = ('id', 'opportunity_number', 'client_name', 'guarantee_type', 'ouvrage_destination', 'work_type',
+                'ouvrage_cost', 'existing_presence', 'is_vip_client', 'rcmo_desired', 'prime_seule_tarif_duo')
+
+
+def serializer_body(rows):
+    return JSONRenderer().render(ProposalSerializer(Proposal.objects.order_by('id')[:rows], many=True).data)
+
+
+def projected_body(rows, fields):
+    return JSONRenderer().render(project_rows(proposal_values(Proposal.objects.order_by('id')[:rows], fields), fields))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    variants = [
+        ('ProposalSerializer', serializer_body),
+        ('values(), tous les champs', lambda rows: projected_body(rows, LIST_FIELDS)),
+        (f'values(), {len(TABLE_FIELDS)} champs du tableau', lambda rows: projected_body(rows, TABLE_FIELDS)),
+    ]
+    with test_database():
+        seed_proposals(max(args.rows))
+        for rows in sorted(args.rows):
+            assert projected_body(rows, LIST_FIELDS) == serializer_body(rows)
+            print(f"{rows} devis")
+            for label, render in variants:
+                size = len(render(rows))
+                elapsed = timed(lambda: render(rows), args.repeat)
+                print(f"  {label:<34}: {elapsed * 1e3:9.1f} ms, {size / 1e6:7.2f} Mo")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Coût d'une mise à jour de devis (requêtes SQL par save) et coût mémoire du
+chargement de la liste.
+
+    python -m benchmarks.bench_proposal_save [--rows 5000] [--saves 200]
+"""
+import argparse
+import time
+import tracemalloc
+from decimal import Decimal
+
+from benchmarks.common import quiet, seed_proposals, test_database
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django_api.models import Proposal
+
+
+def bench_saves(saves):
+    proposals = list(Proposal.objects.order_by('id')[:saves])
+    total_queries = 0
+    start = time.perf_counter()
+    with quiet():
+        for proposal in proposals:
+            proposal.ouvrage_cost += Decimal('100.00')
+            with CaptureQueriesContext(connection) as ctx:
+                proposal.save(user_ip='127.0.0.1')
+            total_queries += len(ctx.captured_queries)
+    elapsed = time.perf_counter() - start
+    kinds = [query['sql'].split(' ', 1)[0] for query in ctx.captured_queries]
+    print(f"save()     : {total_queries / len(proposals):.2f} requêtes/save ({' + '.join(kinds)}), "
+          f"{elapsed / len(proposals) * 1e6:.0f} µs/save")
+
+
+def measure_allocations(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_list(rows):
+    client = APIClient()
+    peak = measure_allocations(lambda: list(Proposal.objects.all()))
+    print(f"instances  : pic {peak / 1024:.0f} Kio, {peak / rows:.0f} octets/ligne")
+    peak = measure_allocations(lambda: client.get('/api/proposals/'))
+    print(f"GET liste  : pic {peak / 1024:.0f} Kio, {peak / rows:.0f} octets/ligne")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--saves', type=int, default=200)
+    args = parser.parse_args()
+
+    with test_database():
+        seed_proposals(args.rows)
+        bench_saves(args.saves)
+        bench_list(args.rows)
+
+
+if __name__ == '__main__':
+    main()
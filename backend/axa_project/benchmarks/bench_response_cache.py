@@ -0,0 +1,65 @@
+"""
+Temps de réponse de la liste et du détail des devis : sans cache, avec cache, et
+revalidation (304) par un client qui renvoie l'ETag reçu.
+
+    python -m benchmarks.bench_response_cache [--proposals 5000] [--requests 200]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.common import seed_proposals, test_database
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import Client
+from django.test.utils import override_settings
+
+from django_api.models import Proposal
+
+URLS = {
+    'liste complète': '/api/proposals/',
+    'page de 50': '/api/proposals/?page_size=50&ordering=-updated_at',
+    'détail': '/api/proposals/{pk}/',
+}
+
+
+def measure(client, url, requests, **headers):
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url, **headers)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1e3, response
+
+
+def bench_url(label, url, requests):
+    client = Client()
+    with override_settings(CACHES=dict(settings.CACHES, proposals={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})):
+        uncached, _ = measure(client, url, requests)
+    caches['proposals'].clear()
+    cached, response = measure(client, url, requests)
+    revalidated, not_modified = measure(client, url, requests, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert not_modified.status_code == 304
+    print(f"{label:<15}: sans cache {uncached:7.2f} ms, avec cache {cached:5.2f} ms, "
+          f"304 {revalidated:5.2f} ms ({len(response.content) // 1024} Kio)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proposals', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with test_database():
+        seed_proposals(args.proposals)
+        pk = random.Random(42).choice(list(Proposal.objects.values_list('pk', flat=True)))
+        for label, url in URLS.items():
+            # La liste complète est bien plus lente : moins de répétitions
+            requests = max(args.requests // 20, 5) if label == 'liste complète' else args.requests
+            bench_url(label, url.format(pk=pk), requests)
+
+
+if __name__ == '__main__':
+    main()
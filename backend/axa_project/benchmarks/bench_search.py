@@ -0,0 +1,58 @@
+"""
+Recherche plein texte (index FTS5) comparée à un filtrage par sous-chaîne
+(`icontains`, qui parcourt la table jusqu'à trouver `limit` devis, sans classement),
+selon la taille du portefeuille et la sélectivité de la recherche.
+
+    python -m benchmarks.bench_search [--sizes 10000 100000] [--repeat 10]
+
+Les devis générés partagent la même rue et la même description : "paix" ou
+"logements coll" trouvent tous les devis, ce qui est le pire cas pour le classement.
+"""
+import argparse
+import time
+from functools import reduce
+from operator import and_
+
+from benchmarks.common import seed_proposals, test_database, timed
+
+from django.db.models import Q
+
+from django_api.models import Proposal
+from django_api.search import search_proposals
+
+QUERIES = ['bench0001234', 'client 4242', 'client 42', 'logements coll', 'paix']
+TEXT_FIELDS = ('opportunity_number', 'client_name', 'ouvrage_description', 'address_chantier')
+
+
+def substring_search(text, limit):
+    # Chaque mot doit apparaître dans l'un des champs texte
+    conditions = [reduce(lambda a, b: a | b, (Q(**{f'{name}__icontains': word}) for name in TEXT_FIELDS))
+                  for word in text.split()]
+    return list(Proposal.objects.filter(reduce(and_, conditions)).order_by('id')[:limit])
+
+
+def bench_size(size, repeat):
+    Proposal.objects.all().delete()
+    start = time.perf_counter()
+    seed_proposals(size)
+    print(f"{size:>7} devis (indexation comprise : {time.perf_counter() - start:5.1f} s)")
+    for text in QUERIES:
+        hits = len(search_proposals(Proposal.objects.all(), text, size))
+        fts = timed(lambda: search_proposals(Proposal.objects.all(), text, 20), repeat)
+        substring = timed(lambda: substring_search(text, 20), repeat)
+        print(f"  {text!r:<18} {hits:>7} devis trouvés : FTS5 {fts * 1e3:7.2f} ms, icontains {substring * 1e3:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with test_database():
+        for size in args.sizes:
+            bench_size(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
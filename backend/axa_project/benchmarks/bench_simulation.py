@@ -0,0 +1,76 @@
+"""
+Simulation d'une grille de taux sur tout le portefeuille : tarification devis par
+devis (instances et `price_proposal` en Decimal) contre simulation en colonnes
+(`simulate_rates`), à froid (lecture de la base) puis sur le portefeuille gardé en
+mémoire.
+
+    python -m benchmarks.bench_simulation [--proposals 100000] [--repeat 5]
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks.common import seed_proposals, test_database, timed
+
+from django.db.models import F
+from django.db.models.functions import Round
+
+from django_api.models import Proposal
+from django_api.pricing import price_proposal
+from django_api.simulation import _books, simulate_rates
+
+# Une grille par combinaison garantie x travaux, plus un segment pour la rénovation lourde avec existant
+SEGMENTS = [
+    {'work_type': 'RENOVATIONLD', 'existing_presence': True, 'do_rate': Decimal('0.0300'), 'trc_rate': Decimal('0.0150')},
+] + [
+    {'guarantee_type': guarantee_type, 'work_type': work_type,
+     'do_rate': Decimal(120 + 10 * index).scaleb(-4), 'trc_rate': Decimal(60 + 5 * index).scaleb(-4)}
+    for index, (guarantee_type, work_type) in enumerate(
+        (guarantee_type, work_type) for guarantee_type in ('DO', 'TRC', 'DUO') for work_type in ('NEUF', 'RENOVATIONLE', 'RENOVATIONLD'))
+]
+
+
+def per_proposal_delta():
+    # Référence : la même simulation devis par devis, avec les règles de Proposal.save
+    total = Decimal(0)
+    cent = Decimal('0.01')
+    for proposal in Proposal.objects.all().iterator(chunk_size=2000):
+        for segment in SEGMENTS:
+            if all(getattr(proposal, name) == value for name, value in segment.items() if name not in ('do_rate', 'trc_rate')):
+                new = price_proposal(proposal.guarantee_type, proposal.ouvrage_cost,
+                                     segment.get('do_rate', proposal.do_rate), segment.get('trc_rate', proposal.trc_rate)).duo
+                total += (new or 0).quantize(cent) - (proposal.prime_seule_tarif_duo or 0).quantize(cent)
+                break
+    return total
+
+
+def cold_simulation():
+    _books.clear()
+    return simulate_rates(Proposal.objects.all(), SEGMENTS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proposals', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database():
+        seed_proposals(args.proposals)
+        # Primes enregistrées au centime, comme par Proposal.save (seed_proposals ne les arrondit pas)
+        Proposal.objects.update(**{name: Round(F(name), 2) for name in
+                                   ('prime_seule_tarif_do', 'prime_seule_tarif_trc', 'prime_seule_tarif_duo')})
+        start = time.perf_counter()
+        reference = per_proposal_delta()
+        print(f"{'devis par devis (Decimal)':<34}: {(time.perf_counter() - start) * 1e3:8.1f} ms")
+
+        report = cold_simulation()
+        assert Decimal(report['total_duo_delta']) == reference, (report['total_duo_delta'], reference)
+        print(f"{'colonnes, lecture de la base':<34}: {timed(cold_simulation, args.repeat) * 1e3:8.1f} ms")
+        print(f"{'colonnes, portefeuille en mémoire':<34}: "
+              f"{timed(lambda: simulate_rates(Proposal.objects.all(), SEGMENTS), args.repeat) * 1e3:8.1f} ms")
+        print(f"{args.proposals} devis, {report['matched']} tarifés, écart DUO total {report['total_duo_delta']} €")
+
+
+if __name__ == '__main__':
+    main()
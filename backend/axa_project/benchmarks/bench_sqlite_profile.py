@@ -0,0 +1,115 @@
+"""
+Débit d'une charge mixte lectures / écritures concurrentes selon le profil de
+connexion SQLite (DATABASE_PROFILE 'basic' ou 'production').
+
+    python -m benchmarks.bench_sqlite_profile [--readers 4] [--writers 2] [--seconds 5]
+
+Les lecteurs lisent des pages de 50 devis (comme la liste paginée), les écrivains
+relisent puis modifient un devis dans une même transaction (comme les lots d'import
+et de retarification). En mode de transaction par défaut, deux transactions qui
+lisent puis écrivent se bloquent mutuellement et SQLite en fait échouer une aussitôt
+(« database is locked »), sans attendre busy_timeout. La base de test est un
+fichier : c'est le comportement du verrou de SQLite sur fichier que l'on mesure.
+"""
+import argparse
+import copy
+import random
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks.common import quiet, seed_proposals, test_database
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+
+from django_api.db_router import set_journal_mode
+from django_api.models import Proposal
+
+PAGE_SIZE = 50
+PAGE_FIELDS = ('id', 'opportunity_number', 'client_name', 'ouvrage_cost', 'prime_seule_tarif_duo', 'updated_at')
+# Copie : le profil actif partage ses dictionnaires avec les connexions, que configure() modifie
+PROFILES = copy.deepcopy(settings.DATABASE_PROFILES)
+
+
+def configure(profile):
+    """Applique les options du profil aux connexions ; renvoie l'alias des lectures."""
+    connections.close_all()
+    config = PROFILES[profile]
+    for alias in connections:
+        if alias in config:
+            connections[alias].settings_dict.update(
+                OPTIONS=config[alias].get('OPTIONS', {}),
+                CONN_MAX_AGE=config[alias].get('CONN_MAX_AGE', 0),
+                CONN_HEALTH_CHECKS=config[alias].get('CONN_HEALTH_CHECKS', False),
+            )
+    return 'readonly' if 'readonly' in config and 'readonly' in connections else 'default'
+
+
+def reader(alias, deadline, counts, errors):
+    try:
+        while time.monotonic() < deadline:
+            try:
+                list(Proposal.objects.using(alias).order_by('-updated_at', '-id').values(*PAGE_FIELDS)[:PAGE_SIZE])
+                counts.append(1)
+            except OperationalError as e:
+                errors.append(e)
+    finally:
+        connections.close_all()
+
+
+def writer(ids, deadline, durations, errors, seed):
+    rng = random.Random(seed)
+    try:
+        while time.monotonic() < deadline:
+            try:
+                start = time.perf_counter()
+                with transaction.atomic():
+                    proposal = Proposal.objects.get(pk=rng.choice(ids))
+                    proposal.ouvrage_cost += Decimal('100.00')
+                    proposal.save(user_ip='127.0.0.1')
+                durations.append(time.perf_counter() - start)
+            except OperationalError as e:
+                errors.append(e)
+    finally:
+        connections.close_all()
+
+
+def bench_profile(profile, args):
+    read_alias = configure(profile)
+    connections['default'].settings_dict['TEST']['NAME'] = 'bench_sqlite_profile.sqlite3'
+    with test_database():
+        # La migration 0009 passe toute base en WAL : le profil 'basic' est mesuré avec le journal par défaut
+        set_journal_mode(connections['default'], 'wal' if profile == 'production' else 'delete')
+        seed_proposals(args.proposals)
+        ids = list(Proposal.objects.values_list('pk', flat=True))
+        reads, durations, errors = [], [], []
+        deadline = time.monotonic() + args.seconds
+        pool = [threading.Thread(target=reader, args=(read_alias, deadline, reads, errors)) for _ in range(args.readers)]
+        pool += [threading.Thread(target=writer, args=(ids, deadline, durations, errors, index)) for index in range(args.writers)]
+        with quiet():
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+        connections.close_all()
+    durations.sort()
+    p95 = durations[int(len(durations) * 0.95) - 1] * 1e3 if durations else 0
+    print(f"{profile:<10}: {len(reads) / args.seconds:7.0f} lectures/s, {len(durations) / args.seconds:5.0f} écritures/s, "
+          f"p95 écriture {p95:6.2f} ms, {len(errors)} erreurs « database is locked »")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--proposals', type=int, default=2000)
+    args = parser.parse_args()
+
+    for profile in ('basic', 'production'):
+        bench_profile(profile, args)
+
+
+if __name__ == '__main__':
+    main()
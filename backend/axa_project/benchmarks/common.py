@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_main.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+
+@contextlib.contextmanager
+def test_database():
+    # Base de test jetable : les benchmarks ne touchent jamais à db.sqlite3
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    # Les connexions miroirs ('readonly') lisent la même base de test
+    for alias in connections:
+        if connections[alias].settings_dict['TEST'].get('MIRROR') == DEFAULT_DB_ALIAS:
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def random_proposal_values(index, rng):
+    guarantee_type = rng.choice(['DO', 'DUO', 'DUO'])
+    return {
+        'opportunity_number': f'BENCH{index:07d}',
+        'client_name': f'Client {rng.randrange(5000)}',
+        'guarantee_type': guarantee_type,
+        'ouvrage_destination': rng.choice(['HABITATION', 'HORS_HABITATION']),
+        'work_type': rng.choice(['NEUF', 'RENOVATIONLE', 'RENOVATIONLD']),
+        'ouvrage_cost': Decimal(rng.randrange(10_000_00, 5_000_000_00)) / 100,
+        'existing_presence': rng.random() < 0.3,
+        'is_vip_client': rng.random() < 0.1,
+        'rcmo_desired': rng.random() < 0.2,
+        'do_rate': Decimal(rng.randrange(50, 400)) / 10000,
+        'trc_rate': Decimal(rng.randrange(20, 200)) / 10000 if guarantee_type == 'DUO' else None,
+        'ouvrage_description': "Construction d'un ensemble de logements collectifs " * rng.randrange(1, 6),
+        'address_chantier': f'{rng.randrange(1, 200)} rue de la Paix 75002 Paris',
+    }
+
+
+def seed_proposals(count, seed=42):
+    from django_api.models import Proposal
+
+    rng = random.Random(seed)
+    proposals = []
+    for index in range(count):
+        proposal = Proposal(**random_proposal_values(index, rng))
+        # On reproduit le calcul des primes sans passer par save() pour aller vite
+        cost = proposal.ouvrage_cost
+        proposal.prime_seule_tarif_do = proposal.do_rate * cost
+        proposal.prime_seule_tarif_trc = proposal.trc_rate * cost if proposal.trc_rate is not None else None
+        proposal.prime_seule_tarif_duo = proposal.prime_seule_tarif_do + (proposal.prime_seule_tarif_trc or 0)
+        proposals.append(proposal)
+    Proposal.objects.bulk_create(proposals, batch_size=1000)
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,294 @@
+"""
+Index local d'adresses (Base Adresse Nationale) pour l'autocomplétion de l'adresse du
+chantier, sans appel à api-adresse.data.gouv.fr depuis le navigateur.
+
+`manage.py build_address_index adresses-75.csv.gz ...` construit, à partir des exports
+CSV de la BAN, un répertoire de tableaux numpy (ADDRESS_INDEX_DIR) :
+
+- tokens.npy : mots normalisés (sans accents ni casse), triés : les mots commençant
+  par un préfixe forment une plage contiguë, trouvée par dichotomie ;
+- token_offsets.npy, postings.npy : pour chaque mot, les numéros triés des adresses
+  qui le contiennent ;
+- latitudes.npy, longitudes.npy, record_offsets.npy, records.bin : coordonnées et
+  champs renvoyés de chaque adresse.
+
+Les fichiers sont ouverts en mémoire partagée (mmap) : les processus serveur se
+partagent les pages du cache système au lieu de charger chacun l'index. Une adresse
+correspond si elle contient tous les mots recherchés, le dernier pouvant être
+incomplet. Les voies sont aussi indexées sans numéro (au barycentre de leurs
+adresses) ; les résultats sont triés par distance au point `lat`/`lon` fourni.
+"""
+import csv
+import gzip
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from array import array
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+TOKEN_BYTES = 24
+DEFAULT_ADDRESS_LIMIT = 5
+MAX_ADDRESS_LIMIT = 20
+# Au-delà, un préfixe est vérifié sur l'union de ses listes plutôt que mot par mot
+MAX_PREFIX_TOKENS = 64
+# Recherche trop vague ("rue de") : on borne le travail plutôt que de parcourir la France
+MAX_CANDIDATES = 200_000
+RECORD_SEPARATOR = '\t'
+INDEX_ARRAYS = ('tokens', 'token_offsets', 'postings', 'latitudes', 'longitudes', 'record_offsets')
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize_tokens(text):
+    ascii_text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return [token[:TOKEN_BYTES] for token in re.findall(r'[a-z0-9]+', ascii_text)]
+
+
+def read_ban_rows(path):
+    """Lignes d'un export CSV de la BAN (séparateur point-virgule, éventuellement compressé)."""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as handle:
+        yield from csv.DictReader(handle, delimiter=';')
+
+
+class AddressIndexBuilder:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.records = open(os.path.join(directory, 'records.bin'), 'wb')
+        self.record_offsets = array('q', [0])
+        self.latitudes = array('f')
+        self.longitudes = array('f')
+        self.vocabulary = {}
+        # Couples (mot, adresse), stockés en tableaux compacts plutôt qu'en listes Python
+        self.pair_tokens = array('I')
+        self.pair_records = array('I')
+        self.streets = {}
+        self.addresses = 0
+        self.skipped = 0
+
+    def add_record(self, label, housenumber, street, postcode, city, latitude, longitude, keywords=''):
+        record_id = len(self.latitudes)
+        fields = (label, housenumber, street, postcode, city)
+        self.records.write(RECORD_SEPARATOR.join(field.replace(RECORD_SEPARATOR, ' ') for field in fields).encode())
+        self.record_offsets.append(self.records.tell())
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+        for token in set(normalize_tokens(f'{label} {keywords}')):
+            self.pair_tokens.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+            self.pair_records.append(record_id)
+
+    def add_row(self, row):
+        street = row.get('nom_voie') or row.get('nom_ld') or ''
+        postcode = row.get('code_postal') or ''
+        city = row.get('nom_commune') or ''
+        try:
+            latitude, longitude = float(row['lat']), float(row['lon'])
+        except (KeyError, TypeError, ValueError):
+            self.skipped += 1
+            return
+        if not street or not city:
+            self.skipped += 1
+            return
+        housenumber = f"{row.get('numero') or ''}{row.get('rep') or ''}"
+        label = f"{housenumber} {street} {postcode} {city}".strip()
+        # "12bis" se trouve aussi en tapant "12 bis"
+        keywords = f"{row.get('numero') or ''} {row.get('rep') or ''}"
+        self.add_record(label, housenumber, street, postcode, city, latitude, longitude, keywords)
+        self.addresses += 1
+        total = self.streets.setdefault((street, postcode, city), [0.0, 0.0, 0])
+        total[0] += latitude
+        total[1] += longitude
+        total[2] += 1
+
+    def finish(self, sources):
+        # Les voies (sans numéro) sont rangées après toutes les adresses
+        for (street, postcode, city), (latitude, longitude, count) in self.streets.items():
+            self.add_record(f"{street} {postcode} {city}", '', street, postcode, city, latitude / count, longitude / count)
+        self.records.close()
+
+        words = sorted(self.vocabulary)
+        rank = np.empty(len(words), dtype=np.uint32)
+        rank[[self.vocabulary[word] for word in words]] = np.arange(len(words), dtype=np.uint32)
+        pair_tokens = rank[np.frombuffer(self.pair_tokens, dtype=np.uint32)]
+        pair_records = np.frombuffer(self.pair_records, dtype=np.uint32)
+        order = np.lexsort((pair_records, pair_tokens))
+        counts = np.bincount(pair_tokens, minlength=len(words))
+
+        arrays = {
+            'tokens': np.array(words, dtype=f'S{TOKEN_BYTES}'),
+            'token_offsets': np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            'postings': pair_records[order],
+            'latitudes': np.frombuffer(self.latitudes, dtype=np.float32),
+            'longitudes': np.frombuffer(self.longitudes, dtype=np.float32),
+            'record_offsets': np.frombuffer(self.record_offsets, dtype=np.int64),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(self.directory, f'{name}.npy'), values)
+        meta = {
+            'addresses': self.addresses,
+            'streets': len(self.streets),
+            'tokens': len(words),
+            'skipped': self.skipped,
+            'sources': [os.path.basename(str(source)) for source in sources],
+            'built_at': timezone.now().isoformat(),
+        }
+        with open(os.path.join(self.directory, 'meta.json'), 'w', encoding='utf-8') as output:
+            json.dump(meta, output, ensure_ascii=False, indent=2)
+        return meta
+
+
+def build_address_index(sources, directory=None):
+    """Construit l'index dans un répertoire temporaire puis remplace l'ancien d'un coup."""
+    directory = str(directory or settings.ADDRESS_INDEX_DIR)
+    start = time.perf_counter()
+    building = f'{directory}.building'
+    shutil.rmtree(building, ignore_errors=True)
+    builder = AddressIndexBuilder(building)
+    for source in sources:
+        for row in read_ban_rows(source):
+            builder.add_row(row)
+    meta = builder.finish(sources)
+
+    # Les processus qui lisent l'ancien index gardent leurs fichiers ouverts jusqu'au rechargement
+    previous = f'{directory}.previous'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, previous)
+    os.rename(building, directory)
+    shutil.rmtree(previous, ignore_errors=True)
+    meta['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    return meta
+
+
+def _member(sorted_values, candidates):
+    """Masque des candidats présents dans un tableau trié."""
+    if not len(sorted_values):
+        return np.zeros(len(candidates), dtype=bool)
+    positions = np.searchsorted(sorted_values, candidates)
+    np.minimum(positions, len(sorted_values) - 1, out=positions)
+    return sorted_values[positions] == candidates
+
+
+class AddressIndex:
+    def __init__(self, directory, version):
+        self.version = version
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as handle:
+            self.meta = json.load(handle)
+        with open(os.path.join(directory, 'records.bin'), 'rb') as handle:
+            size = os.fstat(handle.fileno()).st_size
+            self.records = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def token_range(self, token, prefix):
+        key = token.encode()
+        lo = int(np.searchsorted(self.tokens, key, side='left'))
+        if prefix and len(key) < TOKEN_BYTES:
+            return lo, int(np.searchsorted(self.tokens, key + b'\xff', side='left'))
+        return lo, lo + 1 if lo < len(self.tokens) and self.tokens[lo] == key else lo
+
+    def postings_of(self, lo, hi):
+        return self.postings[self.token_offsets[lo]:self.token_offsets[hi]]
+
+    def candidates(self, query):
+        tokens = normalize_tokens(query)
+        if not tokens:
+            return np.empty(0, dtype=np.uint32), False
+        # Le dernier mot est en cours de frappe, sauf si la saisie se termine par un espace
+        prefix = None if query[-1:].isspace() else tokens.pop()
+        terms = [(*self.token_range(token, False), False) for token in dict.fromkeys(tokens)]
+        if prefix is not None:
+            terms.append((*self.token_range(prefix, True), True))
+        if any(lo == hi for lo, hi, _ in terms):
+            return np.empty(0, dtype=np.uint32), False
+
+        # On part du mot le plus rare, puis on ne garde que les adresses contenant les autres
+        terms.sort(key=lambda term: self.token_offsets[term[1]] - self.token_offsets[term[0]])
+        lo, hi, is_prefix = terms[0]
+        candidates = self.postings_of(lo, hi)
+        candidates = np.unique(candidates) if is_prefix else np.asarray(candidates)
+        candidates = candidates[:MAX_CANDIDATES]
+        for lo, hi, is_prefix in terms[1:]:
+            if not len(candidates):
+                break
+            if not is_prefix:
+                mask = _member(self.postings_of(lo, hi), candidates)
+            elif hi - lo <= MAX_PREFIX_TOKENS:
+                mask = np.zeros(len(candidates), dtype=bool)
+                for token in range(lo, hi):
+                    mask |= _member(self.postings_of(token, token + 1), candidates)
+            else:
+                mask = _member(np.unique(self.postings_of(lo, hi)), candidates)
+            candidates = candidates[mask]
+        has_number = any(token.isdigit() for token in tokens + ([prefix] if prefix else []))
+        return candidates, has_number
+
+    def record(self, record_id):
+        start, end = self.record_offsets[record_id], self.record_offsets[record_id + 1]
+        label, housenumber, street, postcode, city = self.records[start:end].decode().split(RECORD_SEPARATOR)
+        return {
+            'label': label,
+            'housenumber': housenumber or None,
+            'street': street,
+            'postcode': postcode,
+            'city': city,
+            'latitude': round(float(self.latitudes[record_id]), 6),
+            'longitude': round(float(self.longitudes[record_id]), 6),
+        }
+
+    def search(self, query, latitude=None, longitude=None, limit=DEFAULT_ADDRESS_LIMIT):
+        candidates, has_number = self.candidates(query)
+        if not len(candidates):
+            return []
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        if latitude is not None and longitude is not None:
+            # Distance équirectangulaire : suffisante pour classer des adresses proches
+            delta_lat = self.latitudes[candidates] - latitude
+            delta_lon = (self.longitudes[candidates] - longitude) * math.cos(math.radians(latitude))
+            scores += delta_lat.astype(np.float64) ** 2 + delta_lon.astype(np.float64) ** 2
+        if not has_number:
+            # Sans numéro saisi, les voies passent avant les adresses numérotées
+            scores += (candidates < self.meta['addresses']) * 1e6
+        if len(candidates) > limit:
+            best = np.argpartition(scores, limit)[:limit]
+            candidates, scores = candidates[best], scores[best]
+        return [self.record(int(record_id)) for record_id in candidates[np.argsort(scores, kind='stable')]]
+
+
+def get_address_index():
+    """Index courant, rouvert si `build_address_index` l'a reconstruit ; None s'il n'existe pas."""
+    global _index
+    directory = str(settings.ADDRESS_INDEX_DIR)
+    try:
+        version = os.stat(os.path.join(directory, 'meta.json')).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = AddressIndex(directory, version)
+        return _index
+
+
+def parse_coordinate(name, value, bound):
+    if value in (None, ''):
+        return None
+    try:
+        coordinate = float(value)
+    except ValueError:
+        raise ValidationError({name: "Coordonnée invalide."})
+    if not -bound <= coordinate <= bound:
+        raise ValidationError({name: "Coordonnée invalide."})
+    return coordinate
+
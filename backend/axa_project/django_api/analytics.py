@@ -0,0 +1,126 @@
+"""
+Analyses du portefeuille de devis, calculées sur les tables de synthèse.
+
+Les totaux (primes par type de garantie, destination et type de travaux, devis VIP
+et RCMO, tendance mensuelle) sont des GROUP BY sur ProposalSummary, tenue à jour
+par deltas à chaque écriture (cf. summaries.py) : quelques centaines de lignes au
+plus, quel que soit le nombre de devis. `rebuild_summaries` recalcule ces tables
+depuis les devis (reprise, contrôle d'écart).
+"""
+import time
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import TruncMonth
+from rest_framework.exceptions import ValidationError
+
+from .filters import BOOLEAN_FILTERS, CHOICE_FILTERS, FILTER_PARAMS, parse_boolean
+from .models import Proposal, ProposalSummary
+from .pricing import STORED_PREMIUM_PLACES
+from .repricing import cents_to_str, fixed_point
+from .summaries import GROUP_FIELDS, KEY_COLUMNS, MEASURE_FIELDS, TOTAL_COLUMNS
+
+BREAKDOWNS = ('guarantee_type', 'ouvrage_destination', 'work_type')
+MONTH_FILTERS = {'month_from': 'gte', 'month_to': 'lte'}
+
+
+def grouped_totals(queryset):
+    """Totaux par groupe calculés depuis les devis, au format des lignes de ProposalSummary."""
+    totals = {'proposal_count': Count('id')}
+    for name in MEASURE_FIELDS:
+        totals[f'{name}_cents'] = Sum(fixed_point(name, STORED_PREMIUM_PLACES), default=0)
+    return (queryset.order_by()
+            .values(month=TruncMonth('created_at', output_field=DateField()), *GROUP_FIELDS)
+            .annotate(**totals))
+
+
+def summary_drift(queryset=None):
+    """Groupes dont les totaux stockés diffèrent de ceux recalculés depuis les devis."""
+    queryset = Proposal.objects.all() if queryset is None else queryset
+    expected = {tuple(row[name] for name in KEY_COLUMNS): tuple(row[name] for name in TOTAL_COLUMNS)
+                for row in grouped_totals(queryset)}
+    stored = {tuple(row[:len(KEY_COLUMNS)]): tuple(row[len(KEY_COLUMNS):])
+              for row in ProposalSummary.objects.using(queryset.db).values_list(*KEY_COLUMNS, *TOTAL_COLUMNS)}
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def rebuild_summaries():
+    start = time.perf_counter()
+    with transaction.atomic():
+        drift = summary_drift()
+        ProposalSummary.objects.all().delete()
+        groups = ProposalSummary.objects.bulk_create(
+            ProposalSummary(**row) for row in grouped_totals(Proposal.objects.all())
+        )
+    return {
+        'groups': len(groups),
+        'drifted_groups': len(drift),
+        'elapsed_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def parse_month(name, value):
+    try:
+        return datetime.strptime(value.strip(), '%Y-%m').date()
+    except ValueError:
+        raise ValidationError({name: f"Mois invalide : '{value}' (format AAAA-MM)."})
+
+
+def filter_summaries(queryset, params):
+    # Mêmes filtres de choix et booléens que la liste, plus une plage de mois de création
+    unsupported = [name for name in FILTER_PARAMS
+                   if params.get(name) and name not in CHOICE_FILTERS and name not in GROUP_FIELDS]
+    if unsupported:
+        raise ValidationError({name: "Filtre non disponible pour les analyses." for name in unsupported})
+
+    for name, choices in CHOICE_FILTERS.items():
+        value = params.get(name, '')
+        if value:
+            if value not in choices:
+                raise ValidationError({name: f"Choix invalide : '{value}'."})
+            queryset = queryset.filter(**{name: value})
+
+    for name in BOOLEAN_FILTERS:
+        value = params.get(name, '')
+        if value and name in GROUP_FIELDS:
+            queryset = queryset.filter(**{name: parse_boolean(name, value)})
+
+    for name, lookup in MONTH_FILTERS.items():
+        value = params.get(name, '')
+        if value:
+            queryset = queryset.filter(**{f'month__{lookup}': parse_month(name, value)})
+    return queryset
+
+
+def _amounts(row):
+    result = {'count': row['proposal_count'] or 0}
+    for name in MEASURE_FIELDS:
+        result[name] = cents_to_str(row[f'{name}_cents'] or 0)
+    return result
+
+
+def portfolio_analytics(queryset):
+    """Totaux, répartitions et tendance mensuelle d'un queryset de ProposalSummary."""
+    queryset = queryset.order_by()
+    sums = {name: Sum(name) for name in TOTAL_COLUMNS}
+    totals = queryset.aggregate(
+        vip_count=Sum('proposal_count', filter=Q(is_vip_client=True), default=0),
+        rcmo_count=Sum('proposal_count', filter=Q(rcmo_desired=True), default=0),
+        **sums,
+    )
+    data = {
+        'total': _amounts(totals),
+        'vip_count': totals['vip_count'],
+        'rcmo_count': totals['rcmo_count'],
+    }
+    for field_name in BREAKDOWNS:
+        data[f'by_{field_name}'] = [
+            {field_name: row[field_name], **_amounts(row)}
+            for row in queryset.values(field_name).annotate(**sums).order_by(field_name)
+        ]
+    data['monthly'] = [
+        {'month': row['month'].strftime('%Y-%m'), **_amounts(row)}
+        for row in queryset.values('month').annotate(**sums).order_by('month')
+    ]
+    return data
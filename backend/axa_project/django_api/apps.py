@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class ProposalManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'django_api'
+
+    def ready(self):
+        from . import changes, document_cache, response_cache, summaries
+        from .models import Proposal
+        from .signals import proposal_changed
+
+        proposal_changed.connect(document_cache.invalidate_on_change, sender=Proposal, dispatch_uid='document_cache_change')
+        post_delete.connect(document_cache.invalidate_on_delete, sender=Proposal, dispatch_uid='document_cache_delete')
+        proposal_changed.connect(response_cache.invalidate_on_change, sender=Proposal, dispatch_uid='response_cache_change')
+        post_delete.connect(response_cache.invalidate_on_delete, sender=Proposal, dispatch_uid='response_cache_delete')
+        post_delete.connect(summaries.remove_on_delete, sender=Proposal, dispatch_uid='summaries_delete')
+        proposal_changed.connect(changes.publish_on_change, sender=Proposal, dispatch_uid='change_feed_change')
+        post_delete.connect(changes.publish_on_delete, sender=Proposal, dispatch_uid='change_feed_delete')
@@ -0,0 +1,94 @@
+"""
+Reconstruction d'un devis tel qu'il était à une date donnée.
+
+On part de l'instantané le plus récent antérieur à la date (cf. history.py) et on
+rejoue vers l'avant les différences enregistrées depuis : au plus
+`HISTORY_SNAPSHOT_INTERVAL - 1` entrées, quelle que soit la longueur de l'historique.
+Pour un historique antérieur aux instantanés, on part à l'inverse du premier
+instantané postérieur (ou de l'état actuel) et on annule les différences en remontant.
+Les dates antérieures à l'historique archivé sont refusées ; les journées regroupées
+par la rétention ne sont reconstruites qu'à la résolution de la journée.
+"""
+from datetime import datetime, time
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .history import SNAPSHOT_FIELDS, apply_changes, proposal_snapshot
+from .models import Proposal, ProposalHistory
+from .retention import archived_before
+
+
+def parse_as_of(value):
+    """Date ISO (fin de journée) ou date et heure ISO ; None si absent."""
+    if not value:
+        return None
+    try:
+        # Date seule d'abord : parse_datetime l'accepterait aussi, mais comme minuit
+        day = parse_date(value)
+        moment = datetime.combine(day, time.max) if day else parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError({'as_of': "Date invalide (format AAAA-MM-JJ ou AAAA-MM-JJTHH:MM)."})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _after(entry):
+    return Q(timestamp__gt=entry.timestamp) | Q(timestamp=entry.timestamp, id__gt=entry.id)
+
+
+def _until(entry):
+    return Q(timestamp__lt=entry.timestamp) | Q(timestamp=entry.timestamp, id__lte=entry.id)
+
+
+def proposal_as_of(proposal, moment):
+    """
+    Renvoie une instance non enregistrée du devis tel qu'il était à `moment`, ou None
+    si le devis n'existait pas encore. L'instance ne doit pas être sauvegardée.
+    """
+    if proposal.created_at > moment:
+        return None
+    limit = archived_before()
+    if limit is not None and moment < limit:
+        # Les différences nécessaires ne sont plus dans la table (cf. retention.py)
+        raise ValidationError({'as_of': f"L'historique antérieur au {timezone.localtime(limit):%d/%m/%Y} est archivé."})
+
+    entries = ProposalHistory.objects.filter(proposal=proposal).only('id', 'timestamp', 'changes', 'snapshot')
+    base = (entries.filter(timestamp__lte=moment, snapshot__isnull=False)
+            .order_by('-timestamp', '-id').first())
+    if base is not None:
+        state = dict(base.snapshot)
+        updated_at = base.timestamp
+        for entry in entries.filter(_after(base), timestamp__lte=moment).order_by('timestamp', 'id'):
+            apply_changes(state, entry.changes, 'new')
+            updated_at = entry.timestamp
+    else:
+        anchor = (entries.filter(timestamp__gt=moment, snapshot__isnull=False)
+                  .order_by('timestamp', 'id').first())
+        later = entries.filter(timestamp__gt=moment)
+        if anchor is not None:
+            state = dict(anchor.snapshot)
+            later = later.filter(_until(anchor))
+        else:
+            state = proposal_snapshot(proposal)
+        for entry in later.order_by('-timestamp', '-id'):
+            apply_changes(state, entry.changes, 'old')
+        last = entries.filter(timestamp__lte=moment).order_by('-timestamp', '-id').values_list('timestamp', flat=True).first()
+        updated_at = last or proposal.created_at
+
+    # Champ ajouté après l'instantané : on garde la valeur actuelle
+    values = proposal_snapshot(proposal)
+    values.update({name: value for name, value in state.items() if name in SNAPSHOT_FIELDS})
+    historical = Proposal(
+        id=proposal.pk,
+        created_at=proposal.created_at,
+        updated_at=updated_at,
+        **values,
+    )
+    historical._state.adding = False
+    return historical
@@ -0,0 +1,267 @@
+"""
+Vues asynchrones pour le service ASGI (`uvicorn django_main.asgi:application`).
+
+Liste, détail et historique des devis sont lus par l'ORM asynchrone de Django, avec
+les mêmes filtres, le même tri, la même pagination par curseur, la même lecture
+rapide de la liste (cf. projection.py) et le même cache de réponses que
+`ProposalViewSet` (sous des clés distinctes, les liens de pagination n'ayant pas la
+même URL). Sous ASGI, une requête qui attend la base ou un rendu
+n'immobilise pas de thread du serveur.
+
+Les documents sont rendus par un pool de threads borné (ASYNC_DOCUMENT_WORKERS).
+Les demandes au-delà attendent leur tour dans la file du pool, et au-delà de
+ASYNC_DOCUMENT_MAX_PENDING demandes en attente, la vue répond 503 avec un
+Retry-After au lieu d'empiler le travail. Sous ASGI, les fichiers sont envoyés par
+morceaux depuis un itérateur asynchrone : la réponse ne charge jamais le document
+entier en mémoire.
+
+Le flux des modifications (cf. changes.py) y est servi en long polling et en
+Server-Sent Events : un client en attente ne coûte qu'une tâche de la boucle.
+
+Sous WSGI, ces vues fonctionnent aussi (Django les exécute dans une boucle
+d'événements par requête), sans le bénéfice de la concurrence. Seul le flux SSE,
+qui ne se termine jamais, y est refusé.
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .as_of import parse_as_of, proposal_as_of
+from .changes import aread_changes, feed_params, sse_stream
+from .db_router import read_database
+from .document_cache import document_etag, not_modified_response, open_document
+from .documents import DOCUMENT_FORMATS, document_filename
+from .filters import filter_proposals, get_ordering, order_proposals
+from .models import DocumentJob, Proposal, ProposalHistory
+from .pagination import HistoryCursorPagination, ProposalCursorPagination
+from .projection import parse_fields, project_rows, proposal_values
+from .response_cache import acached_response, normalized_params
+from .retention import archived_entries
+from .serializers import ProposalHistorySerializer, ProposalSerializer
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+class RenderPool:
+    """Pool de threads borné pour le rendu des documents, avec refus au-delà d'une file maximale."""
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-document')
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.workers + self.max_pending:
+                raise RenderQueueFull()
+            self.pending += 1
+        try:
+            # Annulée (client parti), une demande encore en file n'est jamais rendue
+            return await asyncio.wrap_future(self.executor.submit(func, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = RenderPool(settings.ASYNC_DOCUMENT_WORKERS, settings.ASYNC_DOCUMENT_MAX_PENDING)
+        return _render_pool
+
+
+def render_pool_pending():
+    return _render_pool.pending if _render_pool is not None else 0
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status_code)
+
+
+def api_errors(view):
+    # Erreurs de validation et 404 au même format JSON que les vues DRF
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return json_response({'detail': 'Méthode non autorisée.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+        try:
+            return await view(Request(request), *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(data, exc.status_code)
+    return wrapper
+
+
+async def get_proposal(pk):
+    proposal = await Proposal.objects.filter(pk=pk).afirst()
+    if proposal is None:
+        raise NotFound()
+    return proposal
+
+
+async def iter_file(document):
+    try:
+        while chunk := await asyncio.to_thread(document.read, CHUNK_SIZE):
+            yield chunk
+    finally:
+        document.close()
+
+
+def file_response(request, document, content_type, filename):
+    if isinstance(request._request, ASGIRequest):
+        response = StreamingHttpResponse(iter_file(document), content_type=content_type)
+        response['Content-Length'] = str(os.fstat(document.fileno()).st_size)
+    else:
+        # Sous WSGI, un itérateur asynchrone serait lu en entier avant l'envoi
+        response = FileResponse(document, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_errors
+async def proposal_list(request):
+    async def build():
+        fields = parse_fields(request.query_params.get('fields'))
+        field, descending = get_ordering(request.query_params)
+        queryset = filter_proposals(Proposal.objects.using(read_database()), request.query_params)
+        queryset = order_proposals(queryset, field, descending)
+        paginator = ProposalCursorPagination()
+        page = await paginator.apaginate_queryset(proposal_values(queryset, fields, extra=('id', field)), request)
+        if page is None:
+            return project_rows([row async for row in proposal_values(queryset, fields)], fields)
+        return paginator.get_paginated_response(project_rows(page, fields)).data
+
+    return await acached_response(request, ('async-list', None, normalized_params(request.query_params)), build)
+
+
+@api_errors
+async def proposal_changes(request):
+    since, wait, limit = feed_params(request.query_params)
+    return json_response(await aread_changes(since, wait, limit))
+
+
+@api_errors
+async def proposal_change_stream(request):
+    if not isinstance(request._request, ASGIRequest):
+        return json_response({'error': "Le flux SSE n'est servi que sous ASGI ; utiliser /api/proposals/changes/?wait=..."},
+                             status.HTTP_400_BAD_REQUEST)
+    since, _, limit = feed_params(request.query_params)
+    # EventSource renvoie le dernier id reçu à la reconnexion
+    response = StreamingHttpResponse(sse_stream(since or request.headers.get('Last-Event-ID'), limit),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_errors
+async def proposal_detail(request, pk):
+    as_of = parse_as_of(request.query_params.get('as_of'))
+    if as_of is not None:
+        proposal = await sync_to_async(proposal_as_of)(await get_proposal(pk), as_of)
+        if proposal is None:
+            return json_response({'error': "Le devis n'existait pas à cette date."}, status.HTTP_404_NOT_FOUND)
+        return json_response(ProposalSerializer(proposal).data)
+
+    async def build():
+        return ProposalSerializer(await get_proposal(pk)).data
+
+    return await acached_response(request, ('async-retrieve', pk, normalized_params(request.query_params)), build)
+
+
+@api_errors
+async def proposal_history(request, pk):
+    proposal = await get_proposal(pk)
+    archive = request.query_params.get('archive')
+    if archive:
+        try:
+            month = datetime.strptime(archive, '%Y-%m').date()
+        except ValueError:
+            return json_response({'error': "Mois d'archive invalide (format AAAA-MM)."}, status.HTTP_400_BAD_REQUEST)
+        entries = await sync_to_async(archived_entries)(proposal, month)
+        return json_response({'next': None, 'results': ProposalHistorySerializer(entries, many=True).data})
+
+    paginator = HistoryCursorPagination()
+    entries = await paginator.apaginate_queryset(
+        ProposalHistory.objects.filter(proposal=proposal).order_by('-timestamp', '-id'), request
+    )
+    for entry in entries:
+        entry.proposal = proposal
+    return json_response(paginator.get_paginated_response(ProposalHistorySerializer(entries, many=True).data).data)
+
+
+@api_errors
+async def proposal_document(request, pk):
+    # Équivalent GET de generate-document : ?doc_type=pdf|word[&as_of=...]
+    doc_type = request.query_params.get('doc_type', 'pdf')
+    if doc_type not in DOCUMENT_FORMATS:
+        return json_response({'error': 'Type de document non supporté.'}, status.HTTP_400_BAD_REQUEST)
+    proposal = await get_proposal(pk)
+    content_type, _, label = DOCUMENT_FORMATS[doc_type]
+    generated_at = datetime.now()
+    as_of = parse_as_of(request.query_params.get('as_of'))
+    if as_of is not None:
+        proposal = await sync_to_async(proposal_as_of)(proposal, as_of)
+        if proposal is None:
+            return json_response({'error': "Le devis n'existait pas à cette date."}, status.HTTP_404_NOT_FOUND)
+        generated_at = timezone.localtime(as_of).replace(tzinfo=None)
+    etag = document_etag(proposal, doc_type, generated_at)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        document, _ = await get_render_pool().run(open_document, proposal, doc_type, generated_at)
+    except RenderQueueFull:
+        response = json_response({'error': "Trop de documents en cours de génération, réessayer dans un instant."},
+                                 status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = '1'
+        return response
+    except Exception as e:
+        logger.exception("Échec de la génération du document", extra={'proposal_id': proposal.pk, 'doc_type': doc_type})
+        return json_response({'error': f"Erreur lors de la génération {label}: {str(e)}"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    response = file_response(request, document, content_type, document_filename(proposal, doc_type, generated_at))
+    response['ETag'] = etag
+    return response
+
+
+@api_errors
+async def document_job_download(request, pk):
+    job = await DocumentJob.objects.filter(pk=pk).afirst()
+    if job is None:
+        raise NotFound()
+    if job.status != DocumentJob.STATUS_DONE:
+        return json_response({'error': "Le document n'est pas encore disponible.", 'status': job.status}, status.HTTP_409_CONFLICT)
+    try:
+        document = await asyncio.to_thread(open, job.file_path, 'rb')
+    except FileNotFoundError:
+        return json_response({'error': "Le document généré n'existe plus."}, status.HTTP_410_GONE)
+    return file_response(request, document, DOCUMENT_FORMATS[job.doc_type][0], job.filename)
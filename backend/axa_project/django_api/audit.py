@@ -0,0 +1,170 @@
+"""
+Écriture de l'historique des devis, immédiate ou différée.
+
+En mode 'sync' (par défaut, cf. HISTORY_AUDIT_MODE), `Proposal.save` insère son
+entrée d'historique dans sa propre transaction. En mode 'queue', l'entrée est placée,
+une fois la transaction validée, dans une file en mémoire : un thread d'écriture la
+vide par lots (`bulk_create`) dès que HISTORY_AUDIT_BATCH_SIZE entrées attendent ou
+que HISTORY_AUDIT_FLUSH_SECONDS se sont écoulées depuis la plus ancienne, et draine
+la file à l'arrêt du processus. La requête ne tient plus le verrou d'écriture de
+SQLite que pour la mise à jour du devis ; en contrepartie, l'historique (et `as_of`)
+a jusqu'à HISTORY_AUDIT_FLUSH_SECONDS de retard, et un processus tué brutalement
+perd les entrées encore en file.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+WRITE_ATTEMPTS = 3
+
+_STOP = object()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class AuditWriter:
+    def __init__(self, batch_size, flush_seconds, max_pending):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        # File pleine : l'appelant attend plutôt que de perdre des entrées
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name='history-audit', daemon=True)
+        self._thread.start()
+
+    def put(self, entry):
+        self.queue.put(entry)
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self):
+        """Attend une première entrée, puis complète le lot jusqu'à la taille ou au délai."""
+        batch = []
+        stopping = False
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self.queue.task_done()
+                stopping = True
+                break
+            batch.append(entry)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_seconds
+        return batch, stopping
+
+    def _run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if stopping:
+                    # Arrêt : les entrées arrivées avant le signal sont écrites aussi
+                    while True:
+                        try:
+                            batch.append(self.queue.get_nowait())
+                        except queue.Empty:
+                            break
+                if batch:
+                    try:
+                        self.write(batch)
+                    except Exception:
+                        # Une erreur inattendue ne doit ni tuer le thread ni bloquer flush_history
+                        logger.exception("Historique : échec de l'écriture d'un lot", extra={'entries': len(batch)})
+                        self.dropped += len(batch)
+                    finally:
+                        for _ in batch:
+                            self.queue.task_done()
+        finally:
+            connection.close()
+
+    def write(self, batch):
+        from .models import Proposal, ProposalHistory
+
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                try:
+                    with transaction.atomic():
+                        ProposalHistory.objects.bulk_create(batch)
+                except IntegrityError:
+                    # Devis supprimé avant l'écriture de son historique : ses entrées sont abandonnées
+                    existing = set(Proposal.objects.filter(pk__in={entry.proposal_id for entry in batch})
+                                   .values_list('pk', flat=True))
+                    kept = [entry for entry in batch if entry.proposal_id in existing]
+                    ProposalHistory.objects.bulk_create(kept)
+                    self.dropped += len(batch) - len(kept)
+                    batch = kept
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except DatabaseError as e:
+                # Base verrouillée par un autre écrivain : on réessaie un peu plus tard
+                if attempt == WRITE_ATTEMPTS:
+                    logger.error("Historique : entrées non écrites", extra={'entries': len(batch), 'error': str(e)})
+                    self.dropped += len(batch)
+                    return
+                time.sleep(0.5 * attempt)
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(
+                batch_size=settings.HISTORY_AUDIT_BATCH_SIZE,
+                flush_seconds=settings.HISTORY_AUDIT_FLUSH_SECONDS,
+                max_pending=settings.HISTORY_AUDIT_MAX_PENDING,
+            )
+            atexit.register(shutdown_writer)
+        return _writer
+
+
+def shutdown_writer():
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+
+def record_history(entry):
+    if settings.HISTORY_AUDIT_MODE != 'queue':
+        entry.save()
+        return
+    # Jamais d'historique pour une modification annulée
+    transaction.on_commit(lambda: get_writer().put(entry))
+
+
+def flush_history():
+    """Attend que toutes les entrées en file soient écrites (tests, commandes)."""
+    writer = _writer
+    if writer is not None:
+        writer.queue.join()
+
+
+def audit_stats():
+    writer = _writer
+    return {
+        'mode': settings.HISTORY_AUDIT_MODE,
+        'queue_depth': writer.queue.qsize() if writer else 0,
+        'written': writer.written if writer else 0,
+        'dropped': writer.dropped if writer else 0,
+        'batches': writer.batches if writer else 0,
+    }
@@ -0,0 +1,179 @@
+"""
+Créations, modifications partielles et suppressions de devis par lots
+(`POST /api/proposals/bulk/`).
+
+Chaque élément est validé par le même sérialiseur que l'API unitaire et tarifé par
+`price_instance`, comme dans `Proposal.save`. Les devis visés sont lus en une
+requête, et l'unicité des numéros d'opportunité est vérifiée pour tout le lot en une
+autre. Le lot est tout ou rien : au moindre élément invalide, rien n'est écrit et le
+rapport donne le résultat de chaque élément. Sinon, tout est enregistré dans une même
+transaction : les suppressions, puis les mêmes écritures groupées que l'import
+(cf. imports.write_proposals) pour les créations, les modifications, leur historique
+et les tables de synthèse.
+"""
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .imports import store_premiums, write_proposals
+from .models import Proposal
+from .pricing import price_instance
+from .serializers import ProposalBatchItemSerializer, ProposalSerializer
+from .summaries import collect_deletes
+
+KEY_FIELD = 'opportunity_number'
+# Modification partielle : la ligne entière est réécrite, un seul UPDATE pour tout le lot
+UPDATE_FIELDS = [field.name for field in Proposal._meta.concrete_fields if field.name not in ('id', 'created_at')]
+
+NOT_FOUND = ["Devis introuvable."]
+DUPLICATE = ["Devis présent plusieurs fois dans le lot."]
+
+
+def item_error(errors, pk=None):
+    return {'status': 'error', 'id': pk, 'errors': errors}
+
+
+def prepare(validator, item, instance=None):
+    """Valide l'élément, applique ses valeurs au devis et le tarife ; renvoie (devis, erreurs)."""
+    try:
+        values = validator.run_validation(item)
+    except ValidationError as exc:
+        return None, exc.detail
+    instance = instance or Proposal()
+    for attr, value in values.items():
+        setattr(instance, attr, value)
+    price_instance(instance)
+    return instance, store_premiums(instance)
+
+
+class ProposalBatch:
+    def __init__(self, dry_run=False, user_ip=None):
+        self.dry_run = dry_run
+        self.user_ip = user_ip
+        # Un sérialiseur par type d'opération, réutilisé pour chaque élément (comme ListSerializer) :
+        # ses champs ne sont construits qu'une fois
+        self.create_validator = ProposalBatchItemSerializer()
+        self.update_validator = ProposalBatchItemSerializer(partial=True)
+        self.report = {
+            'dry_run': dry_run,
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'deleted': 0,
+            'failed': 0,
+            'results': {'create': [], 'update': [], 'delete': []},
+        }
+
+    def run(self, creates, updates, deletes):
+        results = self.report['results']
+        with transaction.atomic():
+            requested = [item.get('id') for item in updates] + deletes
+            self.existing = Proposal.objects.in_bulk([pk for pk in requested if type(pk) is int])
+
+            results['delete'] = self.check_deletes(deletes)
+            results['update'], updated = self.prepare_updates(updates, set(deletes))
+            results['create'], created = self.prepare_creates(creates)
+            self.check_numbers(updated + created, set(deletes))
+
+            self.report['failed'] = sum(result['status'] == 'error' for items in results.values() for result in items)
+            if self.report['failed']:
+                # Tout ou rien : les éléments valides ne sont pas écrits non plus
+                return self.report
+
+            if not self.dry_run:
+                with transaction.atomic():
+                    if deletes:
+                        with collect_deletes():
+                            Proposal.objects.filter(pk__in=deletes).delete()
+                    write_proposals(
+                        [instance for _, instance in created],
+                        [(instance, result['changes']) for result, instance in updated if result['changes']],
+                        UPDATE_FIELDS,
+                        self.user_ip,
+                    )
+
+        proposals = iter(ProposalSerializer([instance for _, instance in created + updated], many=True).data)
+        for result, instance in created:
+            result.update(status='created', id=instance.pk, proposal=next(proposals))
+        for result, instance in updated:
+            result.update(status='updated' if result['changes'] else 'unchanged', proposal=next(proposals))
+        for result in results['delete'] + results['update'] + results['create']:
+            self.report[result['status']] += 1
+        return self.report
+
+    def check_deletes(self, deletes):
+        seen = set()
+        results = []
+        for pk in deletes:
+            if pk in seen:
+                results.append(item_error({'id': DUPLICATE}, pk))
+            elif pk not in self.existing:
+                results.append(item_error({'id': NOT_FOUND}, pk))
+            else:
+                results.append({'status': 'deleted', 'id': pk})
+            seen.add(pk)
+        return results
+
+    def prepare_updates(self, updates, deleted):
+        seen = set()
+        results = []
+        updated = []
+        for item in updates:
+            pk = item.get('id')
+            if type(pk) is not int:
+                results.append(item_error({'id': ["Identifiant de devis requis."]}))
+                continue
+            if pk in seen or pk in deleted:
+                results.append(item_error({'id': DUPLICATE}, pk))
+                continue
+            seen.add(pk)
+            if pk not in self.existing:
+                results.append(item_error({'id': NOT_FOUND}, pk))
+                continue
+            data = {name: value for name, value in item.items() if name != 'id'}
+            instance, errors = prepare(self.update_validator, data, self.existing[pk])
+            if errors:
+                results.append(item_error(errors, pk))
+                continue
+            changes = instance.get_changes(instance.get_loaded_values())
+            if changes:
+                instance.history_version += 1
+            result = {'status': 'valid', 'id': pk, 'changes': changes}
+            results.append(result)
+            updated.append((result, instance))
+        return results, updated
+
+    def prepare_creates(self, creates):
+        results = []
+        created = []
+        for item in creates:
+            instance, errors = prepare(self.create_validator, item)
+            if errors:
+                results.append(item_error(errors))
+                continue
+            result = {'status': 'valid', 'id': None}
+            results.append(result)
+            created.append((result, instance))
+        return results, created
+
+    def check_numbers(self, items, deleted):
+        """Numéros d'opportunité en double dans le lot ou déjà pris par un devis qui n'est pas supprimé."""
+        # Un devis modifié qui garde son numéro n'est pas vérifié
+        items = [(result, instance) for result, instance in items
+                 if instance.pk is None or instance.get_loaded_values()[KEY_FIELD] != instance.opportunity_number]
+        if not items:
+            return
+        owners = dict(Proposal.objects.filter(opportunity_number__in=[instance.opportunity_number for _, instance in items])
+                      .values_list(KEY_FIELD, 'id'))
+        seen = set()
+        for result, instance in items:
+            number = instance.opportunity_number
+            owner = owners.get(number)
+            if number in seen:
+                result.update(item_error({KEY_FIELD: ["Numéro d'opportunité en double dans le lot."]}, instance.pk))
+            elif owner is not None and owner != instance.pk and owner not in deleted:
+                result.update(item_error({KEY_FIELD: ["Un devis avec ce numéro d'opportunité existe déjà."]}, instance.pk))
+            seen.add(number)
+
+
+def apply_batch(creates=(), updates=(), deletes=(), dry_run=False, user_ip=None):
+    return ProposalBatch(dry_run=dry_run, user_ip=user_ip).run(list(creates), list(updates), list(deletes))
@@ -0,0 +1,52 @@
+from django.db import connections, router
+
+
+def bulk_update_rows(model, rows, fields, using=None):
+    """
+    Met à jour des lignes par clé primaire avec un seul `UPDATE ... WHERE pk = %s`
+    exécuté via `executemany`. `rows` est une séquence de (pk, {champ: valeur}).
+
+    Équivalent à `QuerySet.bulk_update` pour des valeurs littérales, mais sans
+    construire une expression CASE WHEN par ligne et par champ, ce qui coûte
+    l'essentiel du temps de `bulk_update` sur des lots de plusieurs milliers de lignes.
+    """
+    if not rows:
+        return 0
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    pk_field = model._meta.pk
+
+    assignments = ', '.join(f'{quote(field.column)} = %s' for field in model_fields)
+    sql = f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE {quote(pk_field.column)} = %s'
+    params = [
+        [field.get_db_prep_save(values[field.name], connection) for field in model_fields]
+        + [pk_field.get_db_prep_value(pk, connection)]
+        for pk, values in rows
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+    return len(params)
+
+
+def bulk_insert_rows(model, rows, fields, using=None):
+    """
+    Insère des lignes avec un seul `INSERT` exécuté via `executemany`. `rows` est une
+    séquence de {champ: valeur} ; les valeurs par défaut et `auto_now` ne sont pas
+    appliquées, et les clés primaires créées ne sont pas renvoyées.
+    """
+    if not rows:
+        return 0
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+
+    columns = ', '.join(quote(field.column) for field in model_fields)
+    placeholders = ', '.join(['%s'] * len(model_fields))
+    sql = f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+    params = [[field.get_db_prep_save(values[field.name], connection) for field in model_fields] for values in rows]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+    return len(params)
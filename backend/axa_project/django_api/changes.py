@@ -0,0 +1,279 @@
+"""
+Flux des modifications de devis, pour tenir un tableau de bord à jour sans relire
+toute la liste.
+
+Chaque création, modification ou suppression validée est ajoutée à un tampon
+circulaire en mémoire (CHANGE_FEED_SIZE derniers changements). Les créations et
+modifications viennent du signal `proposal_changed`, envoyé là où l'historique est
+écrit (Proposal.save, imports, lots, retarification), et les suppressions de
+`post_delete`. Un changement porte les champs modifiés, avec leurs nouvelles valeurs
+au format de l'API (tous les champs pour une création), et un curseur. Le client
+reprend avec `since=<curseur>` et n'applique que les changements suivants.
+
+Deux façons de lire le flux :
+- `GET /api/proposals/changes/?since=...&wait=25` répond dès qu'un changement
+  arrive, ou au bout de `wait` secondes avec une liste vide. Sous ASGI,
+  `/api/async/proposals/changes/` fait de même sans occuper de thread ;
+- `GET /api/async/proposals/changes/stream/?since=...` (ASGI seulement) ouvre un
+  flux Server-Sent Events. Chaque message a le curseur pour `id:`, si bien
+  qu'EventSource reprend seul via Last-Event-ID après une coupure ou la fin du
+  flux, au bout de CHANGE_FEED_STREAM_SECONDS.
+
+Le curseur commence par l'identifiant du processus. Après un redémarrage, ou si le
+client a plus de CHANGE_FEED_SIZE changements de retard, la réponse indique
+`reset` : le client relit la liste, puis reprend au curseur renvoyé. Le diffuseur
+vit dans le processus, sans courtier externe. Avec plusieurs processus serveur,
+chacun ne diffuse que ses propres écritures.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .projection import LIST_FIELDS
+
+CREATED, UPDATED, DELETED = 'created', 'updated', 'deleted'
+# Modifiés à chaque écriture, absents des différences de l'historique
+WRITE_FIELDS = ('updated_at', 'history_version')
+
+_representation_fields = None
+
+
+def representation_fields():
+    global _representation_fields
+    if _representation_fields is None:
+        from .serializers import ProposalSerializer
+        _representation_fields = ProposalSerializer().fields
+    return _representation_fields
+
+
+class Change:
+    """Un changement du tampon. Les valeurs sont relevées à l'écriture, et le JSON n'est rendu qu'à la première lecture."""
+    __slots__ = ('sequence', 'cursor', 'kind', 'pk', 'timestamp', 'values', '_data', '_payload')
+
+    def __init__(self, sequence, cursor, kind, pk, timestamp, values):
+        self.sequence = sequence
+        self.cursor = cursor
+        self.kind = kind
+        self.pk = pk
+        self.timestamp = timestamp
+        self.values = values
+        self._data = None
+        self._payload = None
+
+    def data(self):
+        if self._data is None:
+            self._data = self.render()
+        return self._data
+
+    def render(self):
+        fields = representation_fields()
+        return {
+            'cursor': self.cursor,
+            'type': self.kind,
+            'id': self.pk,
+            'timestamp': fields['updated_at'].to_representation(self.timestamp),
+            'fields': {name: None if value is None else fields[name].to_representation(value)
+                       for name, value in self.values.items()},
+        }
+
+    def payload(self):
+        if self._payload is None:
+            self._payload = json.dumps(self.data(), ensure_ascii=False, separators=(',', ':'))
+        return self._payload
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
+
+
+class ChangeFeed:
+    def __init__(self, size):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.changes = deque(maxlen=size)
+        self.sequence = 0
+        self._condition = threading.Condition()
+        # Clients asynchrones en attente : (boucle d'événements, asyncio.Event)
+        self._waiters = set()
+
+    def cursor(self, sequence):
+        return f'{self.epoch}-{sequence}'
+
+    def publish(self, kind, pk, values):
+        with self._condition:
+            self.sequence += 1
+            self.changes.append(Change(self.sequence, self.cursor(self.sequence), kind, pk, timezone.now(), values))
+            self._condition.notify_all()
+            waiters = list(self._waiters)
+        # Un seul réveil par boucle d'événements, quel que soit le nombre de clients qui y attendent
+        events = defaultdict(list)
+        for loop, event in waiters:
+            events[loop].append(event)
+        for loop, loop_events in events.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, loop_events)
+            except RuntimeError:
+                # Boucle fermée : ses clients sont partis
+                self._waiters.difference_update((loop, event) for event in loop_events)
+
+    def position(self, since):
+        """Numéro du dernier changement déjà reçu, ou None si le client doit tout relire."""
+        epoch, _, sequence = since.partition('-')
+        if not sequence.isdigit():
+            raise ValidationError({'since': "Curseur invalide."})
+        sequence = int(sequence)
+        oldest = self.changes[0].sequence if self.changes else self.sequence + 1
+        if epoch != self.epoch or sequence > self.sequence or sequence < oldest - 1:
+            return None
+        return sequence
+
+    def read(self, since, limit):
+        """(changements, curseur de reprise, reset) ; sans `since`, seulement le curseur courant."""
+        with self._condition:
+            position = self.position(since) if since else None
+            if position is None:
+                return [], self.cursor(self.sequence), bool(since)
+            start = position - self.changes[0].sequence + 1 if self.changes else 0
+            changes = list(itertools.islice(self.changes, start, start + limit))
+            return changes, changes[-1].cursor if changes else since, False
+
+    def has_changes_after(self, since):
+        with self._condition:
+            return self._has_changes_after(since)
+
+    def _has_changes_after(self, since):
+        # Curseur à relire (reset) : la réponse part sans attendre
+        position = self.position(since)
+        return position is None or position < self.sequence
+
+    def wait(self, since, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._has_changes_after(since), timeout)
+
+    async def await_changes(self, since, timeout):
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        self._waiters.add(waiter)
+        try:
+            if not self.has_changes_after(since):
+                await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.discard(waiter)
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get_feed():
+    global _feed
+    with _feed_lock:
+        if _feed is None:
+            _feed = ChangeFeed(settings.CHANGE_FEED_SIZE)
+        return _feed
+
+
+def change_values(instance, created, changes):
+    if created:
+        names = LIST_FIELDS
+    else:
+        names = [name for name in LIST_FIELDS if name in changes or name in WRITE_FIELDS]
+    return {name: getattr(instance, name) for name in names}
+
+
+def publish_on_change(sender, instance, created, changes, **kwargs):
+    # Valeurs relevées tout de suite, diffusées une fois l'écriture validée
+    transaction.on_commit(partial(
+        get_feed().publish, CREATED if created else UPDATED, instance.pk, change_values(instance, created, changes)
+    ))
+
+
+def publish_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(get_feed().publish, DELETED, instance.pk, {}))
+
+
+def feed_params(query_params):
+    """?since=<curseur>&wait=<secondes>&limit=<nombre> -> (since, wait, limit)."""
+    try:
+        wait = max(0.0, min(float(query_params.get('wait', 0)), settings.CHANGE_FEED_MAX_WAIT_SECONDS))
+    except ValueError:
+        raise ValidationError({'wait': "Durée d'attente invalide (en secondes)."})
+    try:
+        limit = min(int(query_params.get('limit', settings.CHANGE_FEED_PAGE_SIZE)), settings.CHANGE_FEED_PAGE_SIZE)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValidationError({'limit': f"Nombre de changements invalide (1 à {settings.CHANGE_FEED_PAGE_SIZE})."})
+    return query_params.get('since') or None, wait, limit
+
+
+def read_changes(since, wait, limit):
+    # Long polling : sans changement après `since`, attend jusqu'à `wait` secondes
+    feed = get_feed()
+    changes, cursor, reset = feed.read(since, limit)
+    if since and wait and not changes and not reset:
+        feed.wait(since, wait)
+        changes, cursor, reset = feed.read(since, limit)
+    return changes_response(changes, cursor, reset)
+
+
+async def aread_changes(since, wait, limit):
+    feed = get_feed()
+    changes, cursor, reset = feed.read(since, limit)
+    if since and wait and not changes and not reset:
+        await feed.await_changes(since, wait)
+        changes, cursor, reset = feed.read(since, limit)
+    return changes_response(changes, cursor, reset)
+
+
+def changes_response(changes, cursor, reset):
+    return {'cursor': cursor, 'reset': reset, 'results': [change.data() for change in changes]}
+
+
+def sse_message(change):
+    return f'id: {change.cursor}\nevent: {change.kind}\ndata: {change.payload()}\n\n'
+
+
+def sse_control(kind, cursor):
+    # 'ready' à l'ouverture, 'reset' si le client doit relire la liste
+    return f'id: {cursor}\nevent: {kind}\ndata: {json.dumps({"cursor": cursor})}\n\n'
+
+
+def sse_stream(since, limit):
+    """Messages SSE à partir de `since`, puis au fil des écritures, pendant CHANGE_FEED_STREAM_SECONDS."""
+    feed = get_feed()
+    # Lu avant le début de la réponse : un curseur invalide donne encore une erreur 400
+    return _sse_messages(feed, since, feed.read(since, limit), limit)
+
+
+async def _sse_messages(feed, since, first, limit):
+    changes, cursor, reset = first
+    yield 'retry: 3000\n\n'
+    # 'ready' porte le point de reprise : les changements qui suivent sont ceux d'après
+    yield sse_control('reset', cursor) if reset else sse_control('ready', since or cursor)
+    # Flux borné : EventSource se reconnecte seul (Last-Event-ID), et un arrêt du serveur
+    # n'attend pas indéfiniment la fin des flux ouverts
+    deadline = time.monotonic() + settings.CHANGE_FEED_STREAM_SECONDS
+    while (remaining := deadline - time.monotonic()) > 0:
+        for change in changes:
+            yield sse_message(change)
+        if not changes:
+            await feed.await_changes(cursor, min(settings.CHANGE_FEED_HEARTBEAT_SECONDS, remaining))
+            if not feed.has_changes_after(cursor):
+                # Commentaire SSE : garde la connexion ouverte à travers les proxys
+                yield ': ping\n\n'
+        changes, cursor, reset = feed.read(cursor, limit)
+        if reset:
+            yield sse_control('reset', cursor)
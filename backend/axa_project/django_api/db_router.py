@@ -0,0 +1,52 @@
+"""
+Routage entre la connexion principale et la connexion en lecture seule 'readonly'
+(profil 'production', cf. DATABASE_PROFILE).
+
+Les lectures lourdes (liste, exports) choisissent explicitement la connexion de
+lecture avec `read_database()`. Le routeur garantit le reste : toutes les écritures
+et les migrations passent par 'default', y compris l'enregistrement d'un objet lu
+depuis 'readonly'.
+
+Le journal WAL est enregistré dans le fichier de la base : la migration 0009 le
+choisit une fois pour toutes, quel que soit le profil, au lieu de chaque ouverture de
+connexion.
+"""
+from django.db import connections
+
+WRITE_DATABASE = 'default'
+READ_DATABASE = 'readonly'
+
+
+def read_database():
+    if READ_DATABASE not in connections.databases or connections[WRITE_DATABASE].is_in_memory_db():
+        # Base en mémoire (tests) : une seconde connexion n'apporterait rien
+        return WRITE_DATABASE
+    # Dans une transaction, les lectures doivent voir ses propres écritures
+    if connections[WRITE_DATABASE].in_atomic_block:
+        return WRITE_DATABASE
+    return READ_DATABASE
+
+
+def set_journal_mode(connection, mode):
+    """Passe le fichier SQLite de `connection` au journal `mode` ('wal', 'delete') ; renvoie le mode obtenu."""
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return None
+    # Sans effet dans une transaction : la migration qui l'appelle n'est pas atomique
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {mode}')
+        return cursor.fetchone()[0]
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        return WRITE_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Les deux connexions ouvrent le même fichier
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == WRITE_DATABASE
@@ -0,0 +1,156 @@
+"""
+Cache disque des documents générés, adressé par contenu.
+
+La clé est l'empreinte SHA-256 des champs réellement rendus, de la version du
+gabarit, du format et de la date imprimée : deux demandes qui produiraient le même
+fichier partagent donc la même entrée. Les fichiers sont rangés par devis
+(`<DOCUMENT_CACHE_DIR>/<id>/<clé>.<ext>`) pour pouvoir purger d'un coup les
+entrées d'un devis modifié, et la taille totale est bornée par une éviction LRU
+(la date de modification des fichiers est rafraîchie à chaque lecture).
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+
+from .documents import DOCUMENT_FORMATS, RENDERED_FIELDS, TEMPLATE_VERSION, format_date_generation, render_document
+from .metrics import CACHE_REQUESTS
+
+_size_lock = threading.Lock()
+_estimated_size = None
+
+
+def cache_key(proposal, doc_type, date_generation):
+    values = [str(getattr(proposal, field)) if getattr(proposal, field) is not None else None for field in RENDERED_FIELDS]
+    if proposal.ouvrage_cost is not None:
+        # 1000 et 1000.00 donnent le même rendu
+        values[RENDERED_FIELDS.index('ouvrage_cost')] = f"{proposal.ouvrage_cost:.2f}"
+    payload = json.dumps([TEMPLATE_VERSION, doc_type, date_generation, values], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def proposal_cache_dir(proposal_id):
+    return os.path.join(settings.DOCUMENT_CACHE_DIR, str(proposal_id))
+
+
+def cache_path(proposal_id, key, doc_type):
+    return os.path.join(proposal_cache_dir(proposal_id), f"{key}.{DOCUMENT_FORMATS[doc_type][1]}")
+
+
+def _iter_entries():
+    root = settings.DOCUMENT_CACHE_DIR
+    if not os.path.isdir(root):
+        return
+    for proposal_dir in os.scandir(root):
+        if not proposal_dir.is_dir():
+            continue
+        for entry in os.scandir(proposal_dir.path):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                yield entry
+
+
+def total_size():
+    return sum(entry.stat().st_size for entry in _iter_entries())
+
+
+def _add_to_size(delta):
+    global _estimated_size
+    with _size_lock:
+        if _estimated_size is None:
+            _estimated_size = total_size()
+        else:
+            _estimated_size += delta
+        return _estimated_size
+
+
+def evict(max_bytes=None):
+    # Supprime les entrées les moins récemment lues jusqu'à repasser sous la limite
+    global _estimated_size
+    max_bytes = settings.DOCUMENT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for entry in _iter_entries():
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+    with _size_lock:
+        _estimated_size = size
+    return size
+
+
+def invalidate_proposal(proposal_id):
+    global _estimated_size
+    shutil.rmtree(proposal_cache_dir(proposal_id), ignore_errors=True)
+    with _size_lock:
+        _estimated_size = None
+
+
+def document_etag(proposal, doc_type, generated_at=None):
+    return f'"{cache_key(proposal, doc_type, format_date_generation(generated_at))}"'
+
+
+def etag_matches(header, etag):
+    # Comparaison faible (RFC 9110) : W/"x" désigne le même document que "x"
+    tags = parse_etags(header)
+    return tags == ['*'] or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+
+def not_modified_response(request, etag):
+    """Réponse 304 si l'en-tête If-None-Match de la requête désigne `etag`, sinon None."""
+    if not etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return None
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
+
+
+def open_document(proposal, doc_type, generated_at=None):
+    """
+    Renvoie (fichier ouvert, clé) du document en cache, en le générant au besoin.
+    Le fichier est ouvert avant de rendre la main : une éviction concurrente ne
+    peut donc pas le faire disparaître pendant qu'il est envoyé.
+    """
+    date_generation = format_date_generation(generated_at)
+    key = cache_key(proposal, doc_type, date_generation)
+    path = cache_path(proposal.pk, key, doc_type)
+    try:
+        os.utime(path)
+        document = open(path, 'rb')
+    except FileNotFoundError:
+        CACHE_REQUESTS.inc(cache='documents', result='miss')
+    else:
+        CACHE_REQUESTS.inc(cache='documents', result='hit')
+        return document, key
+
+    content = render_document(proposal, doc_type, generated_at)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as output:
+        output.write(content)
+    os.replace(tmp_path, path)
+    document = open(path, 'rb')
+
+    if _add_to_size(len(content)) > settings.DOCUMENT_CACHE_MAX_BYTES:
+        evict()
+    return document, key
+
+
+def invalidate_on_change(sender, instance, created, changes, **kwargs):
+    if not created and any(field in changes for field in RENDERED_FIELDS):
+        invalidate_proposal(instance.pk)
+
+
+def invalidate_on_delete(sender, instance, **kwargs):
+    invalidate_proposal(instance.pk)
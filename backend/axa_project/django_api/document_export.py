@@ -0,0 +1,92 @@
+"""
+Export groupé des documents d'une sélection de devis.
+
+L'archive ZIP est produite au fil de l'eau : les documents sont rendus (ou lus
+dans le cache disque) par un pool de threads, dans une fenêtre bornée, et chaque
+entrée est écrite dans le flux de la réponse dès qu'elle est prête. Seule la
+fenêtre en cours est gardée en mémoire, jamais l'archive entière.
+
+Le PDF fusionné est un unique document ReportLab construit à partir des contenus
+de chaque devis ; il est écrit dans un fichier temporaire puis envoyé par morceaux.
+"""
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .document_cache import open_document
+from .documents import document_filename, format_date_generation, render_merged_pdf
+
+EXPORT_CHUNK_SIZE = 200
+
+
+class _StreamBuffer:
+    """Flux non positionnable dans lequel écrit `zipfile`, vidé après chaque entrée."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def iter_documents(proposals, doc_type, generated_at, workers=None):
+    """
+    Renvoie (devis, fichier ouvert) pour chaque devis, dans l'ordre d'origine.
+    Au plus 2 x `workers` documents sont en cours de rendu ou en attente d'envoi.
+    """
+    workers = workers or settings.DOCUMENT_JOB_WORKERS
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='document-export') as executor:
+        try:
+            for proposal in proposals:
+                pending.append((proposal, executor.submit(open_document, proposal, doc_type, generated_at)))
+                if len(pending) >= 2 * workers:
+                    proposal, future = pending.popleft()
+                    yield proposal, future.result()[0]
+            while pending:
+                proposal, future = pending.popleft()
+                yield proposal, future.result()[0]
+        finally:
+            # Export interrompu (client déconnecté, erreur) : on referme ce qui a déjà été ouvert
+            for _, future in pending:
+                if not future.cancel() and future.exception() is None:
+                    future.result()[0].close()
+
+
+def stream_zip(queryset, doc_type, generated_at):
+    buffer = _StreamBuffer()
+    proposals = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    # Les PDF et DOCX sont déjà compressés : niveau minimal pour ne pas payer le CPU pour rien
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for proposal, document in iter_documents(proposals, doc_type, generated_at):
+            with document, archive.open(document_filename(proposal, doc_type, generated_at), 'w', force_zip64=True) as entry:
+                shutil.copyfileobj(document, entry)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def merged_pdf_file(queryset, generated_at):
+    output = tempfile.TemporaryFile()
+    try:
+        render_merged_pdf(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE), format_date_generation(generated_at), output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def bundle_filename(bundle, generated_at):
+    return f"Propositions_commerciales_{generated_at.strftime('%d%m%Y_%H%M')}.{bundle}"
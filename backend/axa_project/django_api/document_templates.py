@@ -0,0 +1,460 @@
+"""
+Gabarits précompilés des propositions commerciales.
+
+Tout ce qui ne dépend pas du devis est préparé une seule fois par processus, au
+premier rendu : styles ReportLab, styles des tableaux, paragraphes fixes déjà
+analysés, logo déjà décodé et encodé pour le PDF, document Word de base déjà mis
+en forme (marges, style Normal, logo, titres, tableaux). Un rendu ne fait plus
+que compléter les champs propres au devis.
+"""
+import copy
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from docx import Document as DocxDocument
+from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+from docx.shared import Inches, Pt, RGBColor
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
+from reportlab.platypus import Flowable, Paragraph, Spacer, Table, TableStyle
+
+logger = logging.getLogger(__name__)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def HEXtoRGB(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return RGBColor(int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16))
+
+
+def logo_path():
+    return os.path.join(settings.BASE_DIR, 'static', 'logo.png')
+
+
+def _get_template(key, factory):
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                template = _templates[key] = factory()
+    return template
+
+
+def get_pdf_template():
+    return _get_template('pdf', PdfTemplate)
+
+
+def get_word_template():
+    return _get_template('word', WordTemplate)
+
+
+def clear_templates():
+    # À appeler si le logo ou la mise en page change sans redémarrage du processus
+    with _templates_lock:
+        _templates.clear()
+
+
+PARAMETER_LABELS = (
+    "Type d'ouvrage:",
+    "Types de travaux réalisés:",
+    "Coût du chantier:",
+    "Présence d'existant:",
+    "Garantie choisie:",
+    "Description de l'ouvrage :",
+    "Adresse du chantier:",
+)
+
+
+def parameter_values(proposal, missing_guarantee):
+    # Valeurs imprimées en face de PARAMETER_LABELS ; seul le libellé d'une garantie absente diffère entre PDF et Word
+    cost = proposal.ouvrage_cost if proposal.ouvrage_cost is not None else 0
+    return (
+        proposal.get_ouvrage_destination_display() if proposal.ouvrage_destination else "Non Applicable",
+        proposal.get_work_type_display() if proposal.work_type else "rénovation légère, rénovation lourde, construction neuve",
+        f"{cost:.2f} €" if proposal.ouvrage_cost is not None else "xxxxxxx €",
+        "Oui" if proposal.existing_presence else "Non",
+        proposal.get_guarantee_type_display() if proposal.guarantee_type else missing_guarantee,
+        proposal.ouvrage_description if proposal.ouvrage_description else "Non renseignée",
+        proposal.address_chantier if proposal.address_chantier else "Non renseignée",
+    )
+
+
+class PreparedImage:
+    """
+    Image PNG décodée, compressée et encodée une seule fois. Chaque document PDF
+    reçoit sa propre copie de l'objet image (et de son masque de transparence),
+    sans relire ni réencoder le fichier.
+    """
+
+    def __init__(self, path):
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self._xobject = PDFImageXObject(self.name, ImageReader(path), mask='auto')
+        self._smask = getattr(self._xobject, '_smask', None)
+
+    def register(self, canv):
+        document = canv._doc
+        if canv.hasForm(self.name):
+            return
+        xobject = copy.copy(self._xobject)
+        document.addForm(self.name, xobject)
+        if self._smask is not None:
+            del xobject._smask
+            xobject.smask = document.Reference(copy.copy(self._smask), document.getXObjectName(self._smask.name))
+
+
+class PreparedImageFlowable(Flowable):
+    # Équivalent de platypus.Image pour une PreparedImage ; une instance par document
+    def __init__(self, image, width, height, hAlign='CENTER'):
+        super().__init__()
+        self.image = image
+        self.drawWidth = width
+        self.drawHeight = height
+        self.hAlign = hAlign
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        self.image.register(self.canv)
+        self.canv._currentPageHasImages = 1
+        self.canv.saveState()
+        self.canv.scale(self.drawWidth, self.drawHeight)
+        self.canv.doForm(self.image.name)
+        self.canv.restoreState()
+
+
+class PdfTemplate:
+    """Parties fixes du PDF. Les paragraphes prototypes sont copiés à chaque rendu :
+    la mise en page modifie les flowables, qui ne peuvent donc pas être partagés."""
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.style_body = ParagraphStyle('BodyText', parent=styles['Normal'], fontSize=11, leading=12, spaceBefore=5, spaceAfter=5)
+        style_body_blue = ParagraphStyle('BodyBlueText', parent=self.style_body, textColor="#00008f")
+        style_main_title = ParagraphStyle('MainTitle', parent=styles['h1'], fontSize=11, leading=18, spaceBefore=6, spaceAfter=5, textColor="#00008f")
+        style_section_title = ParagraphStyle('SectionTitle', parent=styles['h2'], fontSize=11, leading=13, fontName='Helvetica-Bold', spaceBefore=10, spaceAfter=10)
+        style_table_text = ParagraphStyle('TableText', parent=styles['Normal'], fontSize=9, leading=11)
+        style_table_cell_text = ParagraphStyle('TableCellText', parent=style_table_text, alignment=TA_RIGHT)
+        style_footnote = ParagraphStyle('Footnote', parent=styles['Normal'], fontSize=10, leading=10, spaceBefore=6)
+        style_footnote_indented = ParagraphStyle('FootnoteIndented', parent=style_footnote, leftIndent=0.27*inch)
+        style_body_html = ParagraphStyle('BodyTextHTML', parent=style_table_text, allowHTMLEscapes=1)
+
+        path = logo_path()
+        if path and os.path.exists(path):
+            self.logo = PreparedImage(path)
+        else:
+            self.logo = None
+            logger.warning("Logo PDF non trouvé ou chemin non défini.", extra={'logo_path': path})
+
+        self.header = [
+            Paragraph("TARIFICATION INDICATIVE", style_main_title),
+            Paragraph("Produit chantier", style_body_blue),
+            Paragraph("Tarification indicative (*) sur la base d'un risque conforme aux paramètres suivants :", self.style_body),
+        ]
+        self.trc_title = [
+            Paragraph("<u>Garanties Tous Risques chantier</u>", style_body_html),
+            Paragraph("MONTANTS DE GARANTIES (exprimés en €)", style_section_title),
+        ]
+        self.data_trc = [
+            [Paragraph("Dommages matériels à l'ouvrage<br/>(Ce montant est épuisable pendant la durée des travaux)", style_body_html), Paragraph("XXXXXXXX", style_table_cell_text)],
+            [Paragraph("Responsabilité civile (tous dommages confondus)<br/>(Ces montants sont épuisables pendant la durée des travaux)", style_body_html), Paragraph("XXXXXXXXX", style_table_cell_text)],
+            [Paragraph("Maintenance-visite<br/>(Ce montant est compris dans le montant de la garantie des dommages matériels à l'ouvrage)", style_body_html), Paragraph("XXXXXXXXXXX", style_table_cell_text)],
+            [Paragraph("Mesure conservatoire", style_table_text), Paragraph("XXXXXXXXXXXX", style_table_cell_text)]
+        ]
+        self.table_style_trc = TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('GRID', (0,0), (-1,-1), 0.75, colors.black),
+            ('LEFTPADDING', (0,0), (-1,-1), 5),
+            ('RIGHTPADDING', (0,0), (-1,-1), 5),
+            ('TOPPADDING', (0,0), (-1,-1), 3),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 3),
+        ])
+        self.franchises_title = Paragraph("MONTANTS DE FRANCHISES (par sinistre exprimés en €)", style_section_title)
+        self.data_franchises = [
+            [Paragraph("Dommages subis par les ouvrages de bâtiment", style_table_text), Paragraph("XXXXXXXXXXX", style_table_cell_text)],
+            [Paragraph("Catastrophes naturelles", style_table_text), Paragraph("Montant déterminé par la loi ou par ses textes d'application", style_table_cell_text)],
+            [Paragraph("Responsabilité civile (1)", style_body_html), ""],
+            [Paragraph("- Assuré maître d'ouvrage", style_table_text), Paragraph("XXXXXXXXXXX", style_table_cell_text)],
+            [Paragraph("- Assurés intervenants", style_table_text), Paragraph("SANS", style_table_cell_text)],
+            [Paragraph("Maintenance-visite", style_table_text), Paragraph("XXXXXXXXXXX", style_table_cell_text)]
+        ]
+        self.table_style_franchises = TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('GRID', (0,0), (-1,-1), 0.75, colors.black),
+            ('LEFTPADDING', (0,0), (-1,-1), 5),
+            ('RIGHTPADDING', (0,0), (-1,-1), 5),
+            ('TOPPADDING', (0,0), (-1,-1), 3),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 3),
+            ('SPAN', (1,2), (1,2)),
+            ('LEFTPADDING', (0,3), (0,4), 20),
+        ])
+        self.footnote = Paragraph("(1) Ces franchises s'appliquent pour des dommages autres que corporels", style_footnote_indented)
+        self.reserve = Paragraph("(*) Cette tarification est faite sous réserve d'acceptation du risque par la compagnie", style_footnote)
+
+    @staticmethod
+    def _copy_rows(rows):
+        return [[copy.copy(cell) for cell in row] for row in rows]
+
+    def story(self, proposal, date_generation):
+        story = []
+        if self.logo is not None:
+            story.append(PreparedImageFlowable(self.logo, width=0.75*inch, height=0.75*inch))
+
+        story.append(Spacer(1, 0.1*inch))
+        story.extend(copy.copy(paragraph) for paragraph in self.header)
+        for key, value in zip(PARAMETER_LABELS, parameter_values(proposal, "Non renseigné")):
+            story.append(Paragraph(f"{key} {value}", self.style_body))
+
+        story.extend(copy.copy(paragraph) for paragraph in self.trc_title)
+        table_trc = Table(self._copy_rows(self.data_trc))
+        table_trc.setStyle(self.table_style_trc)
+        story.append(table_trc)
+
+        story.append(copy.copy(self.franchises_title))
+        table_franchises = Table(self._copy_rows(self.data_franchises))
+        table_franchises.setStyle(self.table_style_franchises)
+        story.append(table_franchises)
+        story.append(copy.copy(self.footnote))
+        story.append(Spacer(1, 0.2*inch))
+        story.append(Paragraph(f"Date de simulation de tarif: le {date_generation}", self.style_body))
+        story.append(copy.copy(self.reserve))
+        return story
+
+
+# Fonctions d'aide pour formater le texte et les paragraphes
+def set_run_font(run, name='Calibri', size_pt=11, bold=False, italic=False, color_rgb=None, underline=False):
+    font = run.font
+    font.name = name
+    font.size = Pt(size_pt)
+    font.bold = bold
+    font.italic = italic
+    if color_rgb:
+        font.color.rgb = color_rgb
+    font.underline = underline
+
+
+def set_paragraph_format(paragraph, alignment=None, space_before_pt=None, space_after_pt=None,
+                         line_spacing_rule=None, line_spacing_value=None, left_indent_inches=None, keep_with_next=False):
+    p_fmt = paragraph.paragraph_format
+    if alignment:
+        p_fmt.alignment = alignment
+    if space_before_pt:
+        p_fmt.space_before = Pt(space_before_pt)
+    if space_after_pt:
+        p_fmt.space_after = Pt(space_after_pt)
+    if line_spacing_rule:
+        p_fmt.line_spacing_rule = line_spacing_rule
+    if line_spacing_value:
+        p_fmt.line_spacing = line_spacing_value
+    if left_indent_inches:
+        p_fmt.left_indent = Inches(left_indent_inches)
+    if keep_with_next:
+        p_fmt.keep_with_next = True
+
+
+# Helper pour formater les cellules de tableau
+def format_table_cell(cell, text, font_name='Calibri', size_pt=9, bold=False,
+                      alignment=None, left_indent_inches=None, is_html_like=False,
+                      cell_v_align=WD_CELL_VERTICAL_ALIGNMENT.TOP):
+    cell.vertical_alignment = cell_v_align
+    if cell.paragraphs and not cell.paragraphs[0].text.strip():
+        p = cell.paragraphs[0]
+        p.clear()
+        set_paragraph_format(p, space_before_pt=0, space_after_pt=0, line_spacing_rule=WD_LINE_SPACING.SINGLE)
+    else:
+        p = cell.add_paragraph()
+        set_paragraph_format(p, space_before_pt=0, space_after_pt=0, line_spacing_rule=WD_LINE_SPACING.SINGLE)
+
+    if alignment:
+        p.alignment = alignment
+    if left_indent_inches:
+        p.paragraph_format.left_indent = Inches(left_indent_inches)
+
+    lines = text.split('<br/>') if is_html_like and isinstance(text, str) else [text]
+    for i, line_text in enumerate(lines):
+        run = p.add_run(line_text)
+        set_run_font(run, name=font_name, size_pt=size_pt, bold=bold)
+        if i < len(lines) - 1:
+            run.add_break()
+
+
+class WordTemplate:
+    """
+    Document Word complet dont seuls les paragraphes des paramètres du devis et de
+    la date restent à remplir. Il est conservé sérialisé : chaque rendu en rouvre
+    une copie, renseigne les textes manquants puis l'enregistre.
+    """
+
+    def __init__(self):
+        doc_word = DocxDocument()
+
+        sections = doc_word.sections
+        for section in sections:
+            section.top_margin = Inches(0.5)
+            section.bottom_margin = Inches(0.25)
+            section.left_margin = Inches(0.75)
+            section.right_margin = Inches(0.75)
+
+        style_normal_word = doc_word.styles['Normal']
+        font_normal = style_normal_word.font
+        font_normal.name = 'Calibri'
+        font_normal.size = Pt(11)
+        p_fmt_normal = style_normal_word.paragraph_format
+        p_fmt_normal.space_before = Pt(5)
+        p_fmt_normal.space_after = Pt(5)
+        p_fmt_normal.line_spacing_rule = None
+        p_fmt_normal.line_spacing = 1
+
+        path = logo_path()
+        if path and os.path.exists(path):
+            p_logo = doc_word.add_paragraph()
+            set_paragraph_format(p_logo, alignment=WD_ALIGN_PARAGRAPH.CENTER, space_before_pt=0, space_after_pt=0)
+            run_logo = p_logo.add_run()
+            run_logo.add_picture(path, width=Inches(0.75))
+        else:
+            logger.warning("Logo Word non trouvé ou chemin non défini.", extra={'logo_path': path})
+
+        p_main_title = doc_word.add_paragraph()
+        set_paragraph_format(p_main_title, alignment=WD_ALIGN_PARAGRAPH.LEFT,
+                             space_before_pt=6, space_after_pt=5,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
+        run_main_title = p_main_title.add_run("TARIFICATION INDICATIVE")
+        set_run_font(run_main_title, name='Calibri', size_pt=13, bold=False, color_rgb=HEXtoRGB("#00008f"))
+
+        p_subtitle = doc_word.add_paragraph()
+        set_paragraph_format(p_subtitle, alignment=WD_ALIGN_PARAGRAPH.LEFT,
+                             space_before_pt=5, space_after_pt=5,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
+        run_subtitle = p_subtitle.add_run("Produit chantier")
+        set_run_font(run_subtitle, name='Calibri', size_pt=11, color_rgb=HEXtoRGB("#00008f"))
+
+        p_intro = doc_word.add_paragraph()
+        set_paragraph_format(p_intro, space_before_pt=5, space_after_pt=5,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
+        run_intro = p_intro.add_run("Tarification indicative (*) sur la base d'un risque conforme aux paramètres suivants :")
+        set_run_font(run_intro, name='Calibri', size_pt=11)
+
+        # Paragraphes des paramètres : le libellé est fixe, la valeur est renseignée à chaque rendu
+        self.parameter_paragraphs = []
+        for key in PARAMETER_LABELS:
+            self.parameter_paragraphs.append(len(doc_word.paragraphs))
+            p_param = doc_word.add_paragraph()
+            set_paragraph_format(p_param, space_before_pt=5, space_after_pt=5,
+                                 line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
+            run_param_key = p_param.add_run(key + " ")
+            set_run_font(run_param_key, name='Calibri', size_pt=11)
+            run_param_value = p_param.add_run()
+            set_run_font(run_param_value, name='Calibri', size_pt=11)
+
+        p_garanties_text = doc_word.add_paragraph()
+        set_paragraph_format(p_garanties_text, space_before_pt=5, space_after_pt=5,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1.22)
+        run_garanties_text = p_garanties_text.add_run("Garanties Tous Risques chantier")
+        set_run_font(run_garanties_text, name='Calibri', size_pt=9, underline=True)
+
+        p_montants_title = doc_word.add_paragraph()
+        set_paragraph_format(p_montants_title, space_before_pt=10, space_after_pt=10,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1.18)
+        run_montants_title = p_montants_title.add_run("MONTANTS DE GARANTIES (exprimés en €)")
+        set_run_font(run_montants_title, name='Calibri', size_pt=11, bold=True)
+
+        table_data_trc_word = [
+            ("Dommages matériels à l'ouvrage (Ce montant est épuisable pendant la durée des travaux)", "XXXXXXXX"),
+            ("Responsabilité civile (tous dommages confondus)<br/>(Ces montants sont épuisables pendant la durée des travaux)", "XXXXXXXXX"),
+            ("Maintenance-visite (Ce montant est compris dans le montant de la garantie des dommages matériels à l'ouvrage)", "XXXXXXXXXXX"),
+            ("Mesure conservatoire", "XXXXXXXXXXXX")
+        ]
+        table_trc_word = doc_word.add_table(rows=len(table_data_trc_word), cols=2)
+        table_trc_word.style = 'TableGrid'
+        table_trc_word.autofit = True
+
+        for i, (item, value) in enumerate(table_data_trc_word):
+            cell1 = table_trc_word.cell(i, 0)
+            format_table_cell(cell1, item, size_pt=9, is_html_like=True)
+
+            cell2 = table_trc_word.cell(i, 1)
+            format_table_cell(cell2, value, size_pt=9, alignment=WD_ALIGN_PARAGRAPH.RIGHT)
+
+        p_franch_title = doc_word.add_paragraph()
+        set_paragraph_format(p_franch_title, space_before_pt=10, space_after_pt=10,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1.18)
+        run_franch_title = p_franch_title.add_run("MONTANTS DE FRANCHISES (par sinistre exprimés en €)")
+        set_run_font(run_franch_title, name='Calibri', size_pt=11, bold=True)
+
+        table_data_franchises_word = [
+            ("Dommages subis par les ouvrages de bâtiment", "XXXXXXXXXXX"),
+            ("Catastrophes naturelles", "Montant déterminé par la loi ou par ses textes d'application"),
+            ("Responsabilité civile (1)", ""),
+            ("- Assuré maître d'ouvrage", "XXXXXXXXXXX"),
+            ("- Assurés intervenants", "SANS"),
+            ("Maintenance-visite", "XXXXXXXXXXX")
+        ]
+
+        table_franchises_doc = doc_word.add_table(rows=len(table_data_franchises_word), cols=2)
+        table_franchises_doc.style = 'TableGrid'
+        table_franchises_doc.autofit = True
+
+        for i, (item, value) in enumerate(table_data_franchises_word):
+            cell1 = table_franchises_doc.cell(i, 0)
+            cell2 = table_franchises_doc.cell(i, 1)
+
+            indent = 0
+            if item.startswith("- "):
+                indent = 0.27
+
+            format_table_cell(cell1, item, size_pt=9, left_indent_inches=indent)
+
+            if item == "Responsabilité civile (1)":
+                cell1.merge(cell2)
+            else:
+                format_table_cell(cell2, value, size_pt=9, alignment=WD_ALIGN_PARAGRAPH.RIGHT)
+
+        p_footnote = doc_word.add_paragraph()
+        set_paragraph_format(p_footnote, space_before_pt=6, space_after_pt=0,
+                             line_spacing_rule=WD_LINE_SPACING.SINGLE)
+        run_footnote = p_footnote.add_run("     (1) Ces franchises s'appliquent pour des dommages autres que corporels")
+        set_run_font(run_footnote, name='Calibri', size_pt=10)
+
+        p_spacer_after_footnote = doc_word.add_paragraph()
+        set_paragraph_format(p_spacer_after_footnote, space_before_pt=0, space_after_pt=1)
+
+        self.date_paragraph = len(doc_word.paragraphs)
+        p_date = doc_word.add_paragraph()
+        set_paragraph_format(p_date, space_before_pt=5, space_after_pt=5,
+                             line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
+        run_date = p_date.add_run()
+        set_run_font(run_date, name='Calibri', size_pt=11)
+
+        p_reserve = doc_word.add_paragraph()
+        set_paragraph_format(p_reserve, space_before_pt=6, space_after_pt=1,
+                             line_spacing_rule=WD_LINE_SPACING.SINGLE)
+        run_reserve = p_reserve.add_run("(*) Cette tarification est faite sous réserve d'acceptation du risque par la compagnie")
+        set_run_font(run_reserve, name='Calibri', size_pt=10)
+
+        base = BytesIO()
+        doc_word.save(base)
+        self.base = base.getvalue()
+
+    def render(self, proposal, date_generation):
+        doc_word = DocxDocument(BytesIO(self.base))
+        paragraphs = doc_word.paragraphs
+        for index, value in zip(self.parameter_paragraphs, parameter_values(proposal, "DO/TRC/ DO + TRC")):
+            paragraphs[index].runs[1].text = value
+        paragraphs[self.date_paragraph].runs[0].text = f"Date de simulation de tarif: le {date_generation}"
+
+        word_buffer = BytesIO()
+        doc_word.save(word_buffer)
+        word_value = word_buffer.getvalue()
+        word_buffer.close()
+        return word_value
@@ -0,0 +1,89 @@
+from io import BytesIO
+
+from reportlab.platypus import SimpleDocTemplate, PageBreak
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import A4
+
+from datetime import datetime
+
+from .document_templates import get_pdf_template, get_word_template
+from .metrics import DOCUMENT_RENDER
+
+# Formats de document proposés : type demandé -> (type MIME, extension, libellé des erreurs)
+DOCUMENT_FORMATS = {
+    'pdf': ('application/pdf', 'pdf', 'du PDF'),
+    'word': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx', 'du document Word'),
+}
+
+
+# À incrémenter à chaque modification de la mise en page : invalide le cache des documents
+TEMPLATE_VERSION = 1
+
+# Champs du devis qui apparaissent dans le document (le numéro d'opportunité ne sert qu'au nom du fichier)
+RENDERED_FIELDS = (
+    'ouvrage_destination',
+    'work_type',
+    'ouvrage_cost',
+    'existing_presence',
+    'guarantee_type',
+    'ouvrage_description',
+    'address_chantier',
+)
+
+
+class UnsupportedDocumentType(ValueError):
+    pass
+
+
+def document_filename(proposal, doc_type, generated_at=None):
+    generated_at = generated_at or datetime.now()
+    current_time = generated_at.strftime("%d%m%Y_%H%M")
+    extension = DOCUMENT_FORMATS[doc_type][1]
+    return f"Proposition_commerciale_{proposal.opportunity_number}_{current_time}.{extension}"
+
+
+def format_date_generation(generated_at=None):
+    return (generated_at or datetime.now()).strftime("%d/%m/%Y")
+
+
+def render_document(proposal, doc_type, generated_at=None):
+    if doc_type not in DOCUMENT_FORMATS:
+        raise UnsupportedDocumentType(doc_type)
+    date_generation = format_date_generation(generated_at)
+    with DOCUMENT_RENDER.time(format=doc_type):
+        if doc_type == 'pdf':
+            return render_pdf(proposal, date_generation)
+        return render_word(proposal, date_generation)
+
+
+def pdf_template(output):
+    return SimpleDocTemplate(output, pagesize=A4,
+                             rightMargin=0.75*inch, leftMargin=0.75*inch,
+                             topMargin=0.5*inch, bottomMargin=0.25*inch)
+
+
+def render_pdf(proposal, date_generation):
+    pdf_buffer = BytesIO()
+    pdf_template(pdf_buffer).build(pdf_story(proposal, date_generation))
+    pdf_value = pdf_buffer.getvalue()
+    pdf_buffer.close()
+    return pdf_value
+
+
+def render_merged_pdf(proposals, date_generation, output):
+    # Un seul document : les pages de chaque devis se suivent, séparées par un saut de page
+    with DOCUMENT_RENDER.time(format='pdf-merged'):
+        story = []
+        for proposal in proposals:
+            if story:
+                story.append(PageBreak())
+            story.extend(pdf_story(proposal, date_generation))
+        pdf_template(output).build(story)
+
+
+def pdf_story(proposal, date_generation):
+    return get_pdf_template().story(proposal, date_generation)
+
+
+def render_word(proposal, date_generation):
+    return get_word_template().render(proposal, date_generation)
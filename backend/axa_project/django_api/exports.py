@@ -0,0 +1,146 @@
+"""
+Exports tabulaires (CSV, XLSX, JSON lines) des devis et de leur historique.
+
+Les lignes sont lues en tuples par `iterator(chunk_size=...)` et converties à la
+volée : la mémoire consommée ne dépend pas du nombre de devis. CSV et JSON lines
+sont produits au fil de l'eau ; le classeur XLSX (openpyxl en mode write-only)
+est écrit dans un fichier, puis envoyé par morceaux.
+"""
+import csv
+import json
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .models import ProposalHistory
+
+EXPORT_CHUNK_SIZE = 2000
+# Nombre de lignes regroupées dans chaque morceau envoyé au client
+ROWS_PER_CHUNK = 500
+
+# Format -> (type MIME, extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+PROPOSAL_EXPORT_FIELDS = (
+    'id',
+    'opportunity_number',
+    'client_name',
+    'guarantee_type',
+    'ouvrage_destination',
+    'work_type',
+    'ouvrage_cost',
+    'existing_presence',
+    'is_vip_client',
+    'rcmo_desired',
+    'trc_rate',
+    'do_rate',
+    'prime_seule_tarif_trc',
+    'prime_seule_tarif_do',
+    'prime_seule_tarif_duo',
+    'ouvrage_description',
+    'address_chantier',
+    'created_at',
+    'updated_at',
+)
+HISTORY_EXPORT_FIELDS = ('id', 'proposal_id', 'proposal__opportunity_number', 'timestamp', 'user_ip', 'changes')
+HISTORY_EXPORT_HEADER = ('id', 'proposal_id', 'opportunity_number', 'timestamp', 'user_ip', 'changes')
+
+
+def proposal_rows(queryset, fields=PROPOSAL_EXPORT_FIELDS):
+    # `fields` : colonnes retenues (cf. projection.parse_fields), les autres ne sont pas lues
+    return fields, queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def history_rows(proposals):
+    # Historique des devis sélectionnés, dans l'ordre d'enregistrement
+    queryset = ProposalHistory.objects.using(proposals.db).filter(proposal__in=proposals.order_by().values('pk')).order_by('id')
+    return HISTORY_EXPORT_HEADER, queryset.values_list(*HISTORY_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def local_datetime(value):
+    return timezone.localtime(value) if timezone.is_aware(value) else value
+
+
+def text_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return local_datetime(value).isoformat()
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def xlsx_value(value):
+    if isinstance(value, datetime):
+        # Excel ne connaît pas les fuseaux horaires : heure locale sans fuseau
+        return local_datetime(value).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class _Echo:
+    """Pseudo-fichier pour csv.writer : renvoie la ligne au lieu de l'écrire."""
+
+    def write(self, value):
+        return value
+
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode()
+
+
+def _csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    # BOM : Excel reconnaît alors l'UTF-8 (accents des noms de clients)
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([text_value(value) for value in row])
+
+
+def _jsonl_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def iter_export(header, rows, file_format):
+    """Contenu d'un export CSV ou JSON lines, en morceaux d'octets."""
+    lines = _csv_lines(header, rows) if file_format == 'csv' else _jsonl_lines(header, rows)
+    return _chunked(lines)
+
+
+def write_xlsx(header, rows, output, title):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append([xlsx_value(value) for value in row])
+    workbook.save(output)
+
+
+def write_export(header, rows, file_format, output, title='Export'):
+    """Écrit un export complet dans `output`, un fichier ouvert en binaire."""
+    if file_format == 'xlsx':
+        write_xlsx(header, rows, output, title)
+        return
+    for chunk in iter_export(header, rows, file_format):
+        output.write(chunk)
+
+
+def export_filename(prefix, file_format, generated_at=None):
+    generated_at = generated_at or datetime.now()
+    return f"{prefix}_{generated_at.strftime('%d%m%Y_%H%M')}.{EXPORT_FORMATS[file_format][1]}"
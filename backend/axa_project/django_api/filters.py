@@ -0,0 +1,124 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Proposal
+
+# Champs texte filtrés par sous-chaîne (comme le tableau du frontend)
+TEXT_FILTERS = ('opportunity_number', 'client_name')
+CHOICE_FILTERS = {
+    'guarantee_type': dict(Proposal.GUARANTEE_TYPE_CHOICES),
+    'ouvrage_destination': dict(Proposal.OUVRAGE_DESTINATION_CHOICES),
+    'work_type': dict(Proposal.WORK_TYPE_CHOICES),
+}
+BOOLEAN_FILTERS = ('existing_presence', 'is_vip_client', 'rcmo_desired')
+PRICE_FILTERS = {
+    'prime_price_min': 'gte',
+    'prime_price_max': 'lte',
+}
+FILTER_PARAMS = TEXT_FILTERS + tuple(CHOICE_FILTERS) + BOOLEAN_FILTERS + tuple(PRICE_FILTERS)
+
+# Clés de tri autorisées ; chacune est couverte par un index (cf. Proposal.Meta.indexes)
+ORDERING_FIELDS = (
+    'id',
+    'opportunity_number',
+    'client_name',
+    'work_type',
+    'ouvrage_cost',
+    'prime_seule_tarif_duo',
+    'created_at',
+    'updated_at',
+)
+NULLABLE_ORDERING_FIELDS = ('prime_seule_tarif_duo',)
+DEFAULT_ORDERING = 'id'
+
+
+def parse_boolean(name, value):
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'oui'):
+        return True
+    if lowered in ('false', '0', 'non'):
+        return False
+    raise ValidationError({name: f"Valeur booléenne invalide : '{value}'."})
+
+
+def parse_decimal(name, value):
+    try:
+        return Decimal(value.strip())
+    except InvalidOperation:
+        raise ValidationError({name: f"Montant invalide : '{value}'."})
+
+
+def filter_proposals(queryset, params):
+    for name in TEXT_FILTERS:
+        value = params.get(name, '')
+        if value:
+            queryset = queryset.filter(**{f'{name}__icontains': value})
+
+    for name, choices in CHOICE_FILTERS.items():
+        value = params.get(name, '')
+        if value:
+            if value not in choices:
+                raise ValidationError({name: f"Choix invalide : '{value}'."})
+            queryset = queryset.filter(**{name: value})
+
+    for name in BOOLEAN_FILTERS:
+        value = params.get(name, '')
+        if value:
+            queryset = queryset.filter(**{name: parse_boolean(name, value)})
+
+    price_filters = {}
+    for name, lookup in PRICE_FILTERS.items():
+        value = params.get(name, '')
+        if value:
+            price_filters[lookup] = parse_decimal(name, value)
+    if price_filters:
+        # Le tableau considère une prime DUO absente comme nulle
+        lower = price_filters.get('gte')
+        upper = price_filters.get('lte')
+        if (lower is None or lower <= 0) and (upper is None or upper >= 0):
+            price_q = Q(prime_seule_tarif_duo__isnull=True)
+        else:
+            price_q = Q(pk__in=[])
+        bounds = {f'prime_seule_tarif_duo__{lookup}': value for lookup, value in price_filters.items()}
+        queryset = queryset.filter(Q(**bounds) | price_q)
+
+    return queryset
+
+
+def get_ordering(params):
+    value = params.get('ordering', '') or DEFAULT_ORDERING
+    descending = value.startswith('-')
+    field = value.lstrip('-')
+    if field not in ORDERING_FIELDS:
+        raise ValidationError({'ordering': f"Clé de tri non supportée : '{field}'."})
+    return field, descending
+
+
+def order_proposals(queryset, field, descending):
+    # L'id sert de départage pour que l'ordre soit total (requis par la pagination par curseur)
+    if field == 'id':
+        return queryset.order_by('-id' if descending else 'id')
+    if descending:
+        return queryset.order_by(f'-{field}', '-id')
+    return queryset.order_by(field, 'id')
+
+
+class ProposalFilterBackend(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        queryset = filter_proposals(queryset, request.query_params)
+        field, descending = get_ordering(request.query_params)
+        return order_proposals(queryset, field, descending)
+
+
+def parse_filter_pairs(pairs):
+    # Filtres passés en ligne de commande sous la forme NOM=VALEUR
+    params = {}
+    for pair in pairs or []:
+        name, separator, value = pair.partition('=')
+        if not separator or name not in FILTER_PARAMS:
+            raise ValidationError({'filter': f"Filtre invalide : '{pair}'. Filtres possibles : {', '.join(FILTER_PARAMS)}."})
+        params[name] = value
+    return params
@@ -0,0 +1,152 @@
+"""
+Encodage compact des différences enregistrées dans l'historique des devis.
+
+En base, une entrée est une liste de triplets `[code, ancienne valeur, nouvelle valeur]` :
+le code est la position du champ dans `HISTORY_FIELD_CODES` et les montants et taux
+sont des entiers exprimés dans la plus petite unité du champ (centimes, dix-millièmes).
+Le champ décode à la lecture : l'API, les exports et le signal `proposal_changed`
+continuent de manipuler le format d'origine `{champ: {'old': ..., 'new': ...}}`,
+décimaux en chaînes normalisées.
+
+Toutes les `HISTORY_SNAPSHOT_INTERVAL` entrées, l'entrée porte aussi un instantané
+complet du devis après la modification (`snapshot`, liste des valeurs dans l'ordre
+de `SNAPSHOT_FIELDS`, mêmes unités) : c'est le point de départ des reconstructions
+`as_of`, qui n'ont ainsi jamais à rejouer tout l'historique.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.conf import settings
+from django.db import models
+
+from .pricing import COST_PLACES, RATE_PLACES, STORED_PREMIUM_PLACES
+
+# Ordre figé : on ajoute les nouveaux champs à la fin, sans jamais réordonner ni supprimer,
+# sans quoi les entrées déjà enregistrées seraient décodées avec le mauvais nom
+HISTORY_FIELD_CODES = (
+    'status',
+    'opportunity_number',
+    'client_name',
+    'guarantee_type',
+    'ouvrage_destination',
+    'work_type',
+    'ouvrage_cost',
+    'existing_presence',
+    'is_vip_client',
+    'rcmo_desired',
+    'trc_rate',
+    'do_rate',
+    'prime_seule_tarif_trc',
+    'prime_seule_tarif_do',
+    'prime_seule_tarif_duo',
+    'ouvrage_description',
+    'address_chantier',
+)
+FIELD_CODES = {name: code for code, name in enumerate(HISTORY_FIELD_CODES)}
+SNAPSHOT_FIELDS = HISTORY_FIELD_CODES[1:]
+DECIMAL_PLACES = {
+    'ouvrage_cost': COST_PLACES,
+    'trc_rate': RATE_PLACES,
+    'do_rate': RATE_PLACES,
+    'prime_seule_tarif_trc': STORED_PREMIUM_PLACES,
+    'prime_seule_tarif_do': STORED_PREMIUM_PLACES,
+    'prime_seule_tarif_duo': STORED_PREMIUM_PLACES,
+}
+
+
+def decimal_text(value, places):
+    """Valeur telle qu'enregistrée (arrondie à `places` décimales), en chaîne normalisée."""
+    if value is None:
+        return None
+    return str(value.quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_EVEN).normalize())
+
+
+def encode_value(name, value):
+    places = DECIMAL_PLACES.get(name)
+    if places is None or value is None:
+        return value
+    return int(Decimal(value).scaleb(places).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def decode_value(name, value):
+    places = DECIMAL_PLACES.get(name)
+    if places is None or value is None:
+        return value
+    return str(Decimal(value).scaleb(-places).normalize())
+
+
+def field_value(name, value):
+    """Valeur Python d'une différence décodée, telle que la base la renverrait."""
+    places = DECIMAL_PLACES.get(name)
+    if places is None or value is None:
+        return value
+    return Decimal(value).quantize(Decimal(1).scaleb(-places))
+
+
+def encode_changes(changes):
+    if not isinstance(changes, dict):
+        return changes
+    # Un champ inconnu de la table des codes est gardé sous son nom plutôt que perdu
+    return [
+        [FIELD_CODES.get(name, name), encode_value(name, change['old']), encode_value(name, change['new'])]
+        for name, change in changes.items()
+    ]
+
+
+def decode_changes(value):
+    # Les entrées antérieures à l'encodage compact sont déjà au format d'origine
+    if not isinstance(value, list):
+        return value
+    changes = {}
+    for code, old, new in value:
+        name = HISTORY_FIELD_CODES[code] if isinstance(code, int) else code
+        changes[name] = {'old': decode_value(name, old), 'new': decode_value(name, new)}
+    return changes
+
+
+def apply_changes(state, changes, side):
+    """Applique à `state` les valeurs 'new' (rejeu) ou 'old' (annulation) d'une différence."""
+    for name, change in changes.items():
+        if name in state:
+            state[name] = field_value(name, change[side])
+
+
+def needs_snapshot(version):
+    # La première entrée (création) porte toujours un instantané
+    return (version - 1) % settings.HISTORY_SNAPSHOT_INTERVAL == 0
+
+
+def proposal_snapshot(proposal):
+    return {name: getattr(proposal, name) for name in SNAPSHOT_FIELDS}
+
+
+def encode_snapshot(values):
+    if not isinstance(values, dict):
+        return values
+    return [encode_value(name, values[name]) for name in SNAPSHOT_FIELDS]
+
+
+def decode_snapshot(value):
+    if not isinstance(value, list):
+        return value
+    # Un instantané antérieur à l'ajout d'un champ est simplement plus court
+    return {name: field_value(name, decode_value(name, item)) for name, item in zip(SNAPSHOT_FIELDS, value)}
+
+
+class HistoryChangesField(models.JSONField):
+    """JSONField qui enregistre les différences encodées et les relit décodées."""
+
+    def get_prep_value(self, value):
+        return super().get_prep_value(encode_changes(value))
+
+    def from_db_value(self, value, expression, connection):
+        return decode_changes(super().from_db_value(value, expression, connection))
+
+
+class HistorySnapshotField(models.JSONField):
+    """JSONField qui enregistre un instantané du devis encodé et le relit en valeurs Python."""
+
+    def get_prep_value(self, value):
+        return super().get_prep_value(encode_snapshot(value))
+
+    def from_db_value(self, value, expression, connection):
+        return decode_snapshot(super().from_db_value(value, expression, connection))
@@ -0,0 +1,254 @@
+"""
+Import en masse de devis depuis un fichier CSV.
+
+Le fichier est lu au fil de l'eau et traité par lots. Chaque ligne est validée
+avec les mêmes règles que le formulaire (`clean_fields` puis `Proposal.clean`) et
+tarifée par `price_instance`, comme dans `Proposal.save`. Les devis sont ensuite
+créés ou mis à jour selon leur numéro d'opportunité, un lot par transaction
+(`bulk_create` / `bulk_update_rows`), avec leur historique enregistré en une
+seule requête. Une ligne invalide est consignée dans le rapport sans interrompre
+l'import.
+"""
+import csv
+import io
+import time
+from decimal import ROUND_HALF_EVEN, Decimal
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .bulk import bulk_insert_rows, bulk_update_rows
+from .history import needs_snapshot, proposal_snapshot
+from .models import CREATION_CHANGES, Proposal, ProposalHistory
+from .pricing import STORED_PREMIUM_PLACES, price_instance
+from .repricing import PREMIUM_FIELDS
+from .signals import proposal_changed
+from .summaries import SummaryDelta, instance_values
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+CENT = Decimal(1).scaleb(-STORED_PREMIUM_PLACES)
+
+KEY_FIELD = 'opportunity_number'
+# Colonnes reprises du fichier ; les autres (id, primes, dates) sont ignorées, si bien
+# qu'un export CSV peut être réimporté tel quel
+IMPORT_FIELDS = (
+    'opportunity_number',
+    'client_name',
+    'guarantee_type',
+    'ouvrage_destination',
+    'work_type',
+    'ouvrage_cost',
+    'existing_presence',
+    'is_vip_client',
+    'rcmo_desired',
+    'trc_rate',
+    'do_rate',
+    'ouvrage_description',
+    'address_chantier',
+)
+CREATE_FIELDS = [field.name for field in Proposal._meta.concrete_fields if not field.primary_key]
+HISTORY_FIELDS = ('proposal', 'changes', 'user_ip', 'timestamp', 'snapshot')
+BOOLEAN_VALUES = {'true': True, '1': True, 'oui': True, 'false': False, '0': False, 'non': False, '': False}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def open_csv(binary_file):
+    # utf-8-sig : accepte les fichiers enregistrés par Excel (et nos propres exports)
+    return io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+
+
+def cell_value(field, raw):
+    if field.get_internal_type() == 'BooleanField':
+        return BOOLEAN_VALUES.get(raw.strip().lower(), raw)
+    if raw == '' and field.null:
+        return None
+    return raw.strip() if field.get_internal_type() == 'DecimalField' else raw
+
+
+def store_premiums(instance):
+    """
+    Arrondit les primes calculées au centime, comme la base le fait à l'enregistrement :
+    une ligne identique au devis existant n'apparaît ainsi pas comme modifiée.
+    """
+    errors = {}
+    for name in PREMIUM_FIELDS:
+        field = Proposal._meta.get_field(name)
+        value = getattr(instance, name)
+        if value is None:
+            continue
+        if abs(value) >= 10 ** (field.max_digits - field.decimal_places):
+            errors[name] = ["La prime calculée dépasse le montant maximal enregistrable."]
+            continue
+        setattr(instance, name, value.quantize(CENT, rounding=ROUND_HALF_EVEN))
+    return errors
+
+
+def prepare_row(instance, row, columns):
+    """Applique les valeurs de la ligne, valide puis tarife. Renvoie les erreurs éventuelles."""
+    for field in columns:
+        setattr(instance, field.attname, cell_value(field, row[field.name]))
+    try:
+        instance.clean_fields(exclude=PREMIUM_FIELDS)
+        instance.clean()
+    except ValidationError as exc:
+        return exc.message_dict
+    price_instance(instance)
+    return store_premiums(instance)
+
+
+class ProposalImporter:
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, user_ip=None):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.user_ip = user_ip
+        self.seen = set()
+        self.report = {
+            'dry_run': dry_run,
+            'rows': 0,
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'failed': 0,
+            'ignored_columns': [],
+            'errors': [],
+        }
+
+    def add_error(self, line, number, errors):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'line': line, KEY_FIELD: number, 'errors': errors})
+
+    def run(self, text_file):
+        reader = csv.DictReader(text_file, restval='')
+        header = [name.strip() for name in reader.fieldnames or []]
+        if KEY_FIELD not in header:
+            raise ImportFormatError(f"La colonne '{KEY_FIELD}' est obligatoire.")
+        reader.fieldnames = header
+        self.columns = [Proposal._meta.get_field(name) for name in IMPORT_FIELDS if name in header]
+        self.update_fields = ([field.name for field in self.columns if field.name != KEY_FIELD] + list(PREMIUM_FIELDS)
+                              + ['updated_at', 'history_version'])
+        self.report['ignored_columns'] = [name for name in header if name not in IMPORT_FIELDS]
+
+        start = time.perf_counter()
+        chunk = []
+        for row in reader:
+            chunk.append((reader.line_num, row))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+
+        elapsed = time.perf_counter() - start
+        self.report['elapsed_seconds'] = round(elapsed, 3)
+        self.report['rows_per_second'] = round(self.report['rows'] / elapsed) if elapsed > 0 else None
+        return self.report
+
+    def import_chunk(self, chunk):
+        self.report['rows'] += len(chunk)
+        with transaction.atomic():
+            numbers = [(row[KEY_FIELD] or '').strip() for _, row in chunk]
+            existing = Proposal.objects.in_bulk([number for number in numbers if number], field_name=KEY_FIELD)
+
+            created = []
+            updated = []
+            for (line, row), number in zip(chunk, numbers):
+                row[KEY_FIELD] = number
+                if number in self.seen:
+                    self.add_error(line, number, {KEY_FIELD: ["Numéro d'opportunité en double dans le fichier."]})
+                    continue
+                instance = existing.get(number) or Proposal()
+                errors = prepare_row(instance, row, self.columns)
+                if errors:
+                    self.add_error(line, number, errors)
+                    continue
+                self.seen.add(number)
+                if instance.pk is None:
+                    created.append(instance)
+                    continue
+                changes = instance.get_changes(instance.get_loaded_values())
+                if changes:
+                    instance.history_version += 1
+                    updated.append((instance, changes))
+                else:
+                    self.report['unchanged'] += 1
+
+            if not self.dry_run:
+                try:
+                    with transaction.atomic():
+                        self.write(created, updated)
+                except IntegrityError as exc:
+                    # Devis créé entre-temps par une autre requête : le lot entier est rejeté
+                    for instance in created + [instance for instance, _ in updated]:
+                        self.add_error(None, instance.opportunity_number, {'__all__': [str(exc)]})
+                    return
+            self.report['created'] += len(created)
+            self.report['updated'] += len(updated)
+
+    def write(self, created, updated):
+        write_proposals(created, updated, self.update_fields, self.user_ip)
+
+
+def write_proposals(created, updated, update_fields, user_ip=None):
+    """
+    Enregistre, dans la transaction en cours, des devis déjà validés et tarifés :
+    `created` par un seul INSERT, `updated` (liste de (devis, différences)) par un seul
+    UPDATE des colonnes `update_fields`, puis leur historique et les tables de synthèse.
+    Les notifications (`proposal_changed`) partent une fois la transaction validée.
+    """
+    now = timezone.now()
+    if created:
+        for instance in created:
+            instance.created_at = instance.updated_at = now
+            instance.history_version = 1
+        bulk_insert_rows(Proposal, [{name: getattr(instance, name) for name in CREATE_FIELDS} for instance in created], CREATE_FIELDS)
+        # executemany ne renvoie pas les id : une requête pour les relire
+        ids = dict(Proposal.objects.filter(opportunity_number__in=[instance.opportunity_number for instance in created])
+                   .values_list('opportunity_number', 'id'))
+        for instance in created:
+            instance.pk = ids[instance.opportunity_number]
+            instance._state.adding = False
+    for instance, _ in updated:
+        instance.updated_at = now
+    bulk_update_rows(
+        Proposal,
+        [(instance.pk, {name: getattr(instance, name) for name in update_fields}) for instance, _ in updated],
+        update_fields,
+    )
+    bulk_insert_rows(
+        ProposalHistory,
+        [history_row(instance, CREATION_CHANGES, now, user_ip) for instance in created]
+        + [history_row(instance, changes, now, user_ip) for instance, changes in updated],
+        HISTORY_FIELDS,
+    )
+    summary = SummaryDelta()
+    for instance in created:
+        summary.add(instance_values(instance))
+    for instance, _ in updated:
+        summary.remove(instance.get_loaded_values())
+        summary.add(instance_values(instance))
+    summary.apply()
+    transaction.on_commit(partial(send_signals, created, updated, user_ip))
+
+
+def history_row(instance, changes, timestamp, user_ip):
+    snapshot = proposal_snapshot(instance) if needs_snapshot(instance.history_version) else None
+    return {'proposal': instance.pk, 'changes': changes, 'user_ip': user_ip, 'timestamp': timestamp, 'snapshot': snapshot}
+
+
+def send_signals(created, updated, user_ip):
+    # Mêmes notifications que Proposal.save (cache des documents, etc.)
+    for instance in created:
+        proposal_changed.send(sender=Proposal, instance=instance, created=True, changes=CREATION_CHANGES, user_ip=user_ip)
+    for instance, changes in updated:
+        proposal_changed.send(sender=Proposal, instance=instance, created=False, changes=changes, user_ip=user_ip)
+
+
+def import_proposals(text_file, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, user_ip=None):
+    return ProposalImporter(chunk_size=chunk_size, dry_run=dry_run, user_ip=user_ip).run(text_file)
@@ -0,0 +1,189 @@
+"""
+File de génération de documents adossée à la base.
+
+Chaque demande crée une ligne `DocumentJob` en attente, puis est confiée à un pool
+local (threads ou processus) dont la taille est fixée par `DOCUMENT_JOB_WORKERS`.
+La table sert de file : un job n'est rendu que par le worker qui a réussi à le
+passer de PENDING à RUNNING, et les jobs en attente (ou abandonnés par un worker
+arrêté) sont repris au démarrage du pool ou par `manage.py run_document_jobs`.
+
+Les jobs terminés depuis plus de DOCUMENT_JOB_RETENTION_SECONDS sont supprimés avec
+leur fichier, au plus une fois par PURGE_INTERVAL_SECONDS, par le pool local comme
+par `run_document_jobs`.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .document_cache import open_document
+from .documents import DOCUMENT_FORMATS, document_filename
+from .models import DocumentJob
+
+PURGE_INTERVAL_SECONDS = 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_purge = None
+_purge_lock = threading.Lock()
+
+
+def _init_process_worker():
+    # Processus lancés en mode 'spawn' : Django doit être initialisé dans chacun d'eux
+    import django
+    django.setup()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = settings.DOCUMENT_JOB_WORKERS
+            if settings.DOCUMENT_JOB_EXECUTOR == 'process':
+                _executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_process_worker,
+                )
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='document-job')
+            created = True
+        else:
+            created = False
+    if created:
+        recover_pending_jobs()
+    return _executor
+
+
+def shutdown_executor(wait=True):
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def dispatch(job_id):
+    if settings.DOCUMENT_JOB_EXECUTOR == 'sync':
+        run_document_job(job_id)
+    else:
+        executor = get_executor()
+        executor.submit(run_document_job, job_id)
+        if purge_due():
+            executor.submit(purge_expired_jobs)
+
+
+def submit_document_job(proposal, doc_type):
+    job = DocumentJob.objects.create(proposal=proposal, doc_type=doc_type)
+    # Le worker ne doit voir le job qu'une fois la transaction de la requête validée
+    transaction.on_commit(lambda: dispatch(job.pk))
+    return job
+
+
+def requeue_stale_jobs():
+    limit = timezone.now() - timedelta(seconds=settings.DOCUMENT_JOB_TIMEOUT_SECONDS)
+    return DocumentJob.objects.filter(status=DocumentJob.STATUS_RUNNING, started_at__lt=limit).update(
+        status=DocumentJob.STATUS_PENDING, started_at=None,
+    )
+
+
+def purge_expired_jobs():
+    """Supprime les jobs terminés (ou en échec) depuis plus de DOCUMENT_JOB_RETENTION_SECONDS, et leurs fichiers."""
+    try:
+        limit = timezone.now() - timedelta(seconds=settings.DOCUMENT_JOB_RETENTION_SECONDS)
+        # Un job fini avant la limite a forcément été créé avant : created_at borne le parcours de l'index
+        expired = DocumentJob.objects.filter(
+            status__in=(DocumentJob.STATUS_DONE, DocumentJob.STATUS_FAILED), created_at__lt=limit, finished_at__lt=limit,
+        )
+        purged = 0
+        for job_id, path in expired.values_list('pk', 'file_path').iterator():
+            if path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            # Fichier supprimé avant la ligne : un échec laisse au pire un job dont le téléchargement répond 410
+            purged += DocumentJob.objects.filter(pk=job_id).delete()[0]
+        return purged
+    finally:
+        if settings.DOCUMENT_JOB_EXECUTOR != 'sync':
+            close_old_connections()
+
+
+def purge_due():
+    global _last_purge
+    with _purge_lock:
+        now = time.monotonic()
+        if _last_purge is not None and now - _last_purge < PURGE_INTERVAL_SECONDS:
+            return False
+        _last_purge = now
+        return True
+
+
+def pending_job_ids(limit=None):
+    queryset = DocumentJob.objects.filter(status=DocumentJob.STATUS_PENDING).order_by('created_at')
+    return list(queryset.values_list('pk', flat=True)[:limit])
+
+
+def recover_pending_jobs():
+    requeue_stale_jobs()
+    for job_id in pending_job_ids():
+        dispatch(job_id)
+
+
+def claim_job(job_id):
+    # Mise à jour conditionnelle : un seul worker peut passer le job en cours
+    return DocumentJob.objects.filter(pk=job_id, status=DocumentJob.STATUS_PENDING).update(
+        status=DocumentJob.STATUS_RUNNING, started_at=timezone.now(),
+    ) == 1
+
+
+def job_output_path(job):
+    extension = DOCUMENT_FORMATS[job.doc_type][1]
+    return os.path.join(settings.DOCUMENT_JOB_DIR, f"{job.pk}.{extension}")
+
+
+def write_atomically(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as output:
+        output.write(content)
+    os.replace(tmp_path, path)
+
+
+def run_document_job(job_id):
+    """Rend le job s'il est encore en attente ; True si ce worker l'a pris et a enregistré son issue."""
+    try:
+        if not claim_job(job_id):
+            return False
+        job = DocumentJob.objects.select_related('proposal').get(pk=job_id)
+        # Le document porte la date de la demande, pas celle du rendu
+        generated_at = timezone.localtime(job.created_at)
+        # Les écritures finales ne portent que sur un job toujours en cours : un job repris
+        # entre-temps (requeue_stale_jobs) n'est pas écrasé par ce worker
+        running = DocumentJob.objects.filter(pk=job_id, status=DocumentJob.STATUS_RUNNING)
+        try:
+            document, _ = open_document(job.proposal, job.doc_type, generated_at)
+            with document:
+                content = document.read()
+            path = job_output_path(job)
+            write_atomically(path, content)
+        except Exception as e:
+            return running.update(
+                status=DocumentJob.STATUS_FAILED, error=str(e), finished_at=timezone.now(),
+            ) == 1
+        return running.update(
+            status=DocumentJob.STATUS_DONE,
+            file_path=path,
+            filename=document_filename(job.proposal, job.doc_type, generated_at),
+            finished_at=timezone.now(),
+        ) == 1
+    finally:
+        if settings.DOCUMENT_JOB_EXECUTOR != 'sync':
+            close_old_connections()
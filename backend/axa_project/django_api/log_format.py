@@ -0,0 +1,35 @@
+"""
+Formats des journaux (cf. LOGGING dans les paramètres) : les champs passés en
+`extra=` sont repris tels quels, en `clé=valeur` ('text') ou en JSON lines ('json').
+"""
+import json
+import logging
+from datetime import datetime, timezone
+
+# Attributs posés par logging sur chaque enregistrement : tout le reste vient de `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+def extra_fields(record):
+    return {name: value for name, value in vars(record).items() if name not in RECORD_ATTRIBUTES}
+
+
+class KeyValueFormatter(logging.Formatter):
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = ' '.join(f'{name}={value}' for name, value in extra_fields(record).items())
+        return f'{line} {fields}' if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **extra_fields(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
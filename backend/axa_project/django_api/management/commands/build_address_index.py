@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from django_api.addresses import build_address_index
+
+
+class Command(BaseCommand):
+    help = ("Construit l'index local d'autocomplétion des adresses à partir d'exports CSV de la "
+            "Base Adresse Nationale (adresses-XX.csv ou .csv.gz, séparateur point-virgule).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Fichiers CSV de la BAN (un par département par exemple).")
+        parser.add_argument('--output', default=settings.ADDRESS_INDEX_DIR,
+                            help="Répertoire de l'index (par défaut ADDRESS_INDEX_DIR).")
+
+    def handle(self, *args, **options):
+        try:
+            meta = build_address_index(options['paths'], options['output'])
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except (KeyError, UnicodeDecodeError) as exc:
+            raise CommandError(f"Fichier BAN invalide : {exc}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{meta['addresses']} adresses et {meta['streets']} voies indexées ({meta['tokens']} mots, "
+            f"{meta['skipped']} lignes ignorées) en {meta['elapsed_seconds']} s."
+        ))
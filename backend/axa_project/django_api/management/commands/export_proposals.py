@@ -0,0 +1,65 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from django_api.exports import EXPORT_FORMATS, PROPOSAL_EXPORT_FIELDS, history_rows, proposal_rows, write_export
+from django_api.filters import FILTER_PARAMS, filter_proposals, parse_filter_pairs
+from django_api.models import Proposal
+from django_api.projection import parse_fields
+
+
+class Command(BaseCommand):
+    help = "Exporte les devis sélectionnés (ou leur historique) en CSV, XLSX ou JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='file_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--history', action='store_true', help="Exporte l'historique des modifications des devis sélectionnés.")
+        parser.add_argument(
+            '--filter', action='append', dest='filters', metavar='NOM=VALEUR',
+            help=f"Filtre de sélection, répétable ({', '.join(FILTER_PARAMS)}).",
+        )
+        parser.add_argument(
+            '--fields', metavar='CHAMP,CHAMP',
+            help=f"Colonnes exportées, dans l'ordre habituel ({', '.join(PROPOSAL_EXPORT_FIELDS)} ; toutes par défaut).",
+        )
+        parser.add_argument('--output', '-o', help="Fichier de sortie (sortie standard par défaut, sauf pour XLSX).")
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filter_proposals(Proposal.objects.order_by('id'), parse_filter_pairs(options['filters']))
+            fields = parse_fields(options['fields'], PROPOSAL_EXPORT_FIELDS)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        file_format = options['file_format']
+        if file_format == 'xlsx' and not options['output']:
+            raise CommandError("L'export XLSX nécessite --output.")
+
+        if options['history']:
+            header, rows = history_rows(queryset)
+            title = 'Historique'
+        else:
+            header, rows = proposal_rows(queryset, fields)
+            title = 'Devis'
+        counted = _Counter(rows)
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                write_export(header, counted, file_format, output, title=title)
+            self.stdout.write(self.style.SUCCESS(f"{counted.count} lignes exportées dans {options['output']}."))
+        else:
+            write_export(header, counted, file_format, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+            self.stderr.write(f"{counted.count} lignes exportées.")
+
+
+class _Counter:
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
@@ -0,0 +1,39 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_api.imports import DEFAULT_CHUNK_SIZE, ImportFormatError, import_proposals, open_csv
+
+
+class Command(BaseCommand):
+    help = "Importe (crée ou met à jour) des devis depuis un fichier CSV, par lots, selon leur numéro d'opportunité."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Fichier CSV (séparateur virgule, encodage UTF-8).")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Valide et tarife les lignes sans rien enregistrer.")
+        parser.add_argument('--report', help="Enregistre le rapport complet (JSON) dans ce fichier.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as binary_file:
+                report = import_proposals(open_csv(binary_file), chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except (ImportFormatError, UnicodeDecodeError, csv.Error) as exc:
+            raise CommandError(f"Fichier CSV invalide : {exc}")
+
+        for error in report['errors']:
+            messages = '; '.join(f"{field}: {' '.join(texts)}" for field, texts in error['errors'].items())
+            self.stderr.write(f"Ligne {error['line']} ({error['opportunity_number']}) : {messages}")
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+        prefix = "[simulation] " if report['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{report['rows']} lignes lues : {report['created']} créées, {report['updated']} mises à jour, "
+            f"{report['unchanged']} inchangées, {report['failed']} en erreur "
+            f"({report['rows_per_second']} lignes/s, {report['elapsed_seconds']} s)."
+        ))
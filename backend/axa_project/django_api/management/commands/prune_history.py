@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_api.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = ("Applique la rétention de l'historique des devis : regroupement quotidien des entrées anciennes, "
+            "puis archivage des mois les plus anciens en JSON lines compressé.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rollup-after-days', type=int, default=settings.HISTORY_ROLLUP_AFTER_DAYS,
+                            help="Âge (en jours) à partir duquel les entrées sont regroupées par jour.")
+        parser.add_argument('--archive-after-months', type=int, default=settings.HISTORY_ARCHIVE_AFTER_MONTHS,
+                            help="Âge (en mois entiers) à partir duquel les entrées sont archivées.")
+        parser.add_argument('--skip-rollup', action='store_true', help="N'effectue pas le regroupement quotidien.")
+        parser.add_argument('--skip-archive', action='store_true', help="N'effectue pas l'archivage.")
+        parser.add_argument('--dry-run', action='store_true', help="Compte ce qui serait regroupé ou archivé sans rien modifier.")
+
+    def handle(self, *args, **options):
+        report = apply_retention(
+            rollup_days=options['rollup_after_days'],
+            archive_months=options['archive_after_months'],
+            rollup=not options['skip_rollup'],
+            archive=not options['skip_archive'],
+            dry_run=options['dry_run'],
+        )
+
+        prefix = "[simulation] " if report['dry_run'] else ""
+        if 'rollup' in report:
+            rollup = report['rollup']
+            self.stdout.write(
+                f"{prefix}Regroupement : {rollup['days']} journées, "
+                f"{rollup['entries_before']} entrées -> {rollup['entries_after']}."
+            )
+        if 'archive' in report:
+            archive = report['archive']
+            months = ', '.join(archive['months']) or "aucun mois"
+            self.stdout.write(f"{prefix}Archivage : {archive['entries']} entrées ({months}).")
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Rétention appliquée en {report['elapsed_seconds']} s."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from django_api.analytics import rebuild_summaries, summary_drift
+
+
+class Command(BaseCommand):
+    help = ("Recalcule depuis les devis les tables de synthèse du portefeuille (reprise de données, "
+            "correction d'écart). Avec --check, signale seulement les groupes qui diffèrent.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Compare sans rien modifier ; code de sortie 1 en cas d'écart.")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = summary_drift()
+            for key in drift:
+                self.stdout.write(f"Écart : {key[0]:%Y-%m} " + ' / '.join(str(value) for value in key[1:]))
+            if drift:
+                self.stderr.write(self.style.ERROR(f"{len(drift)} groupe(s) en écart."))
+                raise SystemExit(1)
+            self.stdout.write(self.style.SUCCESS("Tables de synthèse à jour."))
+            return
+
+        report = rebuild_summaries()
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['groups']} groupes recalculés ({report['drifted_groups']} en écart) en {report['elapsed_seconds']} s."
+        ))
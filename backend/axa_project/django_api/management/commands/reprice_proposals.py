@@ -0,0 +1,65 @@
+import argparse
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from django_api.filters import FILTER_PARAMS, filter_proposals, parse_filter_pairs
+from django_api.models import Proposal
+from django_api.repricing import DEFAULT_CHUNK_SIZE, RATE_FIELDS, reprice_proposals
+from django_api.serializers import RepriceSerializer
+
+# Mêmes contraintes que l'API (7 chiffres dont 4 décimales) : un taux plus précis est refusé, pas tronqué
+RATE_FIELD = RepriceSerializer().fields['do_rate']
+
+
+def rate_argument(value):
+    if value.lower() == 'none':
+        return None
+    try:
+        return RATE_FIELD.to_internal_value(value)
+    except ValidationError as exc:
+        raise argparse.ArgumentTypeError(f"Taux invalide : '{value}' ({' '.join(exc.detail)})")
+
+
+class Command(BaseCommand):
+    help = "Recalcule par lots les primes des devis sélectionnés, avec d'éventuels nouveaux taux DO/TRC."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filter', action='append', dest='filters', metavar='NOM=VALEUR',
+            help=f"Filtre de sélection, répétable ({', '.join(FILTER_PARAMS)}).",
+        )
+        # SUPPRESS : une option absente ne modifie pas le taux, 'none' l'efface
+        parser.add_argument('--do-rate', type=rate_argument, default=argparse.SUPPRESS, help="Nouveau taux DO ('none' pour l'effacer).")
+        parser.add_argument('--trc-rate', type=rate_argument, default=argparse.SUPPRESS, help="Nouveau taux TRC ('none' pour l'effacer).")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Calcule les écarts de prime sans rien enregistrer.")
+        parser.add_argument('--show-deltas', action='store_true', help="Affiche l'écart de prime DUO de chaque devis.")
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filter_proposals(Proposal.objects.all(), parse_filter_pairs(options['filters']))
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        rates = {field: options[field] for field in RATE_FIELDS if field in options}
+
+        report = reprice_proposals(
+            queryset,
+            rates=rates,
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+        )
+
+        if options['show_deltas']:
+            for delta in report['deltas']:
+                self.stdout.write(
+                    f"{delta['opportunity_number']}: {delta['old_prime_seule_tarif_duo']} -> "
+                    f"{delta['new_prime_seule_tarif_duo']} ({delta['delta']})"
+                )
+        prefix = "[simulation] " if report['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{report['selected']} devis sélectionnés, {report['changed']} modifiés, "
+            f"écart total DUO {report['total_duo_delta']} €, "
+            f"{report['rows_per_second']} lignes/s ({report['elapsed_seconds']} s)."
+        ))
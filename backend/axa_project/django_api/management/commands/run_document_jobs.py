@@ -0,0 +1,33 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_api.jobs import pending_job_ids, purge_due, purge_expired_jobs, requeue_stale_jobs, run_document_job
+
+
+class Command(BaseCommand):
+    help = "Traite les générations de documents en attente (worker autonome, sans Redis)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.DOCUMENT_JOB_WORKERS)
+        parser.add_argument('--loop', action='store_true', help="Continue d'interroger la file au lieu de s'arrêter quand elle est vide.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Pause (en secondes) entre deux interrogations d'une file vide.")
+
+    def handle(self, *args, **options):
+        processed = 0
+        purged = 0
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='document-job') as pool:
+            while True:
+                if purge_due():
+                    purged += purge_expired_jobs()
+                requeue_stale_jobs()
+                job_ids = pending_job_ids(limit=options['workers'] * 10)
+                # Seuls les jobs réellement pris par ce worker sont comptés
+                processed += sum(pool.map(run_document_job, job_ids))
+                if not options['loop'] and not job_ids:
+                    break
+                if not job_ids:
+                    time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"{processed} document(s) traité(s), {purged} job(s) expiré(s) supprimé(s)."))
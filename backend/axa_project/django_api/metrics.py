@@ -0,0 +1,181 @@
+"""
+Métriques du serveur au format texte Prometheus (`GET /metrics`).
+
+Compteurs et histogrammes sont tenus en mémoire, dans le processus : chaque
+processus serveur expose les siens (à l'image du cache 'locmem' et de la file
+d'historique), et Prometheus les additionne par instance. Les documents rendus par
+l'exécuteur 'process' des jobs (cf. jobs.py) sont mesurés dans les processus de
+rendu et n'apparaissent donc pas ici.
+
+Mesures par requête (cf. middleware.RequestMetricsMiddleware) : durée, nombre et
+durée des requêtes SQL, taille de la réponse, par vue et par action. S'y ajoutent
+la durée de rendu des documents par format, les succès et échecs des caches et,
+relevées à chaque lecture, la profondeur de la file d'historique et celle du pool de
+rendu des vues asynchrones.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def collect(self):
+        with self._lock:
+            return self.header() + self._samples()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f'{self.name}{_labels_text(self.label_names, key)} {_format_value(value)}'
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Effectifs par intervalle (le dernier au-delà du plus grand seuil), somme, nombre
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_labels_text(self.label_names, key, [le])} {cumulative}')
+            labels = _labels_text(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    """Valeur relevée au moment de la lecture par `read()` (ex. profondeur d'une file)."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, read):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def _samples(self):
+        return [f'{self.name} {_format_value(self.read())}']
+
+
+def _audit_queue_depth():
+    from .audit import audit_stats
+    return audit_stats()['queue_depth']
+
+
+def _render_pool_pending():
+    from .async_views import render_pool_pending
+    return render_pool_pending()
+
+
+REQUEST_LATENCY = Histogram(
+    'axa_http_request_duration_seconds', "Durée de traitement des requêtes HTTP.",
+    labels=('view', 'action', 'method', 'status'))
+REQUEST_DB_QUERIES = Histogram(
+    'axa_http_request_db_queries', "Nombre de requêtes SQL par requête HTTP.",
+    labels=('view', 'action'), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram(
+    'axa_http_request_db_duration_seconds', "Temps passé en base par requête HTTP.",
+    labels=('view', 'action'))
+RESPONSE_SIZE = Histogram(
+    'axa_http_response_size_bytes', "Taille du corps des réponses (hors réponses en flux sans Content-Length).",
+    labels=('view', 'action'), buckets=SIZE_BUCKETS)
+DOCUMENT_RENDER = Histogram(
+    'axa_document_render_duration_seconds', "Durée de rendu des documents, par format.",
+    labels=('format',))
+CACHE_REQUESTS = Counter(
+    'axa_cache_requests_total', "Lectures des caches de réponses et de documents.",
+    labels=('cache', 'result'))
+SLOW_REQUEST_PROFILES = Counter(
+    'axa_slow_request_profiles_total', "Profils cProfile enregistrés pour des requêtes lentes.",
+    labels=('view',))
+AUDIT_QUEUE_DEPTH = Gauge(
+    'axa_history_audit_queue_depth', "Entrées d'historique en attente d'écriture (mode 'queue').",
+    _audit_queue_depth)
+ASYNC_RENDER_PENDING = Gauge(
+    'axa_async_document_renders_pending', "Rendus de documents en cours ou en attente dans le pool des vues asynchrones.",
+    _render_pool_pending)
+
+REGISTRY = (
+    REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS, RESPONSE_SIZE,
+    DOCUMENT_RENDER, CACHE_REQUESTS, SLOW_REQUEST_PROFILES, AUDIT_QUEUE_DEPTH, ASYNC_RENDER_PENDING,
+)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,139 @@
+"""
+Mesure de chaque requête HTTP (cf. metrics.py) et profilage des requêtes lentes.
+
+La vue et l'action DRF servent d'étiquettes : 'proposal-list' / 'list',
+'proposal-generate-document' / 'generate_document', etc. Les requêtes SQL sont
+comptées et chronométrées sur toutes les connexions (lecture et écriture) par un
+`execute_wrapper`. Pour une réponse en flux (exports, ZIP), la durée s'arrête au
+début de l'envoi. Le middleware sert aussi bien WSGI qu'ASGI : sous ASGI, il ne
+renvoie pas les vues asynchrones (cf. async_views.py) dans un thread.
+
+Profilage (REQUEST_PROFILING, service WSGI seulement) : une requête sur
+REQUEST_PROFILE_SAMPLE_RATE est exécutée sous cProfile ; si elle dépasse
+REQUEST_PROFILE_SLOW_SECONDS, ses statistiques sont écrites dans
+REQUEST_PROFILE_DIR (lisibles avec `pstats` ou snakeviz).
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .metrics import (REQUEST_DB_QUERIES, REQUEST_DB_SECONDS, REQUEST_LATENCY, RESPONSE_SIZE,
+                      SLOW_REQUEST_PROFILES)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def view_labels(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', ''
+    # Vue DRF : correspondance méthode HTTP -> action posée par ViewSet.as_view
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), getattr(match.func, '__name__', ''))
+    return match.view_name or match.route, action
+
+
+def response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    length = response.get('Content-Length')
+    return int(length) if length else None
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profiler = None
+        if settings.REQUEST_PROFILING and random.random() < settings.REQUEST_PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        view = self.record(request, response, timer, elapsed)
+        if profiler is not None and elapsed >= settings.REQUEST_PROFILE_SLOW_SECONDS:
+            self.dump_profile(profiler, request, view, elapsed)
+        return response
+
+    async def __acall__(self, request):
+        # Service ASGI : pas de profilage, cProfile mêlerait toutes les requêtes de la boucle d'événements
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = await self.get_response(request)
+        self.record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, timer, elapsed):
+        view, action = view_labels(request)
+        REQUEST_LATENCY.observe(elapsed, view=view, action=action, method=request.method, status=response.status_code)
+        REQUEST_DB_QUERIES.observe(timer.count, view=view, action=action)
+        REQUEST_DB_SECONDS.observe(timer.seconds, view=view, action=action)
+        size = response_size(response)
+        if size is not None:
+            RESPONSE_SIZE.observe(size, view=view, action=action)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Requête traitée", extra={
+                'view': view, 'action': action, 'method': request.method, 'status': response.status_code,
+                'duration_ms': round(elapsed * 1e3, 1), 'db_queries': timer.count,
+                'db_ms': round(timer.seconds * 1e3, 1), 'size': size,
+            })
+        return view
+
+    def dump_profile(self, profiler, request, view, elapsed):
+        os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+        name = re.sub(r'[^\w.-]', '_', view)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{round(elapsed * 1e3)}ms-{os.getpid()}.prof"
+        path = os.path.join(settings.REQUEST_PROFILE_DIR, filename)
+        profiler.dump_stats(path)
+        SLOW_REQUEST_PROFILES.inc(view=view)
+        logger.warning("Requête lente profilée", extra={
+            'view': view, 'method': request.method, 'path': request.path,
+            'duration_ms': round(elapsed * 1e3, 1), 'profile': path,
+        })
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0002_proposal_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('doc_type', models.CharField(max_length=10, verbose_name='Type de document')),
+                ('status', models.CharField(choices=[('PENDING', 'En attente'), ('RUNNING', 'En cours'), ('DONE', 'Terminé'), ('FAILED', 'Échec')], default='PENDING', max_length=10, verbose_name='Statut')),
+                ('filename', models.CharField(blank=True, default='', max_length=255, verbose_name='Nom du fichier')),
+                ('file_path', models.CharField(blank=True, default='', max_length=500, verbose_name='Chemin du fichier généré')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Erreur')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date de demande')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Début du rendu')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Fin du rendu')),
+                ('proposal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_jobs', to='django_api.proposal', verbose_name='Devis')),
+            ],
+            options={
+                'verbose_name': 'Génération de document',
+                'verbose_name_plural': 'Générations de documents',
+                'indexes': [models.Index(fields=['status', 'created_at'], name='document_job_queue_idx')],
+            },
+        ),
+    ]
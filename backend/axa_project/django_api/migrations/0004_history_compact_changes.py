@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:59
+
+import json
+
+import django_api.history
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def compact_changes(apps, schema_editor):
+    # Les entrées existantes sont relues (décodées ou telles quelles) puis réécrites encodées
+    ProposalHistory = apps.get_model('django_api', 'ProposalHistory')
+    batch = []
+    for entry in ProposalHistory.objects.only('id', 'changes').iterator(chunk_size=BATCH_SIZE):
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            ProposalHistory.objects.bulk_update(batch, ['changes'])
+            batch = []
+    if batch:
+        ProposalHistory.objects.bulk_update(batch, ['changes'])
+
+
+def expand_changes(apps, schema_editor):
+    ProposalHistory = apps.get_model('django_api', 'ProposalHistory')
+    quote = schema_editor.connection.ops.quote_name
+    sql = f'UPDATE {quote(ProposalHistory._meta.db_table)} SET {quote("changes")} = %s WHERE {quote("id")} = %s'
+    rows = [(json.dumps(entry.changes), entry.pk) for entry in ProposalHistory.objects.only('id', 'changes').iterator(chunk_size=BATCH_SIZE)]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0003_document_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='proposalhistory',
+            name='changes',
+            field=django_api.history.HistoryChangesField(verbose_name='Changements'),
+        ),
+        migrations.AddIndex(
+            model_name='proposalhistory',
+            index=models.Index(fields=['proposal', 'timestamp'], name='history_proposal_ts_idx'),
+        ),
+        migrations.RunPython(compact_changes, expand_changes),
+    ]
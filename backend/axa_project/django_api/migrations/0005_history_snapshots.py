@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:02
+
+import django_api.history
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+BATCH_SIZE = 2000
+
+
+def seed_snapshots(apps, schema_editor):
+    # Version = nombre d'entrées existantes ; la dernière entrée de chaque devis reçoit
+    # l'état actuel comme instantané, point d'appui des reconstructions sur l'historique existant
+    Proposal = apps.get_model('django_api', 'Proposal')
+    ProposalHistory = apps.get_model('django_api', 'ProposalHistory')
+    stats = ProposalHistory.objects.order_by().values('proposal_id').annotate(count=Count('id'), last_id=Max('id'))
+    versions = {row['proposal_id']: (row['count'], row['last_id']) for row in stats}
+
+    proposals = []
+    entries = []
+    for proposal in Proposal.objects.filter(pk__in=list(versions)).iterator(chunk_size=BATCH_SIZE):
+        proposal.history_version, last_id = versions[proposal.pk]
+        proposals.append(proposal)
+        entries.append(ProposalHistory(id=last_id, snapshot=django_api.history.proposal_snapshot(proposal)))
+        if len(proposals) >= BATCH_SIZE:
+            Proposal.objects.bulk_update(proposals, ['history_version'])
+            ProposalHistory.objects.bulk_update(entries, ['snapshot'])
+            proposals, entries = [], []
+    if proposals:
+        Proposal.objects.bulk_update(proposals, ['history_version'])
+        ProposalHistory.objects.bulk_update(entries, ['snapshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0004_history_compact_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposal',
+            name='history_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Version de l'historique"),
+        ),
+        migrations.AddField(
+            model_name='proposalhistory',
+            name='snapshot',
+            field=django_api.history.HistorySnapshotField(blank=True, null=True, verbose_name='Instantané du devis'),
+        ),
+        migrations.RunPython(seed_snapshots, migrations.RunPython.noop),
+    ]
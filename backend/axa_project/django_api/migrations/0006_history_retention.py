@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0005_history_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='Mois archivé')),
+                ('file_path', models.CharField(max_length=500, verbose_name="Fichier d'archive")),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name="Nombre d'entrées archivées")),
+                ('archived_before', models.DateTimeField(verbose_name="Archivé jusqu'au")),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Date de mise à jour')),
+            ],
+            options={
+                'verbose_name': "Archive de l'historique",
+                'verbose_name_plural': "Archives de l'historique",
+                'ordering': ['month'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='proposalhistory',
+            index=models.Index(fields=['timestamp'], name='history_timestamp_idx'),
+        ),
+    ]
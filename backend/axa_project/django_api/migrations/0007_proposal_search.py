@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:40
+
+from django.db import migrations
+
+# Index plein texte SQLite FTS5 des devis (cf. django_api/search.py). Table à contenu
+# externe : elle n'indexe que les textes, relus dans django_api_proposal au besoin.
+# Les déclencheurs la tiennent à jour pour toutes les écritures, y compris les
+# mises à jour groupées (import, retarification) qui ne passent pas par save().
+CREATE_SEARCH = [
+    """
+    CREATE VIRTUAL TABLE django_api_proposal_search USING fts5(
+        opportunity_number, client_name, ouvrage_description, address_chantier,
+        content='django_api_proposal', content_rowid='id',
+        tokenize="unicode61 remove_diacritics 2", prefix='2 3'
+    )
+    """,
+    # Pertinence : le numéro d'opportunité et le client pèsent plus que la description
+    "INSERT INTO django_api_proposal_search(django_api_proposal_search, rank) VALUES('rank', 'bm25(10.0, 5.0, 1.0, 2.0)')",
+    """
+    CREATE TRIGGER django_api_proposal_search_insert AFTER INSERT ON django_api_proposal BEGIN
+        INSERT INTO django_api_proposal_search(rowid, opportunity_number, client_name, ouvrage_description, address_chantier)
+        VALUES (new.id, new.opportunity_number, new.client_name, new.ouvrage_description, new.address_chantier);
+    END
+    """,
+    """
+    CREATE TRIGGER django_api_proposal_search_delete AFTER DELETE ON django_api_proposal BEGIN
+        INSERT INTO django_api_proposal_search(django_api_proposal_search, rowid, opportunity_number, client_name, ouvrage_description, address_chantier)
+        VALUES ('delete', old.id, old.opportunity_number, old.client_name, old.ouvrage_description, old.address_chantier);
+    END
+    """,
+    # Seules les modifications des champs indexés touchent l'index (pas la retarification)
+    """
+    CREATE TRIGGER django_api_proposal_search_update
+    AFTER UPDATE OF opportunity_number, client_name, ouvrage_description, address_chantier ON django_api_proposal BEGIN
+        INSERT INTO django_api_proposal_search(django_api_proposal_search, rowid, opportunity_number, client_name, ouvrage_description, address_chantier)
+        VALUES ('delete', old.id, old.opportunity_number, old.client_name, old.ouvrage_description, old.address_chantier);
+        INSERT INTO django_api_proposal_search(rowid, opportunity_number, client_name, ouvrage_description, address_chantier)
+        VALUES (new.id, new.opportunity_number, new.client_name, new.ouvrage_description, new.address_chantier);
+    END
+    """,
+    # Indexation des devis existants
+    "INSERT INTO django_api_proposal_search(django_api_proposal_search) VALUES('rebuild')",
+]
+
+DROP_SEARCH = [
+    'DROP TRIGGER IF EXISTS django_api_proposal_search_update',
+    'DROP TRIGGER IF EXISTS django_api_proposal_search_delete',
+    'DROP TRIGGER IF EXISTS django_api_proposal_search_insert',
+    'DROP TABLE IF EXISTS django_api_proposal_search',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0006_history_retention'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH, reverse_sql=DROP_SEARCH),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:20
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Count, DateField, F, Sum
+from django.db.models.functions import Cast, Round, TruncMonth
+
+GROUP_FIELDS = ('guarantee_type', 'ouvrage_destination', 'work_type', 'is_vip_client', 'rcmo_desired')
+MEASURE_FIELDS = ('ouvrage_cost', 'prime_seule_tarif_do', 'prime_seule_tarif_trc', 'prime_seule_tarif_duo')
+
+
+def grouped_totals(Proposal):
+    # Copie figée de analytics.grouped_totals : une migration ne dépend pas du code vivant
+    totals = {'proposal_count': Count('id')}
+    for name in MEASURE_FIELDS:
+        totals[f'{name}_cents'] = Sum(Cast(Round(F(name) * 100), BigIntegerField()), default=0)
+    return (Proposal.objects.order_by()
+            .values(month=TruncMonth('created_at', output_field=DateField()), *GROUP_FIELDS)
+            .annotate(**totals))
+
+
+
+def fill_summaries(apps, schema_editor):
+    # Totaux des devis existants ; les écritures suivantes les tiennent à jour par deltas
+    Proposal = apps.get_model('django_api', 'Proposal')
+    ProposalSummary = apps.get_model('django_api', 'ProposalSummary')
+    ProposalSummary.objects.bulk_create(
+        ProposalSummary(**row) for row in grouped_totals(Proposal)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0007_proposal_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProposalSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Mois de création')),
+                ('guarantee_type', models.CharField(choices=[('DO', 'DO seule'), ('TRC', 'TRC seule'), ('DUO', 'DUO (DO + TRC)')], max_length=10, verbose_name='Type de garantie')),
+                ('ouvrage_destination', models.CharField(blank=True, choices=[('HABITATION', 'Habitation'), ('HORS_HABITATION', 'Hors Habitation')], max_length=20, verbose_name="Destination de l'ouvrage")),
+                ('work_type', models.CharField(choices=[('NEUF', 'Ouvrage Neuf'), ('RENOVATIONLE', 'Rénovation légère'), ('RENOVATIONLD', 'Rénovation lourde')], max_length=20, verbose_name='Type de travaux')),
+                ('is_vip_client', models.BooleanField(verbose_name='Client VIP')),
+                ('rcmo_desired', models.BooleanField(verbose_name='RCMO souhaitée')),
+                ('proposal_count', models.IntegerField(default=0, verbose_name='Nombre de devis')),
+                ('ouvrage_cost_cents', models.BigIntegerField(default=0, verbose_name='Coût des ouvrages (centimes)')),
+                ('prime_seule_tarif_do_cents', models.BigIntegerField(default=0, verbose_name='Primes DO (centimes)')),
+                ('prime_seule_tarif_trc_cents', models.BigIntegerField(default=0, verbose_name='Primes TRC (centimes)')),
+                ('prime_seule_tarif_duo_cents', models.BigIntegerField(default=0, verbose_name='Primes DUO (centimes)')),
+            ],
+            options={
+                'verbose_name': 'Synthèse du portefeuille',
+                'verbose_name_plural': 'Synthèses du portefeuille',
+                'constraints': [models.UniqueConstraint(fields=('month', 'guarantee_type', 'ouvrage_destination', 'work_type', 'is_vip_client', 'rcmo_desired'), name='proposal_summary_group_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
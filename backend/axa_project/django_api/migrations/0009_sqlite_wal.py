@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def set_journal_mode(connection, mode):
+    # Copie figée de db_router.set_journal_mode : une migration ne dépend pas du code vivant
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {mode}')
+
+
+def enable_wal(apps, schema_editor):
+    # Enregistré dans le fichier : toutes les connexions suivantes l'utilisent, quel que
+    # soit le profil (DATABASE_PROFILE) actif au moment de la migration
+    set_journal_mode(schema_editor.connection, 'wal')
+
+
+def disable_wal(apps, schema_editor):
+    set_journal_mode(schema_editor.connection, 'delete')
+
+
+class Migration(migrations.Migration):
+    # PRAGMA journal_mode ne peut pas changer dans une transaction
+    atomic = False
+
+    dependencies = [
+        ('django_api', '0008_proposal_summaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
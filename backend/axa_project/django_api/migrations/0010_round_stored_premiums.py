@@ -0,0 +1,54 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.db import migrations
+from django.db.models import BigIntegerField, Count, DateField, F, Sum
+from django.db.models.functions import Cast, Round, TruncMonth
+
+PREMIUM_FIELDS = ('prime_seule_tarif_do', 'prime_seule_tarif_trc', 'prime_seule_tarif_duo')
+GROUP_FIELDS = ('guarantee_type', 'ouvrage_destination', 'work_type', 'is_vip_client', 'rcmo_desired')
+MEASURE_FIELDS = ('ouvrage_cost', 'prime_seule_tarif_do', 'prime_seule_tarif_trc', 'prime_seule_tarif_duo')
+
+
+def grouped_totals(Proposal):
+    # Copie figée de analytics.grouped_totals : une migration ne dépend pas du code vivant
+    totals = {'proposal_count': Count('id')}
+    for name in MEASURE_FIELDS:
+        totals[f'{name}_cents'] = Sum(Cast(Round(F(name) * 100), BigIntegerField()), default=0)
+    return (Proposal.objects.order_by()
+            .values(month=TruncMonth('created_at', output_field=DateField()), *GROUP_FIELDS)
+            .annotate(**totals))
+
+
+def round_stored(value):
+    # Copie figée de pricing.round_stored : arrondi demi-pair au centime
+    return value.quantize(Decimal('0.01'), rounding=ROUND_HALF_EVEN)
+
+
+def round_premiums(apps, schema_editor):
+    # Primes enregistrées sans arrondi par Proposal.save (ex. 0.005) : Django les relisait à 0.00,
+    # ROUND en SQL à 0.01. On les arrondit comme price_instance, puis on recalcule les synthèses
+    Proposal = apps.get_model('django_api', 'Proposal')
+    ProposalSummary = apps.get_model('django_api', 'ProposalSummary')
+    quote = schema_editor.connection.ops.quote_name
+    table = quote(Proposal._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        for name in PREMIUM_FIELDS:
+            column = quote(name)
+            cursor.execute(f'SELECT id, {column} FROM {table} WHERE {column} != ROUND({column}, 2)')
+            updates = [(str(round_stored(Decimal(str(value)))), pk) for pk, value in cursor.fetchall()]
+            cursor.executemany(f'UPDATE {table} SET {column} = %s WHERE id = %s', updates)
+    ProposalSummary.objects.all().delete()
+    ProposalSummary.objects.bulk_create(
+        ProposalSummary(**row) for row in grouped_totals(Proposal)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_api', '0009_sqlite_wal'),
+    ]
+
+    operations = [
+        migrations.RunPython(round_premiums, migrations.RunPython.noop),
+    ]
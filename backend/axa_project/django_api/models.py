@@ -1,8 +1,20 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.core.exceptions import ValidationError
 from decimal import Decimal
 from django.conf import settings
 from django.utils import timezone
+import logging
+import uuid
+
+from .audit import record_history
+from .history import HistoryChangesField, HistorySnapshotField, decimal_text, needs_snapshot, proposal_snapshot
+from .pricing import price_instance
+from .signals import proposal_changed
+from .summaries import SUMMARY_FIELDS, SummaryDelta, instance_values
+
+logger = logging.getLogger(__name__)
+
+CREATION_CHANGES = {'status': {'old': None, 'new': 'Created'}}
 
 class Proposal(models.Model):
     GUARANTEE_TYPE_CHOICES = [
@@ -66,16 +78,70 @@ class Proposal(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Date de création")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Date de mise à jour")
+    # Nombre d'entrées d'historique : rythme les instantanés (cf. history.needs_snapshot)
+    history_version = models.PositiveIntegerField(default=0, editable=False, verbose_name="Version de l'historique")
+
+    # Champs ignorés lors du calcul des différences pour l'historique
+    UNTRACKED_FIELDS = ('id', 'created_at', 'updated_at', 'history_version')
+
+    _loaded_values = None
 
-    _original_values = None
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # On garde une simple référence au tuple lu en base : le dictionnaire des anciennes
+        # valeurs n'est construit que si l'instance est réellement sauvegardée.
+        instance._loaded_values = (field_names, values)
+        return instance
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._original_values = {field.name: getattr(self, field.name) for field in self._meta.fields if hasattr(self, field.name)}
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._capture_loaded_values(fields)
+
+    def _capture_loaded_values(self, fields=None):
+        if fields is None:
+            loaded = {}
+            fields = [field.attname for field in self._meta.concrete_fields]
+        else:
+            # Rechargement partiel (ex. champ différé) : on ne touche qu'aux champs relus
+            loaded = self.get_loaded_values() or {}
+        for name in fields:
+            if name in self.__dict__:
+                loaded[name] = self.__dict__[name]
+        self._loaded_values = (tuple(loaded), tuple(loaded.values()))
+
+    def get_loaded_values(self):
+        if self._loaded_values is None:
+            return None
+        field_names, values = self._loaded_values
+        return dict(zip(field_names, values))
 
     def __str__(self):
         return f"Devis {self.opportunity_number} - {self.client_name}"
 
+    def get_changes(self, old_values, fields=None):
+        changed_fields = {}
+        for field in self._meta.concrete_fields:
+            field_name = field.name
+            if field_name in self.UNTRACKED_FIELDS or field.attname not in old_values:
+                continue
+            if fields is not None and field_name not in fields:
+                continue
+
+            old_value = old_values[field.attname]
+            new_value = getattr(self, field.attname)
+
+            if isinstance(field, models.DecimalField):
+                # Comparaison à la précision de la colonne : une prime recalculée qui
+                # s'arrondit au même centime n'est pas une modification
+                old_value_str = decimal_text(field.to_python(old_value), field.decimal_places)
+                new_value_str = decimal_text(field.to_python(new_value), field.decimal_places)
+                if old_value_str != new_value_str:
+                    changed_fields[field_name] = {'old': old_value_str, 'new': new_value_str}
+            elif old_value != new_value:
+                changed_fields[field_name] = {'old': old_value, 'new': new_value}
+        return changed_fields
+
     def clean(self):
         super().clean()
         if self.ouvrage_destination != '' and self.guarantee_type == 'TRC':
@@ -94,95 +160,82 @@ class Proposal(models.Model):
     def save(self, *args, **kwargs):
         user_ip = kwargs.pop('user_ip', None)
         is_new = self._state.adding
-        old_instance = None
+        old_values = None
         if not is_new:
-            try:
-                old_instance = Proposal.objects.get(pk=self.pk)
-            except Proposal.DoesNotExist:
-                is_new = True 
-
-        cost = self.ouvrage_cost if self.ouvrage_cost is not None else Decimal('0.0')
-        trc_r = self.trc_rate if self.trc_rate is not None else Decimal('0.0')
-        do_r = self.do_rate if self.do_rate is not None else Decimal('0.0')
-
-        cost = cost if cost is not None else Decimal('0.0')
-
-
-        calculated_do_prime = do_r * cost
-        calculated_trc_prime = trc_r * cost
-
-        if self.guarantee_type == 'DO':
-            self.prime_seule_tarif_do = calculated_do_prime
-            self.prime_seule_tarif_trc = None
-            self.prime_seule_tarif_duo = calculated_do_prime
-        elif self.guarantee_type == 'TRC':
-            self.prime_seule_tarif_trc = calculated_trc_prime
-            self.prime_seule_tarif_do = None
-            self.prime_seule_tarif_duo = calculated_trc_prime
-        elif self.guarantee_type == 'DUO':
-            # Si un taux est fourni, la prime correspondante est calculée. Sinon, elle est None.
-            self.prime_seule_tarif_do = calculated_do_prime if self.do_rate is not None else None
-            self.prime_seule_tarif_trc = calculated_trc_prime if self.trc_rate is not None else None
-            
-            # prime_seule_tarif_duo est la somme des deux primes calculées (celles qui ne sont pas None)
-            sum_prime_do = self.prime_seule_tarif_do if self.prime_seule_tarif_do is not None else Decimal('0.0')
-            sum_prime_trc = self.prime_seule_tarif_trc if self.prime_seule_tarif_trc is not None else Decimal('0.0')
-            
-            # Si les deux taux sont None (et donc les deux primes individuelles sont None), la prime DUO devrait être 0 ou None.
-            # Si au moins un taux est fourni, la prime DUO est la somme.
-            if self.do_rate is None and self.trc_rate is None:
-                 self.prime_seule_tarif_duo = Decimal('0.0') # Ou None, selon la préférence métier
-            else:
-                 self.prime_seule_tarif_duo = sum_prime_do + sum_prime_trc
-        
-        else: 
-            self.prime_seule_tarif_do = None
-            self.prime_seule_tarif_trc = None
-            self.prime_seule_tarif_duo = None
-        print(f"Calculated DO Prime: {self.prime_seule_tarif_do}, TRC Prime: {self.prime_seule_tarif_trc}, DUO Prime: {self.prime_seule_tarif_duo}")
-        
-        super().save(*args, **kwargs)
+            old_values = self.get_loaded_values()
+            if old_values is None:
+                # Instance construite à la main avec une pk : on relit la ligne une seule fois
+                old_instance = Proposal.objects.filter(pk=self.pk).first()
+                if old_instance is None:
+                    is_new = True
+                else:
+                    old_values = old_instance.get_loaded_values()
+        summary_before = None if is_new else self._summary_values(old_values)
+
+        price_instance(self)
+        logger.debug("Primes calculées", extra={
+            'opportunity_number': self.opportunity_number, 'prime_do': self.prime_seule_tarif_do,
+            'prime_trc': self.prime_seule_tarif_trc, 'prime_duo': self.prime_seule_tarif_duo,
+        })
 
         changed_fields = {}
-        if not is_new and old_instance:
-            for field in self._meta.fields:
-                field_name = field.name
-                if field_name in ['id', 'created_at', 'updated_at', '_original_values']:
-                    continue
-                
-                old_value = getattr(old_instance, field_name)
-                new_value = getattr(self, field_name)
-
-                if isinstance(old_value, Decimal) or isinstance(new_value, Decimal):
-                    old_value_str = str(old_value.normalize()) if old_value is not None else None
-                    new_value_str = str(new_value.normalize()) if new_value is not None else None
-                    if old_value_str != new_value_str:
-                        changed_fields[field_name] = {'old': old_value_str, 'new': new_value_str}
-                elif old_value != new_value:
-                    changed_fields[field_name] = {'old': old_value, 'new': new_value}
-            
+        if is_new: # Log creation
+            changed_fields = CREATION_CHANGES
+        elif old_values is not None:
+            changed_fields = self.get_changes(old_values)
+        if changed_fields:
+            # La version est enregistrée avec le devis, dans le même UPDATE
+            self.history_version += 1
+
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Proposal, instance=self)):
+            super().save(*args, **kwargs)
             if changed_fields:
-                ProposalHistory.objects.create(
-                    proposal=self,
-                    changes=changed_fields,
-                    user_ip=user_ip 
-                )
-        elif is_new: # Log creation
-            ProposalHistory.objects.create(
-                proposal=self,
-                changes={'status': {'old': None, 'new': 'Created'}},
-                user_ip=user_ip
-            )
+                # Totaux des tables de synthèse : retrait des anciennes valeurs, ajout des nouvelles
+                delta = SummaryDelta()
+                if summary_before is not None:
+                    delta.remove(summary_before)
+                delta.add(instance_values(self))
+                delta.apply(self._state.db)
+
+        if changed_fields:
+            record_history(ProposalHistory(
+                proposal_id=self.pk,
+                changes=changed_fields,
+                user_ip=user_ip,
+                snapshot=proposal_snapshot(self) if needs_snapshot(self.history_version) else None,
+            ))
+            proposal_changed.send(sender=Proposal, instance=self, created=is_new, changes=changed_fields, user_ip=user_ip)
+
+        self._capture_loaded_values()
+
+    def _summary_values(self, old_values):
+        missing = [name for name in SUMMARY_FIELDS if name not in old_values]
+        if missing:
+            # Instance chargée partiellement (only/defer) : les champs absents sont relus avant l'écriture
+            old_values = {**old_values, **Proposal.objects.filter(pk=self.pk).values(*missing).first()}
+        return old_values
 
     class Meta:
         verbose_name = "Proposition de devis"
         verbose_name_plural = "Propositions de devis"
+        # Colonnes filtrées et triées par la liste paginée (l'id est inclus implicitement par SQLite)
+        indexes = [
+            models.Index(fields=['client_name'], name='proposal_client_name_idx'),
+            models.Index(fields=['guarantee_type'], name='proposal_guarantee_type_idx'),
+            models.Index(fields=['ouvrage_destination'], name='proposal_destination_idx'),
+            models.Index(fields=['work_type'], name='proposal_work_type_idx'),
+            models.Index(fields=['ouvrage_cost'], name='proposal_ouvrage_cost_idx'),
+            models.Index(fields=['prime_seule_tarif_duo'], name='proposal_prime_duo_idx'),
+            models.Index(fields=['created_at'], name='proposal_created_at_idx'),
+            models.Index(fields=['updated_at'], name='proposal_updated_at_idx'),
+        ]
 
 class ProposalHistory(models.Model):
     proposal = models.ForeignKey(Proposal, related_name='history_entries', on_delete=models.CASCADE, verbose_name="Devis")
     user_ip = models.GenericIPAddressField(null=True, blank=True, verbose_name="IP de l'utilisateur")
     timestamp = models.DateTimeField(default=timezone.now, verbose_name="Date de modification")
-    changes = models.JSONField(verbose_name="Changements")
+    changes = HistoryChangesField(verbose_name="Changements")
+    snapshot = HistorySnapshotField(null=True, blank=True, verbose_name="Instantané du devis")
 
     def __str__(self):
         return f"Modification du devis {self.proposal.opportunity_number} par {self.user_ip} le {self.timestamp.strftime('%d/%m/%Y %H:%M')}"
@@ -191,3 +244,85 @@ class ProposalHistory(models.Model):
         verbose_name = "Historique de modification de devis"
         verbose_name_plural = "Historiques des modifications de devis"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['proposal', 'timestamp'], name='history_proposal_ts_idx'),
+            # Parcours des entrées les plus anciennes par la rétention (cf. retention.py)
+            models.Index(fields=['timestamp'], name='history_timestamp_idx'),
+        ]
+
+class HistoryArchive(models.Model):
+    month = models.DateField(unique=True, verbose_name="Mois archivé")
+    file_path = models.CharField(max_length=500, verbose_name="Fichier d'archive")
+    entries = models.PositiveIntegerField(default=0, verbose_name="Nombre d'entrées archivées")
+    # Toutes les entrées antérieures à cette date ont quitté la table d'historique
+    archived_before = models.DateTimeField(verbose_name="Archivé jusqu'au")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Date de mise à jour")
+
+    def __str__(self):
+        return f"Archive de l'historique {self.month.strftime('%m/%Y')} ({self.entries} entrées)"
+
+    class Meta:
+        verbose_name = "Archive de l'historique"
+        verbose_name_plural = "Archives de l'historique"
+        ordering = ['month']
+
+class ProposalSummary(models.Model):
+    """Totaux d'un groupe de devis, tenus à jour par deltas (cf. summaries.py)."""
+    month = models.DateField(verbose_name="Mois de création")
+    guarantee_type = models.CharField(max_length=10, choices=Proposal.GUARANTEE_TYPE_CHOICES, verbose_name="Type de garantie")
+    ouvrage_destination = models.CharField(max_length=20, choices=Proposal.OUVRAGE_DESTINATION_CHOICES, blank=True, verbose_name="Destination de l'ouvrage")
+    work_type = models.CharField(max_length=20, choices=Proposal.WORK_TYPE_CHOICES, verbose_name="Type de travaux")
+    is_vip_client = models.BooleanField(verbose_name="Client VIP")
+    rcmo_desired = models.BooleanField(verbose_name="RCMO souhaitée")
+    proposal_count = models.IntegerField(default=0, verbose_name="Nombre de devis")
+    ouvrage_cost_cents = models.BigIntegerField(default=0, verbose_name="Coût des ouvrages (centimes)")
+    prime_seule_tarif_do_cents = models.BigIntegerField(default=0, verbose_name="Primes DO (centimes)")
+    prime_seule_tarif_trc_cents = models.BigIntegerField(default=0, verbose_name="Primes TRC (centimes)")
+    prime_seule_tarif_duo_cents = models.BigIntegerField(default=0, verbose_name="Primes DUO (centimes)")
+
+    def __str__(self):
+        return f"Synthèse {self.month.strftime('%m/%Y')} {self.guarantee_type}/{self.ouvrage_destination}/{self.work_type} ({self.proposal_count} devis)"
+
+    class Meta:
+        verbose_name = "Synthèse du portefeuille"
+        verbose_name_plural = "Synthèses du portefeuille"
+        constraints = [
+            # Cible de l'INSERT ... ON CONFLICT des deltas
+            models.UniqueConstraint(
+                fields=['month', 'guarantee_type', 'ouvrage_destination', 'work_type', 'is_vip_client', 'rcmo_desired'],
+                name='proposal_summary_group_uniq',
+            ),
+        ]
+
+class DocumentJob(models.Model):
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En attente'),
+        (STATUS_RUNNING, 'En cours'),
+        (STATUS_DONE, 'Terminé'),
+        (STATUS_FAILED, 'Échec'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    proposal = models.ForeignKey(Proposal, related_name='document_jobs', on_delete=models.CASCADE, verbose_name="Devis")
+    doc_type = models.CharField(max_length=10, verbose_name="Type de document")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Statut")
+    filename = models.CharField(max_length=255, blank=True, default="", verbose_name="Nom du fichier")
+    file_path = models.CharField(max_length=500, blank=True, default="", verbose_name="Chemin du fichier généré")
+    error = models.TextField(blank=True, default="", verbose_name="Erreur")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Date de demande")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Début du rendu")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Fin du rendu")
+
+    def __str__(self):
+        return f"Document {self.doc_type} du devis {self.proposal_id} ({self.status})"
+
+    class Meta:
+        verbose_name = "Génération de document"
+        verbose_name_plural = "Générations de documents"
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='document_job_queue_idx'),
+        ]
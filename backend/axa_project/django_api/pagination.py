@@ -0,0 +1,167 @@
+import base64
+import json
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .filters import NULLABLE_ORDERING_FIELDS, get_ordering
+
+DECIMAL_ORDERING_FIELDS = ('ouvrage_cost', 'prime_seule_tarif_duo')
+DATETIME_ORDERING_FIELDS = ('created_at', 'updated_at', 'timestamp')
+
+
+def encode_cursor(value, pk):
+    if value is not None and not isinstance(value, str):
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    raw = json.dumps([value, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, field):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        pk = int(pk)
+        if value is not None:
+            if field in DECIMAL_ORDERING_FIELDS:
+                value = Decimal(value)
+            elif field in DATETIME_ORDERING_FIELDS:
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError(cursor)
+            elif field == 'id':
+                value = int(value)
+        return value, pk
+    except (TypeError, ValueError, ArithmeticError, json.JSONDecodeError):
+        raise NotFound("Curseur invalide.")
+
+
+def keyset_filter(field, descending, value, pk):
+    # Prédicats "seekables" : la borne sur la colonne triée vient en premier pour que
+    # SQLite parcoure l'index à partir du curseur au lieu de compter un OFFSET.
+    # SQLite classe les NULL comme les plus petites valeurs (en tête en ASC, en fin en DESC).
+    if field == 'id':
+        return Q(id__lt=pk) if descending else Q(id__gt=pk)
+
+    nullable = field in NULLABLE_ORDERING_FIELDS
+    if not descending:
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'id__gt': pk}) | Q(**{f'{field}__isnull': False})
+        return Q(**{f'{field}__gte': value}) & (Q(**{f'{field}__gt': value}) | Q(id__gt=pk))
+
+    if value is None:
+        return Q(**{f'{field}__isnull': True, 'id__lt': pk})
+    predicate = Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(id__lt=pk))
+    if nullable:
+        predicate |= Q(**{f'{field}__isnull': True})
+    return predicate
+
+
+class ProposalCursorPagination(BasePagination):
+    """
+    Pagination par clé (keyset) : chaque page est une lecture d'index bornée par le
+    dernier couple (clé de tri, id) renvoyé, son coût ne dépend donc pas de la profondeur.
+    La pagination n'est activée que si `page_size` est fourni, afin que les clients
+    qui attendent la liste complète continuent de fonctionner.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if not value:
+            return None
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: "Taille de page invalide."})
+        if page_size <= 0:
+            raise ValidationError({self.page_size_query_param: "Taille de page invalide."})
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        return get_ordering(request.query_params)
+
+    def page_queryset(self, queryset, request):
+        # Requête de la page (une ligne de plus pour savoir s'il y a une suite), ou None sans pagination
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.request = request
+        self.field, self.descending = self.get_ordering(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = decode_cursor(cursor, self.field)
+            queryset = queryset.filter(keyset_filter(self.field, self.descending, value, pk))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request):
+        # Variante des vues asynchrones (cf. async_views.py) : même page, lue par l'ORM asynchrone
+        queryset = self.page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        if isinstance(last, dict):
+            # Ligne lue par .values() (cf. projection.py)
+            cursor = encode_cursor(last[self.field], last['id'])
+        else:
+            cursor = encode_cursor(getattr(last, self.field), last.pk)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'first': self.get_first_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class HistoryCursorPagination(ProposalCursorPagination):
+    """
+    Historique d'un devis, du plus récent au plus ancien, toujours paginé : l'index
+    (proposal, timestamp) sert à la fois le filtre et le tri, id compris.
+    """
+    default_page_size = 50
+
+    def get_page_size(self, request):
+        return super().get_page_size(request) or self.default_page_size
+
+    def get_ordering(self, request):
+        return 'timestamp', True
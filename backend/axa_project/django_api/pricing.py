@@ -0,0 +1,183 @@
+"""
+Moteur de tarification des primes DO / TRC / DUO.
+
+`price_proposal` tarife un devis unique avec des `Decimal`, exactement comme
+`Proposal.save` l'a toujours fait. `price_batch` applique les mêmes règles à des
+colonnes entières en une seule passe numpy : les montants y sont représentés en
+entiers à virgule fixe (centimes pour le coût, 1e-4 pour les taux, 1e-6 pour les
+primes), ce qui rend le calcul exact et donc identique au calcul en `Decimal`.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_EVEN, Decimal
+
+import numpy as np
+
+ZERO = Decimal('0.0')
+
+# Nombre de décimales des colonnes du modèle Proposal
+COST_PLACES = 2
+RATE_PLACES = 4
+PREMIUM_PLACES = COST_PLACES + RATE_PLACES
+STORED_PREMIUM_PLACES = 2
+STORED_CENT = Decimal(1).scaleb(-STORED_PREMIUM_PLACES)
+
+INT64_MAX = np.iinfo(np.int64).max
+
+Premiums = namedtuple('Premiums', ['do', 'trc', 'duo'])
+
+
+def price_proposal(guarantee_type, ouvrage_cost, do_rate, trc_rate):
+    cost = ouvrage_cost if ouvrage_cost is not None else ZERO
+    do_r = do_rate if do_rate is not None else ZERO
+    trc_r = trc_rate if trc_rate is not None else ZERO
+
+    calculated_do_prime = do_r * cost
+    calculated_trc_prime = trc_r * cost
+
+    if guarantee_type == 'DO':
+        return Premiums(calculated_do_prime, None, calculated_do_prime)
+    if guarantee_type == 'TRC':
+        return Premiums(None, calculated_trc_prime, calculated_trc_prime)
+    if guarantee_type == 'DUO':
+        # Si un taux est fourni, la prime correspondante est calculée. Sinon, elle est None.
+        prime_do = calculated_do_prime if do_rate is not None else None
+        prime_trc = calculated_trc_prime if trc_rate is not None else None
+        # Sans aucun taux, la prime DUO vaut 0 ; sinon c'est la somme des primes calculées
+        if do_rate is None and trc_rate is None:
+            return Premiums(prime_do, prime_trc, ZERO)
+        return Premiums(prime_do, prime_trc, (prime_do or ZERO) + (prime_trc or ZERO))
+    return Premiums(None, None, None)
+
+
+def round_stored(value):
+    # Arrondi demi-pair au centime, comme round_to_cents pour les colonnes
+    return None if value is None else value.quantize(STORED_CENT, rounding=ROUND_HALF_EVEN)
+
+
+def price_instance(proposal):
+    # Primes arrondies avant l'enregistrement : la base (y compris ses ROUND en SQL), l'instance
+    # et les tables de synthèse voient la même valeur
+    premiums = Premiums(*map(round_stored, price_proposal(
+        proposal.guarantee_type, proposal.ouvrage_cost, proposal.do_rate, proposal.trc_rate)))
+    proposal.prime_seule_tarif_do, proposal.prime_seule_tarif_trc, proposal.prime_seule_tarif_duo = premiums
+    return premiums
+
+
+FixedColumn = namedtuple('FixedColumn', ['units', 'nulls'])
+
+
+def _int_array(units):
+    try:
+        return np.asarray(units, dtype=np.int64)
+    except OverflowError:
+        return np.asarray(units, dtype=object)
+
+
+def to_fixed(values, places):
+    """Convertit une séquence de Decimal/None en colonne d'entiers à virgule fixe."""
+    units = []
+    nulls = []
+    for value in values:
+        if value is None:
+            units.append(0)
+            nulls.append(True)
+            continue
+        scaled = Decimal(value).scaleb(places)
+        unit = int(scaled)
+        if unit != scaled:
+            raise ValueError(f"{value} a plus de {places} décimales")
+        units.append(unit)
+        nulls.append(False)
+    return FixedColumn(_int_array(units), np.array(nulls, dtype=bool))
+
+
+def _max_abs(units):
+    return int(np.abs(units).max()) if len(units) else 0
+
+
+def _product_dtype(cost, *rates):
+    # Les colonnes du modèle tiennent en int64, mais leur produit peut déborder
+    # (12 chiffres x 7 chiffres) : on bascule alors sur des entiers Python.
+    max_rate = max(_max_abs(rate) for rate in rates)
+    return np.int64 if _max_abs(cost) * max_rate * 2 <= INT64_MAX else object
+
+
+def round_to_cents(units):
+    # Arrondi demi-pair au centime d'une colonne en 1e-6 €, comme le stockage en base
+    scale = 10 ** (PREMIUM_PLACES - STORED_PREMIUM_PLACES)
+    quotient, remainder = units // scale, units % scale
+    half = scale // 2
+    return quotient + ((remainder > half) | ((remainder == half) & (quotient % 2 == 1)))
+
+
+class PremiumColumns:
+    """Résultat de `price_batch` : primes en 1e-6 € et masques des valeurs None."""
+
+    def __init__(self, do, trc, duo, do_null, trc_null, duo_null):
+        self.do = do
+        self.trc = trc
+        self.duo = duo
+        self.do_null = do_null
+        self.trc_null = trc_null
+        self.duo_null = duo_null
+
+    def __len__(self):
+        return len(self.duo)
+
+    @staticmethod
+    def _decimals(units, nulls, places):
+        if places == PREMIUM_PLACES:
+            return [None if null else Decimal(int(unit)).scaleb(-PREMIUM_PLACES) for unit, null in zip(units, nulls)]
+        exponent = Decimal(1).scaleb(-places)
+        return [
+            None if null else Decimal(int(unit)).scaleb(-PREMIUM_PLACES).quantize(exponent, rounding=ROUND_HALF_EVEN)
+            for unit, null in zip(units, nulls)
+        ]
+
+    def to_decimals(self, places=PREMIUM_PLACES):
+        # places=2 reproduit l'arrondi appliqué par la base à l'enregistrement
+        return Premiums(
+            self._decimals(self.do, self.do_null, places),
+            self._decimals(self.trc, self.trc_null, places),
+            self._decimals(self.duo, self.duo_null, places),
+        )
+
+    def rows(self, places=PREMIUM_PLACES):
+        return [Premiums(*row) for row in zip(*self.to_decimals(places))]
+
+    def duo_cents(self):
+        # Prime DUO arrondie au centime, None comptant pour 0
+        return round_to_cents(np.where(self.duo_null, 0, self.duo))
+
+
+def price_batch(guarantee_types, ouvrage_costs, do_rates, trc_rates):
+    """
+    Tarife des colonnes entières d'un coup. Les montants sont des séquences de
+    Decimal/None ou des `FixedColumn` déjà converties, `guarantee_types` une
+    séquence de codes 'DO'/'TRC'/'DUO'.
+    """
+    cost = ouvrage_costs if isinstance(ouvrage_costs, FixedColumn) else to_fixed(ouvrage_costs, COST_PLACES)
+    do_rate = do_rates if isinstance(do_rates, FixedColumn) else to_fixed(do_rates, RATE_PLACES)
+    trc_rate = trc_rates if isinstance(trc_rates, FixedColumn) else to_fixed(trc_rates, RATE_PLACES)
+
+    dtype = _product_dtype(cost.units, do_rate.units, trc_rate.units)
+    cost_units = cost.units.astype(dtype)
+    do_calc = do_rate.units.astype(dtype) * cost_units
+    trc_calc = trc_rate.units.astype(dtype) * cost_units
+
+    types = np.asarray(guarantee_types, dtype=object)
+    is_do = types == 'DO'
+    is_trc = types == 'TRC'
+    is_duo = types == 'DUO'
+    unknown = ~(is_do | is_trc | is_duo)
+
+    do_null = is_trc | unknown | (is_duo & do_rate.nulls)
+    trc_null = is_do | unknown | (is_duo & trc_rate.nulls)
+    duo_null = unknown
+
+    do = np.where(do_null, 0, do_calc)
+    trc = np.where(trc_null, 0, trc_calc)
+    # DO : prime DO ; TRC : prime TRC ; DUO : somme des primes non nulles (0 sans aucun taux)
+    duo = do + trc
+
+    return PremiumColumns(do, trc, duo, do_null, trc_null, duo_null)
@@ -0,0 +1,79 @@
+"""
+Lecture rapide de la liste des devis : les lignes sont lues par `.values()` et
+converties en dictionnaires prêts pour le JSON, sans instance de modèle ni
+sérialiseur par ligne.
+
+Le convertisseur de chaque champ est choisi une fois, d'après le type de la colonne.
+Les décimaux deviennent des chaînes à l'échelle de la colonne, et les dates sont
+rendues en ISO 8601 dans le fuseau courant, comme les champs DRF. La sortie est donc
+identique à celle de ProposalSerializer. Avec `fields=a,b,c`, la réponse se limite à
+ces champs, toujours dans l'ordre du sérialiseur, et les autres colonnes (longs
+textes compris) ne sont pas lues.
+"""
+from django.db import models
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Proposal
+from .serializers import ProposalSerializer
+
+LIST_FIELDS = tuple(ProposalSerializer.Meta.fields)
+
+
+def parse_fields(value, allowed=LIST_FIELDS):
+    """`fields=a,b,c` -> champs demandés dans l'ordre de `allowed` (tous si absent)."""
+    if not value:
+        return tuple(allowed)
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = sorted(requested.difference(allowed))
+    if unknown:
+        raise ValidationError({'fields': f"Champ(s) inconnu(s) : {', '.join(unknown)}."})
+    if not requested:
+        raise ValidationError({'fields': "Aucun champ demandé."})
+    return tuple(name for name in allowed if name in requested)
+
+
+def decimal_text(value):
+    # Valeur déjà à l'échelle de la colonne (convertisseur de la base), comme DecimalField de DRF
+    return f'{value:f}'
+
+
+def datetime_converter():
+    current = timezone.get_current_timezone()
+
+    def convert(value):
+        text = value.astimezone(current).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+def field_converters(fields):
+    """(champ, conversion ou None) pour chaque champ, dans l'ordre de `fields`."""
+    converters = []
+    for name in fields:
+        field = Proposal._meta.get_field(name)
+        if isinstance(field, models.DecimalField):
+            converters.append((name, decimal_text))
+        elif isinstance(field, models.DateTimeField):
+            converters.append((name, datetime_converter()))
+        else:
+            converters.append((name, None))
+    return converters
+
+
+def proposal_values(queryset, fields, extra=()):
+    # `extra` : colonnes lues en plus pour la pagination (clé de tri, id), absentes de la réponse
+    return queryset.values(*fields, *(name for name in extra if name not in fields))
+
+
+def project_rows(rows, fields):
+    """Dictionnaires de `proposal_values` -> dictionnaires de la réponse (champs `fields` seulement)."""
+    converters = field_converters(fields)
+    plain = all(convert is None for _, convert in converters)
+    if plain:
+        return [{name: row[name] for name in fields} for row in rows]
+    return [
+        {name: value if convert is None or value is None else convert(value)
+         for name, convert in converters for value in (row[name],)}
+        for row in rows
+    ]
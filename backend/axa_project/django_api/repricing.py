@@ -0,0 +1,221 @@
+import time
+from decimal import Decimal
+from functools import partial
+
+import numpy as np
+from django.db import transaction
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from .bulk import bulk_update_rows
+from .history import decimal_text, needs_snapshot, proposal_snapshot
+from .models import Proposal, ProposalHistory
+from .pricing import COST_PLACES, RATE_PLACES, STORED_PREMIUM_PLACES, FixedColumn, price_batch, round_to_cents
+from .signals import proposal_changed
+from .summaries import GROUP_FIELDS, SummaryDelta
+
+PREMIUM_FIELDS = ('prime_seule_tarif_do', 'prime_seule_tarif_trc', 'prime_seule_tarif_duo')
+RATE_FIELDS = ('do_rate', 'trc_rate')
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_DELTAS = 1000
+
+
+def fixed_point(field_name, places):
+    # Lecture directe en entier à virgule fixe : évite de construire un Decimal par valeur
+    return Cast(Round(F(field_name) * 10 ** places), BigIntegerField())
+
+
+def fixed_column(values):
+    units = np.fromiter((0 if value is None else value for value in values), dtype=np.int64, count=len(values))
+    nulls = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    return FixedColumn(units, nulls)
+
+
+def constant_column(value, size, places):
+    if value is None:
+        return FixedColumn(np.zeros(size, dtype=np.int64), np.ones(size, dtype=bool))
+    scaled = Decimal(value).scaleb(places)
+    unit = int(scaled)
+    if unit != scaled:
+        # Même contrôle que to_fixed : un taux trop précis n'est jamais tronqué en silence
+        raise ValueError(f"{value} a plus de {places} décimales")
+    return FixedColumn(np.full(size, unit, dtype=np.int64), np.zeros(size, dtype=bool))
+
+
+def fixed_to_decimal(unit, places):
+    return None if unit is None else Decimal(int(unit)).scaleb(-places)
+
+
+def cents_to_str(cents):
+    return None if cents is None else str(fixed_to_decimal(cents, STORED_PREMIUM_PLACES))
+
+
+def pricing_rows(queryset):
+    return queryset.annotate(
+        cost_units=fixed_point('ouvrage_cost', COST_PLACES),
+        do_rate_units=fixed_point('do_rate', RATE_PLACES),
+        trc_rate_units=fixed_point('trc_rate', RATE_PLACES),
+        prime_do_cents=fixed_point('prime_seule_tarif_do', STORED_PREMIUM_PLACES),
+        prime_trc_cents=fixed_point('prime_seule_tarif_trc', STORED_PREMIUM_PLACES),
+        prime_duo_cents=fixed_point('prime_seule_tarif_duo', STORED_PREMIUM_PLACES),
+    ).values_list(
+        'id', 'opportunity_number', 'guarantee_type', 'cost_units', 'do_rate_units', 'trc_rate_units',
+        'prime_do_cents', 'prime_trc_cents', 'prime_duo_cents', 'history_version',
+    )
+
+
+def _premium_cents(units, nulls):
+    return [None if null else int(value) for value, null in zip(round_to_cents(units), nulls)]
+
+
+def reprice_chunk(rows, rates):
+    """
+    Retarife un lot de lignes issues de `pricing_rows`. `rates` contient les nouveaux
+    taux éventuels ('do_rate' / 'trc_rate'). Renvoie, pour chaque ligne dont la
+    tarification change, ses nouvelles valeurs en Decimal et ses différences.
+    """
+    ids, numbers, types, costs, do_units, trc_units, old_do, old_trc, old_duo, versions = zip(*rows)
+    size = len(rows)
+    do_rate = constant_column(rates['do_rate'], size, RATE_PLACES) if 'do_rate' in rates else fixed_column(do_units)
+    trc_rate = constant_column(rates['trc_rate'], size, RATE_PLACES) if 'trc_rate' in rates else fixed_column(trc_units)
+    premiums = price_batch(types, fixed_column(costs), do_rate, trc_rate)
+
+    new_do = _premium_cents(premiums.do, premiums.do_null)
+    new_trc = _premium_cents(premiums.trc, premiums.trc_null)
+    new_duo = _premium_cents(premiums.duo, premiums.duo_null)
+    new_do_rate = [None if null else int(unit) for unit, null in zip(do_rate.units, do_rate.nulls)]
+    new_trc_rate = [None if null else int(unit) for unit, null in zip(trc_rate.units, trc_rate.nulls)]
+
+    changed = []
+    for index in range(size):
+        columns = (
+            ('do_rate', do_units[index], new_do_rate[index], RATE_PLACES),
+            ('trc_rate', trc_units[index], new_trc_rate[index], RATE_PLACES),
+            ('prime_seule_tarif_do', old_do[index], new_do[index], STORED_PREMIUM_PLACES),
+            ('prime_seule_tarif_trc', old_trc[index], new_trc[index], STORED_PREMIUM_PLACES),
+            ('prime_seule_tarif_duo', old_duo[index], new_duo[index], STORED_PREMIUM_PLACES),
+        )
+        values = {}
+        changes = {}
+        for field_name, old_unit, new_unit, places in columns:
+            new_value = fixed_to_decimal(new_unit, places)
+            values[field_name] = new_value
+            if old_unit != new_unit:
+                changes[field_name] = {
+                    'old': decimal_text(fixed_to_decimal(old_unit, places), places),
+                    'new': decimal_text(new_value, places),
+                }
+        if changes:
+            changed.append({
+                'id': ids[index],
+                'opportunity_number': numbers[index],
+                'values': values,
+                'changes': changes,
+                'version': versions[index] + 1,
+                'old_duo_cents': old_duo[index],
+                'new_duo_cents': new_duo[index],
+                # Écarts des primes DO, TRC et DUO en centimes, reportés dans les tables de synthèse
+                'premium_deltas': [(new or 0) - (old or 0) for old, new in (
+                    (old_do[index], new_do[index]), (old_trc[index], new_trc[index]), (old_duo[index], new_duo[index]))],
+            })
+    return changed
+
+
+def chunk_snapshots(changed):
+    # Seuls les devis dont la nouvelle entrée tombe sur un instantané sont relus en entier
+    items = {item['id']: item for item in changed if needs_snapshot(item['version'])}
+    snapshots = {}
+    for pk, proposal in Proposal.objects.in_bulk(list(items)).items():
+        for field_name, value in items[pk]['values'].items():
+            setattr(proposal, field_name, value)
+        snapshots[pk] = proposal_snapshot(proposal)
+    return snapshots
+
+
+def update_summaries(changed):
+    # Le groupe d'un devis ne change pas à la retarification : seuls ses montants sont reportés
+    items = {item['id']: item for item in changed}
+    delta = SummaryDelta()
+    for values in Proposal.objects.filter(pk__in=list(items)).values('id', 'created_at', *GROUP_FIELDS):
+        delta.shift(values, [0] + items[values['id']]['premium_deltas'])
+    delta.apply()
+
+
+def send_signals(changed, user_ip):
+    # Mêmes notifications que Proposal.save (caches des documents et des réponses, etc.)
+    proposals = Proposal.objects.in_bulk([item['id'] for item in changed])
+    for item in changed:
+        if item['id'] in proposals:
+            proposal_changed.send(sender=Proposal, instance=proposals[item['id']], created=False,
+                                  changes=item['changes'], user_ip=user_ip)
+
+
+def reprice_proposals(queryset, rates=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, user_ip=None):
+    """
+    Recalcule les primes (et applique d'éventuels nouveaux taux) de tous les devis du
+    queryset, par lots parcourus dans l'ordre des id. Chaque lot est lu puis écrit dans
+    sa propre transaction (mise à jour groupée + `bulk_create` de l'historique).
+    """
+    rates = rates or {}
+    update_fields = list(PREMIUM_FIELDS) + [field for field in RATE_FIELDS if field in rates] + ['updated_at', 'history_version']
+    queryset = queryset.order_by()
+
+    report = {
+        'dry_run': dry_run,
+        'selected': 0,
+        'changed': 0,
+        'history_entries': 0,
+        'total_duo_delta': 0,
+        'deltas': [],
+    }
+    start = time.perf_counter()
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(pricing_rows(queryset.filter(id__gt=last_id).order_by('id'))[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            report['selected'] += len(rows)
+
+            changed = reprice_chunk(rows, rates)
+            report['changed'] += len(changed)
+            for item in changed:
+                delta = (item['new_duo_cents'] or 0) - (item['old_duo_cents'] or 0)
+                if not delta:
+                    continue
+                report['total_duo_delta'] += delta
+                if len(report['deltas']) < MAX_REPORTED_DELTAS:
+                    report['deltas'].append({
+                        'id': item['id'],
+                        'opportunity_number': item['opportunity_number'],
+                        'old_prime_seule_tarif_duo': cents_to_str(item['old_duo_cents']),
+                        'new_prime_seule_tarif_duo': cents_to_str(item['new_duo_cents']),
+                        'delta': cents_to_str(delta),
+                    })
+
+            if dry_run or not changed:
+                continue
+
+            now = timezone.now()
+            bulk_update_rows(
+                Proposal,
+                [(item['id'], dict(item['values'], updated_at=now, history_version=item['version'])) for item in changed],
+                update_fields,
+            )
+            snapshots = chunk_snapshots(changed)
+            ProposalHistory.objects.bulk_create([
+                ProposalHistory(proposal_id=item['id'], changes=item['changes'], user_ip=user_ip, timestamp=now,
+                                snapshot=snapshots.get(item['id']))
+                for item in changed
+            ])
+            report['history_entries'] += len(changed)
+            update_summaries(changed)
+            transaction.on_commit(partial(send_signals, changed, user_ip))
+
+    elapsed = time.perf_counter() - start
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['selected'] / elapsed) if elapsed > 0 else None
+    report['total_duo_delta'] = cents_to_str(report['total_duo_delta'])
+    return report
@@ -0,0 +1,149 @@
+"""
+Cache des réponses JSON de la liste et du détail des devis.
+
+Les corps déjà rendus sont rangés dans le cache Django 'proposals' (mémoire du
+processus ou fichiers, cf. PROPOSAL_CACHE_BACKEND), sous une clé formée de la
+génération courante, de l'origine de la requête (schéma et hôte, que reprennent les
+liens `next` des pages) et des paramètres de requête normalisés. Toute écriture
+(signal `proposal_changed`, suppression) remplace la génération une fois la
+transaction validée : les anciennes entrées ne sont plus jamais lues et expirent
+d'elles-mêmes. La génération est lue avant la base : une réponse calculée pendant
+une écriture est rangée sous l'ancienne génération et ne peut pas être servie après.
+
+La génération elle-même est toujours dans le cache 'proposals_generation', un
+fichier partagé par tous les processus serveur (SQLite impose de toute façon une
+seule machine) : une écriture traitée par un processus invalide aussi les réponses
+gardées en mémoire par les autres.
+
+Chaque réponse porte un ETag : un client qui le renvoie reçoit un 304 sans corps.
+Le détail porte aussi un Last-Modified tiré de `updated_at`, mais pas les listes :
+la date du devis le plus récent ne change pas quand un devis est supprimé.
+"""
+import hashlib
+import json
+import uuid
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import CACHE_REQUESTS
+
+GENERATION_KEY = 'generation'
+
+
+def get_cache():
+    return caches['proposals']
+
+
+def get_generation_cache():
+    return caches['proposals_generation']
+
+
+def current_generation():
+    cache = get_generation_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # add : si deux requêtes initialisent en même temps, une seule valeur l'emporte
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    get_generation_cache().set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_on_change(sender, instance, **kwargs):
+    # Jamais d'invalidation avant que l'écriture soit visible des autres connexions
+    transaction.on_commit(bump_generation)
+
+
+def invalidate_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(bump_generation)
+
+
+def normalized_params(query_params):
+    """Paramètres de requête triés : ?a=1&b=2 et ?b=2&a=1 partagent la même entrée."""
+    return urlencode(sorted((key, value) for key in query_params for value in query_params.getlist(key)))
+
+
+def cache_key(generation, parts):
+    digest = hashlib.sha1('\x00'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'{generation}:{digest}'
+
+
+def validators(data, body):
+    """ETag d'un devis ou d'une page de devis, et date de dernière modification d'un devis."""
+    detail = isinstance(data, dict) and 'results' not in data
+    if detail:
+        rows, tail = [data], []
+    elif isinstance(data, dict):
+        rows, tail = data['results'], [data.get('next')]
+    else:
+        rows, tail = data, []
+    stamps = [(row.get('id'), row.get('updated_at')) for row in rows]
+    if all(pk is not None and updated_at for pk, updated_at in stamps):
+        digest = hashlib.sha1(json.dumps(stamps + tail).encode()).hexdigest()[:32]
+    else:
+        # Projection (?fields=...) sans id ou sans date de mise à jour : empreinte du corps entier
+        digest = hashlib.sha1(body).hexdigest()[:32]
+    updated_at = data.get('updated_at') if detail else None
+    last_modified = int(parse_datetime(updated_at).timestamp()) if updated_at else None
+    return f'"{digest}"', last_modified
+
+
+def cache_entry(data):
+    body = JSONRenderer().render(data)
+    etag, last_modified = validators(data, body)
+    return {'body': body, 'etag': etag, 'last_modified': last_modified}
+
+
+def entry_response(request, entry):
+    response = HttpResponse(entry['body'], content_type='application/json')
+    response['ETag'] = entry['etag']
+    if entry['last_modified'] is not None:
+        response['Last-Modified'] = http_date(entry['last_modified'])
+    # Le navigateur peut garder la réponse mais doit la revalider (304) à chaque fois
+    response['Cache-Control'] = 'no-cache'
+    return get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'], response=response)
+
+
+def cached_response(request, parts, build):
+    """
+    Renvoie la réponse mise en cache pour `parts`, ou appelle `build()` (une vue DRF)
+    et met en cache son résultat s'il s'agit d'un 200.
+    """
+    cache = get_cache()
+    key = cache_key(current_generation(), (request.scheme, request.get_host(), *parts))
+    entry = cache.get(key)
+    CACHE_REQUESTS.inc(cache='responses', result='miss' if entry is None else 'hit')
+    if entry is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+        entry = cache_entry(response.data)
+        cache.set(key, entry, settings.PROPOSAL_CACHE_TIMEOUT)
+    return entry_response(request, entry)
+
+
+async def acached_response(request, parts, build):
+    """
+    Variante des vues asynchrones (cf. async_views.py) : `build` est une coroutine qui
+    renvoie les données de la réponse, ou lève une exception (jamais mise en cache).
+    """
+    cache = get_cache()
+    key = cache_key(await sync_to_async(current_generation)(), (request.scheme, request.get_host(), *parts))
+    entry = await cache.aget(key)
+    CACHE_REQUESTS.inc(cache='responses', result='miss' if entry is None else 'hit')
+    if entry is None:
+        entry = cache_entry(await build())
+        await cache.aset(key, entry, settings.PROPOSAL_CACHE_TIMEOUT)
+    return entry_response(request, entry)
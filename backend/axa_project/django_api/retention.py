@@ -0,0 +1,222 @@
+"""
+Rétention de l'historique des devis : regroupements quotidiens et archivage.
+
+Deux passes, chacune par petits lots dans des transactions courtes, pour ne jamais
+tenir longtemps le verrou d'écriture de SQLite :
+
+- au-delà de HISTORY_ROLLUP_AFTER_DAYS jours, les entrées d'un même devis et d'un
+  même jour (heure locale) sont fusionnées en une seule : pour chaque champ, la valeur
+  avant la première modification du jour et celle après la dernière. L'entrée fusionnée
+  garde un instantané si le jour en avait un, les reconstructions `as_of` restent donc
+  bornées (à la résolution de la journée) ;
+- au-delà de HISTORY_ARCHIVE_AFTER_MONTHS mois (mois entiers), les entrées sont
+  ajoutées au fichier JSON lines compressé de leur mois (HISTORY_ARCHIVE_DIR), puis
+  supprimées de la table. Le fichier est écrit et synchronisé avant la suppression :
+  une interruption entre les deux laisse au pire un doublon, ignoré à la lecture.
+"""
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .history import apply_changes, decode_changes, decode_snapshot, encode_changes, encode_snapshot
+from .models import HistoryArchive, Proposal, ProposalHistory
+
+ROLLUP_BATCH_SIZE = 200
+ARCHIVE_BATCH_SIZE = 2000
+DELETE_CHUNK_SIZE = 500
+
+
+def rollup_cutoff(now=None, days=None):
+    days = settings.HISTORY_ROLLUP_AFTER_DAYS if days is None else days
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archive_cutoff(now=None, months=None):
+    """Début (heure locale) du mois situé `months` mois avant le mois courant."""
+    months = settings.HISTORY_ARCHIVE_AFTER_MONTHS if months is None else months
+    local = timezone.localtime(now or timezone.now())
+    index = local.year * 12 + local.month - 1 - months
+    return timezone.make_aware(datetime(index // 12, index % 12 + 1, 1))
+
+
+def local_month(moment):
+    local = timezone.localtime(moment)
+    return date(local.year, local.month, 1)
+
+
+def archive_path(month):
+    return os.path.join(settings.HISTORY_ARCHIVE_DIR, f"history-{month:%Y-%m}.jsonl.gz")
+
+
+def archived_before():
+    """Date avant laquelle l'historique n'est plus dans la table (None si rien n'est archivé)."""
+    return HistoryArchive.objects.aggregate(value=Max('archived_before'))['value']
+
+
+def _delete_entries(ids):
+    for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+        ProposalHistory.objects.filter(id__in=ids[start:start + DELETE_CHUNK_SIZE]).delete()
+
+
+def compose_changes(entries):
+    changes = {}
+    for entry in entries:
+        for name, change in entry.changes.items():
+            if name in changes:
+                changes[name]['new'] = change['new']
+            else:
+                changes[name] = dict(change)
+    # Un champ revenu à sa valeur du matin n'a pas changé sur la journée
+    return {name: change for name, change in changes.items() if change['old'] != change['new']}
+
+
+def rolled_snapshot(entries):
+    state = None
+    for entry in entries:
+        if entry.snapshot is not None:
+            state = dict(entry.snapshot)
+        elif state is not None:
+            apply_changes(state, entry.changes, 'new')
+    return state
+
+
+def rollup_entry(entries):
+    last = entries[-1]
+    changes = compose_changes(entries)
+    snapshot = rolled_snapshot(entries)
+    if not changes and snapshot is None:
+        return None
+    return ProposalHistory(proposal_id=last.proposal_id, timestamp=last.timestamp, user_ip=last.user_ip,
+                           changes=changes, snapshot=snapshot)
+
+
+def rollup_history(before, batch_size=ROLLUP_BATCH_SIZE, dry_run=False):
+    """Fusionne par devis et par jour les entrées antérieures à `before`, par lots de devis."""
+    report = {'days': 0, 'entries_before': 0, 'entries_after': 0}
+    last_id = 0
+    while True:
+        ids = list(Proposal.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        entries = (ProposalHistory.objects.filter(proposal_id__in=ids, timestamp__lt=before)
+                   .order_by('proposal_id', 'timestamp', 'id'))
+        groups = [list(group) for _, group in groupby(
+            entries, key=lambda entry: (entry.proposal_id, timezone.localtime(entry.timestamp).date())
+        )]
+        groups = [group for group in groups if len(group) > 1]
+        if not groups:
+            continue
+
+        rollups = [rollup for rollup in map(rollup_entry, groups) if rollup is not None]
+        report['days'] += len(groups)
+        report['entries_before'] += sum(len(group) for group in groups)
+        report['entries_after'] += len(rollups)
+        if dry_run:
+            continue
+        with transaction.atomic():
+            _delete_entries([entry.id for group in groups for entry in group])
+            ProposalHistory.objects.bulk_create(rollups)
+    return report
+
+
+def archive_line(entry):
+    return json.dumps({
+        'id': entry.id,
+        'proposal_id': entry.proposal_id,
+        'timestamp': entry.timestamp.isoformat(),
+        'user_ip': entry.user_ip,
+        'changes': encode_changes(entry.changes),
+        'snapshot': encode_snapshot(entry.snapshot),
+    }, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+def append_archive(path, entries):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Chaque lot ajoute un membre gzip au fichier ; gzip relit les membres à la suite
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+            archive.write(''.join(archive_line(entry) for entry in entries).encode())
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def archive_history(before, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """Déplace les entrées antérieures à `before` (un début de mois) vers les fichiers d'archive."""
+    report = {'entries': 0, 'months': []}
+    queryset = ProposalHistory.objects.filter(timestamp__lt=before)
+    if dry_run:
+        report['entries'] = queryset.count()
+        moments = queryset.values_list('timestamp', flat=True).iterator(chunk_size=ARCHIVE_BATCH_SIZE)
+        report['months'] = sorted({f"{local_month(moment):%Y-%m}" for moment in moments})
+        return report
+
+    months = set()
+    while True:
+        batch = list(queryset.order_by('timestamp', 'id')[:batch_size])
+        if not batch:
+            break
+        by_month = [(month, list(entries)) for month, entries in groupby(batch, key=lambda entry: local_month(entry.timestamp))]
+        for month, entries in by_month:
+            append_archive(archive_path(month), entries)
+        with transaction.atomic():
+            _delete_entries([entry.id for entry in batch])
+            for month, entries in by_month:
+                archive, _ = HistoryArchive.objects.get_or_create(
+                    month=month, defaults={'file_path': archive_path(month), 'archived_before': before},
+                )
+                archive.entries += len(entries)
+                archive.archived_before = max(archive.archived_before, before)
+                archive.save()
+        months.update(month for month, _ in by_month)
+        report['entries'] += len(batch)
+    if report['entries']:
+        # Limite commune à tous les mois : plus aucune entrée antérieure à `before` dans la table
+        HistoryArchive.objects.filter(archived_before__lt=before).update(archived_before=before)
+    report['months'] = sorted(f"{month:%Y-%m}" for month in months)
+    return report
+
+
+def apply_retention(now=None, rollup_days=None, archive_months=None, rollup=True, archive=True, dry_run=False):
+    start = time.perf_counter()
+    report = {'dry_run': dry_run}
+    if rollup:
+        report['rollup'] = rollup_history(rollup_cutoff(now, rollup_days), dry_run=dry_run)
+    if archive:
+        report['archive'] = archive_history(archive_cutoff(now, archive_months), dry_run=dry_run)
+    report['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def archived_entries(proposal, month):
+    """Entrées archivées d'un devis pour un mois, de la plus récente à la plus ancienne."""
+    archive = HistoryArchive.objects.filter(month=month).first()
+    path = archive.file_path if archive else archive_path(month)
+    if not os.path.exists(path):
+        return []
+    # Filtre textuel avant le décodage JSON : la plupart des lignes concernent d'autres devis
+    marker = f'"proposal_id":{proposal.pk},'
+    entries = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            if marker not in line:
+                continue
+            data = json.loads(line)
+            entries[data['id']] = ProposalHistory(
+                id=data['id'],
+                proposal=proposal,
+                timestamp=parse_datetime(data['timestamp']),
+                user_ip=data['user_ip'],
+                changes=decode_changes(data['changes']),
+                snapshot=decode_snapshot(data['snapshot']),
+            )
+    return sorted(entries.values(), key=lambda entry: (entry.timestamp, entry.id), reverse=True)
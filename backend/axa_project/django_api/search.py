@@ -0,0 +1,57 @@
+"""
+Recherche plein texte des devis (index SQLite FTS5, cf. migration 0007_proposal_search).
+
+Numéro d'opportunité, client, description de l'ouvrage et adresse du chantier sont
+indexés sans casse ni accents ("evry" trouve "Évry"). Chaque mot recherché est un
+préfixe ("log coll" trouve "logements collectifs") et tous doivent être présents.
+Le classement par pertinence (bm25 pondéré par colonne) est fait dans l'index :
+seuls les `limit` premiers devis sont lus dans la table.
+"""
+import re
+
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+
+from .models import Proposal
+
+SEARCH_TABLE = 'django_api_proposal_search'
+MAX_TERMS = 12
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def match_expression(text):
+    terms = re.findall(r'\w+', text or '')[:MAX_TERMS]
+    # Mots entre guillemets : la saisie n'est jamais interprétée comme syntaxe FTS5 (OR, NEAR, *...)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({'limit': "Limite invalide."})
+    if limit <= 0:
+        raise ValidationError({'limit': "Limite invalide."})
+    return min(limit, maximum)
+
+
+def search_proposals(queryset, text, limit=DEFAULT_LIMIT):
+    """Devis du queryset correspondant à `text`, du plus au moins pertinent."""
+    match = match_expression(text)
+    if not match:
+        return []
+    quote = connections[queryset.db].ops.quote_name
+    sql = (f'SELECT p.* FROM {quote(Proposal._meta.db_table)} p '
+           f'JOIN {SEARCH_TABLE} ON {SEARCH_TABLE}.rowid = p.id WHERE {SEARCH_TABLE} MATCH %s')
+    params = [match]
+    if queryset.query.has_filters():
+        # Filtres de la liste (type de garantie, primes...) appliqués aux seuls devis trouvés
+        filtered_sql, filtered_params = queryset.order_by().values('id').query.sql_with_params()
+        sql += f' AND p.id IN ({filtered_sql})'
+        params.extend(filtered_params)
+    sql += f' ORDER BY {SEARCH_TABLE}.rank LIMIT %s'
+    params.append(limit)
+    return list(Proposal.objects.db_manager(queryset.db).raw(sql, params))
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Proposal, ProposalHistory 
+from rest_framework.reverse import reverse
+from .models import DocumentJob, Proposal, ProposalHistory
 
 class ProposalSerializer(serializers.ModelSerializer):
     prime_seule_tarif_trc = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -62,3 +63,84 @@ class ProposalHistorySerializer(serializers.ModelSerializer):
             'timestamp',
             'changes'
         ]
+
+class RepriceSerializer(serializers.Serializer):
+    do_rate = serializers.DecimalField(max_digits=7, decimal_places=4, required=False, allow_null=True)
+    trc_rate = serializers.DecimalField(max_digits=7, decimal_places=4, required=False, allow_null=True)
+    dry_run = serializers.BooleanField(default=False)
+    chunk_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+
+class RateSegmentSerializer(serializers.Serializer):
+    # Critère absent : toutes les valeurs ; taux absent : celui du devis
+    guarantee_type = serializers.ChoiceField(choices=Proposal.GUARANTEE_TYPE_CHOICES, required=False)
+    work_type = serializers.ChoiceField(choices=Proposal.WORK_TYPE_CHOICES, required=False)
+    ouvrage_destination = serializers.ChoiceField(choices=Proposal.OUVRAGE_DESTINATION_CHOICES, required=False)
+    existing_presence = serializers.BooleanField(required=False)
+    do_rate = serializers.DecimalField(max_digits=7, decimal_places=4, required=False, allow_null=True)
+    trc_rate = serializers.DecimalField(max_digits=7, decimal_places=4, required=False, allow_null=True)
+
+    def validate(self, data):
+        if 'do_rate' not in data and 'trc_rate' not in data:
+            raise serializers.ValidationError("Le segment doit fixer un taux DO ou TRC.")
+        return data
+
+class RateSimulationSerializer(serializers.Serializer):
+    MAX_SEGMENTS = 200
+
+    segments = RateSegmentSerializer(many=True, allow_empty=False, max_length=MAX_SEGMENTS)
+    top = serializers.IntegerField(min_value=0, max_value=1000, default=10)
+
+class ProposalBatchItemSerializer(ProposalSerializer):
+    # Unicité du numéro d'opportunité vérifiée pour tout le lot en une requête (cf. batch.py)
+    class Meta(ProposalSerializer.Meta):
+        extra_kwargs = {'opportunity_number': {'validators': []}}
+
+class ProposalBatchSerializer(serializers.Serializer):
+    MAX_ITEMS = 1000
+
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        count = len(data['create']) + len(data['update']) + len(data['delete'])
+        if not count:
+            raise serializers.ValidationError("Le lot ne contient aucune opération.")
+        if count > self.MAX_ITEMS:
+            raise serializers.ValidationError(f"Un lot est limité à {self.MAX_ITEMS} opérations.")
+        return data
+
+class ProposalImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    dry_run = serializers.BooleanField(default=False)
+    chunk_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+
+class DocumentJobSerializer(serializers.ModelSerializer):
+    status_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DocumentJob
+        fields = [
+            'id',
+            'proposal',
+            'doc_type',
+            'status',
+            'filename',
+            'error',
+            'created_at',
+            'started_at',
+            'finished_at',
+            'status_url',
+            'download_url',
+        ]
+        read_only_fields = fields
+
+    def get_status_url(self, obj):
+        return reverse('documentjob-detail', args=[obj.pk], request=self.context.get('request'))
+
+    def get_download_url(self, obj):
+        if obj.status != DocumentJob.STATUS_DONE:
+            return None
+        return reverse('documentjob-download', args=[obj.pk], request=self.context.get('request'))
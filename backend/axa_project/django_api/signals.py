@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Envoyé par Proposal.save au moment où l'historique est écrit.
+# Arguments : instance, created (bool), changes (différences au format de ProposalHistory), user_ip
+proposal_changed = Signal()
@@ -0,0 +1,224 @@
+"""
+Simulation d'une grille de taux sur le portefeuille, sans rien enregistrer
+(`POST /api/proposals/simulate/`).
+
+La grille est une liste de segments (type de garantie × type de travaux ×
+destination × présence de l'existant). Un critère absent vaut pour toutes les
+valeurs, et chaque devis prend le premier segment qui lui correspond. Les devis
+d'un segment reçoivent ses taux DO / TRC (un taux absent reste celui du devis) et
+sont tarifés en colonnes par `price_batch`, avec les règles de `Proposal.save`. La
+réponse compare leur prime DUO à celle enregistrée : écart total et par segment,
+percentiles des écarts par devis et devis les plus touchés.
+
+Le portefeuille est lu en une requête, directement en colonnes d'entiers à virgule
+fixe. Il reste en mémoire tant que la génération du cache des réponses ne change
+pas (cf. response_cache.py), si bien que les simulations suivantes sur les mêmes
+devis ne relisent pas la base. Une écriture, dans n'importe quel processus, change
+la génération : les portefeuilles de l'ancienne sont alors libérés.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.db import connections
+
+from .models import Proposal
+from .pricing import COST_PLACES, RATE_PLACES, STORED_PREMIUM_PLACES, FixedColumn, price_batch
+from .repricing import cents_to_str, fixed_column, fixed_point, fixed_to_decimal
+from .response_cache import current_generation
+
+SEGMENT_FIELDS = ('guarantee_type', 'work_type', 'ouvrage_destination', 'existing_presence')
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+BOOK_CACHE_SIZE = 4
+# Code d'une valeur de segment absente du portefeuille : ne correspond à aucun devis
+NO_MATCH = -1
+
+_books = OrderedDict()
+_books_lock = threading.Lock()
+
+
+def encode(values):
+    """Colonne de valeurs -> (codes entiers, code de chaque valeur)."""
+    codes = {value: code for code, value in enumerate(set(values))}
+    return np.fromiter(map(codes.__getitem__, values), dtype=np.int64, count=len(values)), codes
+
+
+class Book:
+    """Devis sélectionnés, en colonnes."""
+
+    def __init__(self, rows):
+        ids, types, work_types, destinations, existing, costs, do_rates, trc_rates, duo_cents = zip(*rows) if rows else ([],) * 9
+        self.ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+        self.guarantee_types = np.asarray(types, dtype=object)
+        self.cost = fixed_column(costs)
+        self.do_rate = fixed_column(do_rates)
+        self.trc_rate = fixed_column(trc_rates)
+        # Prime DUO enregistrée, en centimes (None compte pour 0)
+        self.duo_cents = fixed_column(duo_cents).units
+        # existing_presence arrive en 0/1 : True et False retrouvent les mêmes codes (True == 1)
+        self.dimensions = {
+            name: encode(values) for name, values in zip(SEGMENT_FIELDS, (types, work_types, destinations, existing))
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def matches(self, name, value):
+        column, codes = self.dimensions[name]
+        return column == codes.get(value, NO_MATCH)
+
+
+def book_query(queryset):
+    queryset = queryset.order_by().annotate(
+        cost_units=fixed_point('ouvrage_cost', COST_PLACES),
+        do_rate_units=fixed_point('do_rate', RATE_PLACES),
+        trc_rate_units=fixed_point('trc_rate', RATE_PLACES),
+        prime_duo_cents=fixed_point('prime_seule_tarif_duo', STORED_PREMIUM_PLACES),
+    ).values_list('id', *SEGMENT_FIELDS, 'cost_units', 'do_rate_units', 'trc_rate_units', 'prime_duo_cents')
+    sql, params = queryset.query.sql_with_params()
+    return queryset.db, sql, params
+
+
+def load_book(queryset):
+    # Curseur direct : ni instance ni convertisseur de champ par ligne
+    alias, sql, params = book_query(queryset)
+    # Génération lue avant la base : un portefeuille lu pendant une écriture n'est pas resservi ensuite
+    generation = current_generation()
+    key = (generation, alias, sql, tuple(params))
+    with _books_lock:
+        book = _books.get(key)
+        if book is not None:
+            _books.move_to_end(key)
+            return book, True
+    with connections[alias].cursor() as cursor:
+        cursor.execute(sql, params)
+        book = Book(cursor.fetchall())
+    if generation is not None:
+        with _books_lock:
+            # Portefeuilles d'une génération périmée : jamais resservis, libérés dès maintenant
+            for stale in [cached_key for cached_key in _books if cached_key[0] != generation]:
+                del _books[stale]
+            _books[key] = book
+            while len(_books) > BOOK_CACHE_SIZE:
+                _books.popitem(last=False)
+    return book, False
+
+
+def assign_segments(book, segments):
+    """Indice du premier segment correspondant à chaque devis (-1 : aucun)."""
+    assigned = np.full(len(book), -1, dtype=np.int64)
+    for index, segment in enumerate(segments):
+        mask = assigned == -1
+        for name in SEGMENT_FIELDS:
+            if name in segment:
+                mask &= book.matches(name, segment[name])
+        assigned[mask] = index
+    return assigned
+
+
+def candidate_rates(current, assigned, segments, field_name):
+    units, nulls = current.units.copy(), current.nulls.copy()
+    for index, segment in enumerate(segments):
+        if field_name not in segment:
+            continue
+        selected = assigned == index
+        value = segment[field_name]
+        units[selected] = 0 if value is None else int(value.scaleb(RATE_PLACES))
+        nulls[selected] = value is None
+    return FixedColumn(units, nulls)
+
+
+def rate_str(column, index):
+    return None if column.nulls[index] else str(fixed_to_decimal(column.units[index], RATE_PLACES))
+
+
+def percent_change(old, new):
+    # Variation relative, pour les devis dont la prime actuelle n'est pas nulle
+    priced = old != 0
+    return (new[priced] - old[priced]) * 100.0 / old[priced]
+
+
+def totals(old, new):
+    return {
+        'total_duo_before': cents_to_str(int(old.sum())),
+        'total_duo_after': cents_to_str(int(new.sum())),
+        'total_duo_delta': cents_to_str(int(new.sum() - old.sum())),
+    }
+
+
+def simulate_rates(queryset, segments, top=10):
+    """Tarife les devis du queryset avec les taux des `segments` ; renvoie le rapport de simulation."""
+    start = time.perf_counter()
+    book, cached = load_book(queryset)
+    assigned = assign_segments(book, segments)
+    matched = np.flatnonzero(assigned >= 0)
+
+    do_rate = candidate_rates(book.do_rate, assigned, segments, 'do_rate')
+    trc_rate = candidate_rates(book.trc_rate, assigned, segments, 'trc_rate')
+    premiums = price_batch(
+        book.guarantee_types[matched],
+        FixedColumn(book.cost.units[matched], book.cost.nulls[matched]),
+        FixedColumn(do_rate.units[matched], do_rate.nulls[matched]),
+        FixedColumn(trc_rate.units[matched], trc_rate.nulls[matched]),
+    )
+    old = book.duo_cents[matched]
+    new = premiums.duo_cents().astype(np.int64)
+    delta = new - old
+    segment_of = assigned[matched]
+
+    report = {
+        'selected': len(book),
+        'matched': len(matched),
+        'changed': int(np.count_nonzero(delta)),
+        **totals(old, new),
+        'delta_percentiles': {},
+        'change_percent_percentiles': {},
+        'segments': [],
+        'top_changes': [],
+    }
+    if len(matched):
+        report['delta_percentiles'] = {
+            f'p{rank}': cents_to_str(int(value)) for rank, value in zip(PERCENTILES, np.percentile(delta, PERCENTILES, method='nearest'))
+        }
+    changes = percent_change(old, new)
+    if len(changes):
+        report['change_percent_percentiles'] = {
+            f'p{rank}': round(float(value), 2) for rank, value in zip(PERCENTILES, np.percentile(changes, PERCENTILES))
+        }
+    for index, segment in enumerate(segments):
+        selected = segment_of == index
+        report['segments'].append({
+            **{name: segment[name] for name in SEGMENT_FIELDS if name in segment},
+            **{name: None if segment[name] is None else str(segment[name]) for name in ('do_rate', 'trc_rate') if name in segment},
+            'matched': int(np.count_nonzero(selected)),
+            'changed': int(np.count_nonzero(delta[selected])),
+            **totals(old[selected], new[selected]),
+        })
+
+    # Devis les plus touchés, par écart absolu décroissant
+    changed = np.flatnonzero(delta)
+    if len(changed) > top:
+        changed = changed[np.argpartition(-np.abs(delta[changed]), top - 1)[:top]]
+    changed = changed[np.argsort(-np.abs(delta[changed]), kind='stable')]
+    numbers = dict(Proposal.objects.using(queryset.db).filter(pk__in=book.ids[matched[changed]].tolist())
+                   .values_list('id', 'opportunity_number'))
+    for position in changed:
+        row = matched[position]
+        pk = int(book.ids[row])
+        report['top_changes'].append({
+            'id': pk,
+            'opportunity_number': numbers.get(pk),
+            'segment': int(segment_of[position]),
+            'old_do_rate': rate_str(book.do_rate, row),
+            'new_do_rate': rate_str(do_rate, row),
+            'old_trc_rate': rate_str(book.trc_rate, row),
+            'new_trc_rate': rate_str(trc_rate, row),
+            'old_prime_seule_tarif_duo': cents_to_str(int(old[position])),
+            'new_prime_seule_tarif_duo': cents_to_str(int(new[position])),
+            'delta': cents_to_str(int(delta[position])),
+        })
+
+    report['book_cached'] = cached
+    report['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+    return report
@@ -0,0 +1,129 @@
+"""
+Tables de synthèse du portefeuille (ProposalSummary), tenues à jour par deltas.
+
+Chaque ligne regroupe les devis d'un même mois de création, type de garantie,
+destination, type de travaux, statut VIP et choix RCMO : nombre de devis, coût des
+ouvrages et primes, en centimes. Chaque écriture (Proposal.save, suppression, import,
+retarification) retranche la contribution des anciennes valeurs, ajoute celle des
+nouvelles et reporte la différence dans la même transaction, groupe par groupe
+(`INSERT ... ON CONFLICT DO UPDATE`). Les analyses (cf. analytics.py) ne lisent que
+ces lignes : leur coût dépend du nombre de groupes, pas du nombre de devis.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.db import connections, router
+from django.utils import timezone
+
+from .pricing import STORED_PREMIUM_PLACES
+
+GROUP_FIELDS = ('guarantee_type', 'ouvrage_destination', 'work_type', 'is_vip_client', 'rcmo_desired')
+MEASURE_FIELDS = ('ouvrage_cost', 'prime_seule_tarif_do', 'prime_seule_tarif_trc', 'prime_seule_tarif_duo')
+SUMMARY_FIELDS = ('created_at',) + GROUP_FIELDS + MEASURE_FIELDS
+# Colonnes de ProposalSummary, dans l'ordre des clés et des totaux de SummaryDelta
+KEY_COLUMNS = ('month',) + GROUP_FIELDS
+TOTAL_COLUMNS = ('proposal_count',) + tuple(f'{name}_cents' for name in MEASURE_FIELDS)
+
+
+def month_of(created_at):
+    return timezone.localtime(created_at).date().replace(day=1)
+
+
+def to_cents(value):
+    # Coûts et primes ont deux décimales : un total en centimes reste exact. Arrondi
+    # demi-pair, comme l'enregistrement des primes (cf. pricing.round_stored)
+    if value is None:
+        return 0
+    return int(Decimal(str(value)).scaleb(STORED_PREMIUM_PLACES).to_integral_value(ROUND_HALF_EVEN))
+
+
+def instance_values(proposal):
+    return {name: getattr(proposal, name) for name in SUMMARY_FIELDS}
+
+
+def summary_key(values):
+    return (month_of(values['created_at']),) + tuple(values[name] for name in GROUP_FIELDS)
+
+
+class SummaryDelta:
+    """Différences à reporter dans ProposalSummary, cumulées par groupe."""
+
+    def __init__(self):
+        self.groups = defaultdict(lambda: [0] * len(TOTAL_COLUMNS))
+
+    def add(self, values, sign=1):
+        totals = self.groups[summary_key(values)]
+        totals[0] += sign
+        for index, name in enumerate(MEASURE_FIELDS, start=1):
+            totals[index] += sign * to_cents(values[name])
+
+    def remove(self, values):
+        self.add(values, sign=-1)
+
+    def shift(self, values, cents):
+        # Devis qui reste dans son groupe : seuls les montants (en centimes, dans l'ordre de MEASURE_FIELDS) bougent
+        totals = self.groups[summary_key(values)]
+        for index, value in enumerate(cents, start=1):
+            totals[index] += value
+
+    def apply(self, using=None):
+        from .models import ProposalSummary
+
+        rows = [key + tuple(totals) for key, totals in self.groups.items() if any(totals)]
+        self.groups.clear()
+        if not rows:
+            return 0
+        using = using or router.db_for_write(ProposalSummary)
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        meta = ProposalSummary._meta
+        fields = [meta.get_field(name) for name in KEY_COLUMNS + TOTAL_COLUMNS]
+
+        columns = ', '.join(quote(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        conflict = ', '.join(quote(meta.get_field(name).column) for name in KEY_COLUMNS)
+        increments = ', '.join(
+            f'{quote(column)} = {quote(column)} + excluded.{quote(column)}'
+            for column in (meta.get_field(name).column for name in TOTAL_COLUMNS)
+        )
+        sql = (f'INSERT INTO {quote(meta.db_table)} ({columns}) VALUES ({placeholders}) '
+               f'ON CONFLICT ({conflict}) DO UPDATE SET {increments}')
+        params = [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)] for row in rows]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+            if any(row[len(KEY_COLUMNS)] < 0 for row in rows):
+                # Groupe vidé (suppression, devis passé dans un autre groupe) : la ligne disparaît plutôt que de rester à zéro
+                count_column = quote(meta.get_field('proposal_count').column)
+                cursor.execute(f'DELETE FROM {quote(meta.db_table)} WHERE {count_column} <= 0')
+        return len(params)
+
+
+_collecting = ContextVar('summary_delete_delta', default=None)
+
+
+@contextmanager
+def collect_deletes(using=None):
+    """
+    Suppressions groupées : les retraits des devis supprimés dans le bloc sont cumulés
+    puis reportés en une fois à la sortie, au lieu d'une écriture par devis.
+    """
+    delta = SummaryDelta()
+    token = _collecting.set(delta)
+    try:
+        yield
+    finally:
+        _collecting.reset(token)
+    delta.apply(using)
+
+
+def remove_on_delete(sender, instance, using, **kwargs):
+    # Suppression unitaire ou par queryset : exécuté dans la transaction du Collector
+    collecting = _collecting.get()
+    if collecting is not None:
+        collecting.remove(instance_values(instance))
+        return
+    delta = SummaryDelta()
+    delta.remove(instance_values(instance))
+    delta.apply(using)
@@ -1 +1,1597 @@
-from django.test import TestCase
\ No newline at end of file
+import csv
+import gzip
+import importlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import tempfile
+import zipfile
+from contextlib import closing
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from docx import Document as DocxDocument
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+
+from . import addresses, async_views, audit, changes, document_cache, imports, jobs, response_cache, retention, simulation
+from .metrics import Counter, Histogram, render_metrics
+from .analytics import summary_drift
+from .as_of import proposal_as_of
+from .db_router import READ_DATABASE, WRITE_DATABASE, read_database, set_journal_mode
+from .document_export import merged_pdf_file, stream_zip
+from .document_templates import get_pdf_template, get_word_template, parameter_values
+from .documents import UnsupportedDocumentType, render_document
+from .models import CREATION_CHANGES, DocumentJob, HistoryArchive, Proposal, ProposalHistory, ProposalSummary
+from .pricing import RATE_PLACES, STORED_PREMIUM_PLACES, price_batch, price_proposal, round_stored
+from .repricing import constant_column
+from .retention import apply_retention
+from .serializers import ProposalSerializer
+from .summaries import to_cents
+
+
+def create_proposal(number, **fields):
+    values = {
+        'opportunity_number': number,
+        'client_name': f'Client {number}',
+        'guarantee_type': 'DO',
+        'ouvrage_cost': Decimal('100000.00'),
+        'do_rate': Decimal('0.0100'),
+    }
+    values.update(fields)
+    return Proposal.objects.create(**values)
+
+
+class TemporaryDirectoriesMixin:
+    def temporary_directory(self):
+        directory = tempfile.mkdtemp(prefix='django-api-tests-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        return directory
+
+    def override(self, **settings_values):
+        overrides = override_settings(**settings_values)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def use_temporary_directories(self, *names):
+        # Répertoires de travail (documents, archives...) propres au test
+        directory = self.temporary_directory()
+        self.override(**{name: os.path.join(directory, name.lower()) for name in names})
+
+    def use_temporary_generation(self):
+        # Génération du cache des réponses (fichier partagé entre processus) hors du projet
+        generation = dict(settings.CACHES['proposals_generation'], LOCATION=self.temporary_directory())
+        self.override(CACHES=dict(settings.CACHES, proposals_generation=generation))
+
+
+class ProposalAPITestCase(TemporaryDirectoriesMixin, TestCase):
+    def setUp(self):
+        self.use_temporary_generation()
+        # Cache des réponses partagé par tous les tests du processus
+        caches['proposals'].clear()
+        self.client = APIClient()
+
+    def get_json(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response.json()
+
+
+class ProposalListPaginationTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        costs = ['5000.00', '1000.00', '3000.00', '1000.00', '2000.00', '3000.00', '4000.00']
+        self.proposals = [create_proposal(f'OPP-{index}', ouvrage_cost=Decimal(cost)) for index, cost in enumerate(costs)]
+        # Primes DUO absentes : classées en tête en ordre croissant, en fin en ordre décroissant
+        Proposal.objects.filter(pk__in=[self.proposals[1].pk, self.proposals[4].pk]).update(prime_seule_tarif_duo=None)
+
+    def walk(self, ordering, page_size=2):
+        ids = []
+        data = self.get_json('/api/proposals/', {'ordering': ordering, 'page_size': page_size})
+        while True:
+            self.assertLessEqual(len(data['results']), page_size)
+            ids.extend(row['id'] for row in data['results'])
+            if data['next'] is None:
+                return ids
+            data = self.get_json(data['next'])
+
+    def expected(self, field, descending):
+        rows = list(Proposal.objects.values_list('id', field))
+        # NULL en premier en ordre croissant, comme SQLite ; l'id départage
+        rows.sort(key=lambda row: (row[1] is not None, row[1] or 0, row[0]))
+        if descending:
+            rows.reverse()
+        return [pk for pk, _ in rows]
+
+    def test_pages_cover_every_proposal_once(self):
+        for ordering in ('id', '-id', 'ouvrage_cost', '-ouvrage_cost', 'prime_seule_tarif_duo', '-prime_seule_tarif_duo'):
+            with self.subTest(ordering=ordering):
+                field = ordering.lstrip('-')
+                self.assertEqual(self.walk(ordering), self.expected(field, ordering.startswith('-')))
+
+    def test_without_page_size_returns_full_list(self):
+        data = self.get_json('/api/proposals/', {'ordering': '-ouvrage_cost'})
+        self.assertEqual([row['id'] for row in data], self.expected('ouvrage_cost', True))
+
+    def test_filters(self):
+        data = self.get_json('/api/proposals/', {'client_name': 'opp-3'})
+        self.assertEqual([row['id'] for row in data], [self.proposals[3].pk])
+        data = self.get_json('/api/proposals/', {'prime_price_min': '25', 'prime_price_max': '35'})
+        self.assertEqual({row['id'] for row in data}, {self.proposals[2].pk, self.proposals[5].pk})
+
+    def test_invalid_parameters(self):
+        for params in ({'ordering': 'address_chantier'}, {'guarantee_type': 'XYZ'}, {'page_size': '0'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/proposals/', params).status_code, 400)
+        self.assertEqual(self.client.get('/api/proposals/', {'page_size': 2, 'cursor': 'invalide'}).status_code, 404)
+
+
+class ProposalSaveTests(TestCase):
+    def setUp(self):
+        self.proposal = create_proposal('OPP-1', client_name='Dupont')
+
+    def history(self):
+        return [entry.changes for entry in ProposalHistory.objects.filter(proposal=self.proposal).order_by('id')]
+
+    def test_update_does_not_reread_the_row(self):
+        proposal = Proposal.objects.get(pk=self.proposal.pk)
+        proposal.ouvrage_cost = Decimal('200000.00')
+        with CaptureQueriesContext(connection) as queries:
+            proposal.save()
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'FROM "django_api_proposal"' in query['sql']]
+        self.assertEqual(selects, [])
+        self.assertEqual(self.history()[-1], {
+            'ouvrage_cost': {'old': '1E+5', 'new': '2E+5'},
+            'prime_seule_tarif_do': {'old': '1E+3', 'new': '2E+3'},
+            'prime_seule_tarif_duo': {'old': '1E+3', 'new': '2E+3'},
+        })
+
+    def test_unchanged_save_records_no_history(self):
+        proposal = Proposal.objects.get(pk=self.proposal.pk)
+        proposal.save()
+        proposal.save()
+        self.assertEqual(self.history(), [CREATION_CHANGES])
+        proposal.refresh_from_db()
+        self.assertEqual(proposal.history_version, 1)
+
+    def test_consecutive_saves_compare_with_previous_save(self):
+        self.proposal.client_name = 'Durand'
+        self.proposal.save()
+        self.proposal.client_name = 'Martin'
+        self.proposal.save()
+        self.assertEqual(self.history()[1:], [
+            {'client_name': {'old': 'Dupont', 'new': 'Durand'}},
+            {'client_name': {'old': 'Durand', 'new': 'Martin'}},
+        ])
+
+    def test_instance_built_with_pk_reads_previous_values(self):
+        proposal = Proposal(pk=self.proposal.pk, opportunity_number='OPP-1', client_name='Durand',
+                            guarantee_type='DO', ouvrage_cost=Decimal('100000.00'), do_rate=Decimal('0.0100'),
+                            created_at=self.proposal.created_at, history_version=self.proposal.history_version)
+        # Instance existante sans valeurs chargées (ni lue en base ni déjà enregistrée)
+        proposal._state.adding = False
+        proposal.save()
+        self.assertEqual(self.history()[-1], {'client_name': {'old': 'Dupont', 'new': 'Durand'}})
+
+    def test_deferred_fields(self):
+        proposal = Proposal.objects.only('id', 'client_name').get(pk=self.proposal.pk)
+        proposal.client_name = 'Durand'
+        proposal.save()
+        self.assertEqual(self.history()[-1], {'client_name': {'old': 'Dupont', 'new': 'Durand'}})
+        self.assertEqual(Proposal.objects.get(pk=self.proposal.pk).prime_seule_tarif_duo, Decimal('1000.00'))
+
+
+class PriceBatchTests(TestCase):
+    RATES = [None, Decimal('0'), Decimal('0.0050'), Decimal('0.0125'), Decimal('0.0333'), Decimal('999.9999')]
+    COSTS = [Decimal('0.00'), Decimal('1.00'), Decimal('0.01'), Decimal('12345.67'), Decimal('9999999999.99')]
+
+    def grid(self):
+        return [
+            (guarantee_type, cost, do_rate, trc_rate)
+            for guarantee_type in ('DO', 'TRC', 'DUO')
+            for cost in self.COSTS
+            for do_rate in self.RATES
+            for trc_rate in self.RATES
+        ]
+
+    def test_matches_price_proposal(self):
+        grid = self.grid()
+        premiums = price_batch(*zip(*grid))
+        self.assertEqual(premiums.rows(), [price_proposal(*row) for row in grid])
+
+    def test_rounding_matches_stored_premiums(self):
+        grid = [row for row in self.grid() if row[1] < Decimal('1E+6')]
+        premiums = price_batch(*zip(*grid)).rows(STORED_PREMIUM_PLACES)
+        for index, (guarantee_type, cost, do_rate, trc_rate) in enumerate(grid):
+            proposal = Proposal.objects.create(opportunity_number=f'OPP-{index}', guarantee_type=guarantee_type,
+                                               ouvrage_cost=cost, do_rate=do_rate, trc_rate=trc_rate)
+            proposal.refresh_from_db()
+            stored = (proposal.prime_seule_tarif_do, proposal.prime_seule_tarif_trc, proposal.prime_seule_tarif_duo)
+            self.assertEqual(stored, tuple(premiums[index]), grid[index])
+
+    def test_half_cents_round_to_even(self):
+        premiums = price_batch(['DO'] * 3, [Decimal('1.00'), Decimal('3.00'), Decimal('5.00')], [Decimal('0.0050'), Decimal('0.0050'), Decimal('0.0050')], [None] * 3)
+        self.assertEqual(premiums.duo_cents().tolist(), [0, 2, 2])
+
+    def test_rejects_extra_precision(self):
+        with self.assertRaises(ValueError):
+            price_batch(['DO'], [Decimal('1.001')], [Decimal('0.01')], [None])
+
+
+class RepriceTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.proposals = [create_proposal(f'OPP-{index}', ouvrage_cost=Decimal('1000.00')) for index in range(3)]
+        self.trc = create_proposal('OPP-TRC', guarantee_type='TRC', do_rate=None, trc_rate=Decimal('0.0100'))
+
+    def test_endpoint_applies_new_rate(self):
+        response = self.client.post('/api/proposals/reprice/?guarantee_type=DO', {'do_rate': '0.0200', 'chunk_size': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report['selected'], report['changed'], report['history_entries']), (3, 3, 3))
+        self.assertEqual(report['total_duo_delta'], '30.00')
+        for proposal in Proposal.objects.filter(guarantee_type='DO'):
+            self.assertEqual((proposal.do_rate, proposal.prime_seule_tarif_do, proposal.prime_seule_tarif_duo),
+                             (Decimal('0.0200'), Decimal('20.00'), Decimal('20.00')))
+            self.assertEqual(proposal.history_entries.order_by('-id').first().changes['do_rate'], {'old': '0.01', 'new': '0.02'})
+        self.trc.refresh_from_db()
+        self.assertEqual(self.trc.prime_seule_tarif_trc, Decimal('1000.00'))
+
+    def test_dry_run_writes_nothing(self):
+        response = self.client.post('/api/proposals/reprice/', {'do_rate': '0.0200', 'dry_run': True}, format='json')
+        self.assertEqual(response.json()['changed'], 4)
+        self.assertFalse(Proposal.objects.filter(do_rate=Decimal('0.0200')).exists())
+        self.assertEqual(ProposalHistory.objects.count(), 4)
+
+    def test_endpoint_rejects_extra_precision(self):
+        response = self.client.post('/api/proposals/reprice/', {'do_rate': '0.015049'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_rejects_extra_precision(self):
+        with self.assertRaises(CommandError):
+            call_command('reprice_proposals', '--do-rate', '0.015049', stdout=StringIO())
+        self.assertFalse(Proposal.objects.exclude(do_rate=Decimal('0.0100')).filter(guarantee_type='DO').exists())
+        call_command('reprice_proposals', '--do-rate', '0.0150', '--filter', 'guarantee_type=DO', stdout=StringIO())
+        self.assertEqual(set(Proposal.objects.filter(guarantee_type='DO').values_list('prime_seule_tarif_do', flat=True)),
+                         {Decimal('15.00')})
+
+    def test_constant_column_rejects_extra_precision(self):
+        with self.assertRaises(ValueError):
+            constant_column(Decimal('0.015049'), 3, RATE_PLACES)
+
+
+@override_settings(DOCUMENT_JOB_EXECUTOR='sync')
+class DocumentJobTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('DOCUMENT_JOB_DIR', 'DOCUMENT_CACHE_DIR')
+        self.proposal = create_proposal('OPP-1')
+
+    def submit(self, doc_type='pdf'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/proposals/{self.proposal.pk}/document-jobs/', {'doc_type': doc_type}, format='json')
+        self.assertEqual(response.status_code, 202)
+        return DocumentJob.objects.get(pk=response.json()['id'])
+
+    def expire(self, job):
+        past = timezone.now() - timedelta(days=2)
+        DocumentJob.objects.filter(pk=job.pk).update(created_at=past, finished_at=past)
+
+    def test_job_renders_and_downloads(self):
+        for doc_type, signature in (('pdf', b'%PDF'), ('word', b'PK')):
+            with self.subTest(doc_type=doc_type):
+                job = self.submit(doc_type)
+                self.assertEqual(job.status, DocumentJob.STATUS_DONE)
+                self.assertEqual(self.get_json(f'/api/document-jobs/{job.pk}/')['status'], DocumentJob.STATUS_DONE)
+                response = self.client.get(f'/api/document-jobs/{job.pk}/download/')
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(b''.join(response.streaming_content).startswith(signature))
+
+    def test_unknown_doc_type(self):
+        response = self.client.post(f'/api/proposals/{self.proposal.pk}/document-jobs/', {'doc_type': 'odt'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_jobs_are_purged_with_their_files(self):
+        expired, recent = self.submit(), self.submit()
+        pending = DocumentJob.objects.create(proposal=self.proposal, doc_type='pdf')
+        self.expire(expired)
+        self.expire(pending)
+        self.assertEqual(jobs.purge_expired_jobs(), 1)
+        self.assertFalse(os.path.exists(expired.file_path))
+        self.assertTrue(os.path.exists(recent.file_path))
+        self.assertEqual(set(DocumentJob.objects.values_list('pk', flat=True)), {recent.pk, pending.pk})
+        self.assertEqual(self.client.get(f'/api/document-jobs/{expired.pk}/download/').status_code, 404)
+
+    def test_worker_command_purges_expired_jobs(self):
+        expired, recent = self.submit(), self.submit()
+        self.expire(expired)
+        jobs._last_purge = None
+        output = StringIO()
+        call_command('run_document_jobs', '--workers', '1', stdout=output)
+        self.assertIn('0 document(s) traité(s), 1 job(s) expiré(s) supprimé(s)', output.getvalue())
+        self.assertEqual(list(DocumentJob.objects.values_list('pk', flat=True)), [recent.pk])
+
+
+    def test_run_document_job_reports_whether_it_ran(self):
+        job = DocumentJob.objects.create(proposal=self.proposal, doc_type='pdf')
+        self.assertTrue(jobs.run_document_job(job.pk))
+        self.assertFalse(jobs.run_document_job(job.pk))
+        self.assertEqual(DocumentJob.objects.get(pk=job.pk).status, DocumentJob.STATUS_DONE)
+
+    def test_requeued_job_is_not_overwritten(self):
+        job = DocumentJob.objects.create(proposal=self.proposal, doc_type='pdf')
+        real_open = jobs.open_document
+
+        def open_and_requeue(*args):
+            # Le job est repris par requeue_stale_jobs pendant le rendu
+            DocumentJob.objects.filter(pk=job.pk).update(status=DocumentJob.STATUS_PENDING, started_at=None)
+            return real_open(*args)
+
+        with mock.patch.object(jobs, 'open_document', open_and_requeue):
+            self.assertFalse(jobs.run_document_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, DocumentJob.STATUS_PENDING)
+        self.assertEqual(job.file_path, '')
+
+    def test_worker_command_counts_jobs_it_ran(self):
+        first = DocumentJob.objects.create(proposal=self.proposal, doc_type='pdf')
+        second = DocumentJob.objects.create(proposal=self.proposal, doc_type='pdf')
+        output = StringIO()
+        with mock.patch('django_api.management.commands.run_document_jobs.run_document_job',
+                        side_effect=lambda job_id: job_id == first.pk), \
+                mock.patch('django_api.management.commands.run_document_jobs.pending_job_ids',
+                           side_effect=[[first.pk, second.pk], []]):
+            call_command('run_document_jobs', '--workers', '1', stdout=output)
+        self.assertIn('1 document(s) traité(s)', output.getvalue())
+
+
+class DocumentCacheTests(ProposalAPITestCase):
+    GENERATED_AT = datetime(2026, 3, 2, 10, 30)
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('DOCUMENT_CACHE_DIR')
+        self.proposal = create_proposal('OPP-1', address_chantier='1 rue de la Paix, Paris')
+
+    def cached_files(self):
+        directory = document_cache.proposal_cache_dir(self.proposal.pk)
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def open(self, proposal=None):
+        document, key = document_cache.open_document(proposal or self.proposal, 'pdf', self.GENERATED_AT)
+        with document:
+            return document.read(), key
+
+    def test_same_content_is_rendered_once(self):
+        first, key = self.open()
+        with mock.patch.object(document_cache, 'render_document') as render:
+            self.assertEqual(self.open(), (first, key))
+        render.assert_not_called()
+        self.assertEqual(self.cached_files(), [f'{key}.pdf'])
+
+    def test_key_ignores_unrendered_fields(self):
+        _, key = self.open()
+        proposal = Proposal.objects.get(pk=self.proposal.pk)
+        proposal.client_name = 'Autre client'
+        proposal.ouvrage_cost = Decimal('100000')
+        self.assertEqual(document_cache.cache_key(proposal, 'pdf', '02/03/2026'), key)
+        proposal.address_chantier = '2 rue de la Paix, Paris'
+        self.assertNotEqual(document_cache.cache_key(proposal, 'pdf', '02/03/2026'), key)
+
+    def test_rendered_field_change_purges_entries(self):
+        self.open()
+        self.proposal.client_name = 'Autre client'
+        self.proposal.save()
+        self.assertEqual(len(self.cached_files()), 1)
+        self.proposal.work_type = 'RENOVATIONLE'
+        self.proposal.save()
+        self.assertEqual(self.cached_files(), [])
+
+    def test_eviction(self):
+        self.open()
+        self.assertEqual(document_cache.evict(max_bytes=0), 0)
+        self.assertEqual(self.cached_files(), [])
+
+    def test_endpoint_etag(self):
+        url = f'/api/proposals/{self.proposal.pk}/generate-document/'
+        with mock.patch('django_api.views.datetime') as clock:
+            clock.now.return_value = self.GENERATED_AT
+            response = self.client.post(url, {'doc_type': 'pdf'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="Proposition_commerciale_OPP-1_02032026_1030.pdf"')
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+            response = self.client.post(url, {'doc_type': 'pdf'}, format='json', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            etag = response['ETag']
+            for header, expected in ((f'"other", W/{etag}', 304), ('*', 304), (etag[1:-2], 200), (f'"x{etag[1:]}', 200)):
+                with self.subTest(header=header):
+                    response = self.client.post(url, {'doc_type': 'pdf'}, format='json', HTTP_IF_NONE_MATCH=header)
+                    self.assertEqual(response.status_code, expected)
+
+    def test_etag_matches(self):
+        self.assertTrue(document_cache.etag_matches('"a", "b"', '"b"'))
+        self.assertTrue(document_cache.etag_matches('W/"b"', '"b"'))
+        self.assertTrue(document_cache.etag_matches('*', '"b"'))
+        self.assertFalse(document_cache.etag_matches('"ab"', '"b"'))
+        self.assertFalse(document_cache.etag_matches('', '"b"'))
+
+
+class DocumentExportTests(ProposalAPITestCase):
+    GENERATED_AT = datetime(2026, 3, 2, 10, 30)
+
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('DOCUMENT_CACHE_DIR')
+        for index in range(5):
+            create_proposal(f'OPP-{index}')
+
+    def test_zip_has_one_document_per_proposal_in_order(self):
+        queryset = Proposal.objects.order_by('-id')
+        archive = zipfile.ZipFile(BytesIO(b''.join(stream_zip(queryset, 'word', self.GENERATED_AT))))
+        self.assertEqual(archive.namelist(), [f'Proposition_commerciale_OPP-{index}_02032026_1030.docx' for index in range(4, -1, -1)])
+        self.assertIsNone(archive.testzip())
+        # Documents rendus une seule fois, puis relus depuis le cache
+        with mock.patch.object(document_cache, 'render_document') as render:
+            content = b''.join(stream_zip(queryset, 'word', self.GENERATED_AT))
+        self.assertEqual(len(zipfile.ZipFile(BytesIO(content)).namelist()), 5)
+        render.assert_not_called()
+
+    def test_merged_pdf(self):
+        with merged_pdf_file(Proposal.objects.all(), self.GENERATED_AT) as document:
+            content = document.read()
+        self.assertTrue(content.startswith(b'%PDF'))
+        # Chaque devis commence sur une nouvelle page
+        self.assertGreaterEqual(content.count(b'/Type /Page') - content.count(b'/Type /Pages'), 5)
+
+
+class DocumentTemplateTests(TestCase):
+    def setUp(self):
+        self.first = create_proposal('OPP-1', address_chantier='1 rue de la Paix, Paris', ouvrage_description='Maison')
+        self.second = create_proposal('OPP-2', guarantee_type='DUO', work_type='RENOVATIONLD', ouvrage_cost=Decimal('2500.50'),
+                                      address_chantier=None, ouvrage_description=None)
+
+    def word_text(self, proposal):
+        document = DocxDocument(BytesIO(render_document(proposal, 'word', datetime(2026, 3, 2))))
+        cells = [cell.text for table in document.tables for row in table.rows for cell in row.cells]
+        return '\n'.join([paragraph.text for paragraph in document.paragraphs] + cells)
+
+    def test_templates_are_built_once(self):
+        self.assertIs(get_pdf_template(), get_pdf_template())
+        self.assertIs(get_word_template(), get_word_template())
+
+    def test_word_renders_only_the_proposal_values(self):
+        self.word_text(self.first)
+        text = self.word_text(self.second)
+        for value in ('2500.50 €', 'DUO (DO + TRC)', 'Rénovation lourde', 'Non renseignée', '02/03/2026'):
+            self.assertIn(value, text)
+        # Le gabarit partagé n'a pas gardé les valeurs du rendu précédent
+        self.assertNotIn('1 rue de la Paix', text)
+        self.assertIn('1 rue de la Paix', self.word_text(self.first))
+
+    def test_pdf(self):
+        first = render_document(self.first, 'pdf', datetime(2026, 3, 2))
+        self.assertTrue(first.startswith(b'%PDF'))
+        self.assertNotEqual(first, render_document(self.second, 'pdf', datetime(2026, 3, 2)))
+        with self.assertRaises(UnsupportedDocumentType):
+            render_document(self.first, 'odt')
+
+    def test_parameter_values(self):
+        self.second.ouvrage_cost = None
+        self.second.ouvrage_destination = ''
+        values = parameter_values(self.second, 'Aucune')
+        self.assertEqual(values[0], 'Non Applicable')
+        self.assertEqual(values[2], 'xxxxxxx €')
+        self.assertEqual(values[5:], ('Non renseignée', 'Non renseignée'))
+
+
+class ExportEndpointTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('DOCUMENT_CACHE_DIR')
+        for index, name in enumerate(('Dupont', 'Lefèvre', 'Martin')):
+            create_proposal(f'OPP-{index}', client_name=name)
+        proposal = Proposal.objects.get(opportunity_number='OPP-1')
+        proposal.ouvrage_cost = Decimal('5000.00')
+        proposal.save()
+
+    def download(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, getattr(response, 'content', b'')[:500])
+        return response, b''.join(response.streaming_content)
+
+    def rows(self, file_format, content):
+        if file_format == 'csv':
+            return list(csv.reader(content.decode('utf-8-sig').splitlines()))
+        if file_format == 'xlsx':
+            return [list(row) for row in load_workbook(BytesIO(content), read_only=True).active.values]
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        return [list(lines[0])] + [list(line.values()) for line in lines]
+
+    def test_proposal_export_formats(self):
+        for file_format in ('csv', 'xlsx', 'jsonl'):
+            with self.subTest(file_format=file_format):
+                response, content = self.download('/api/proposals/export/', {
+                    'file_format': file_format, 'fields': 'client_name,id', 'ordering': '-client_name',
+                })
+                self.assertRegex(response['Content-Disposition'], rf'filename="Devis_\d{{8}}_\d{{4}}\.{file_format}"')
+                rows = self.rows(file_format, content)
+                self.assertEqual(rows[0], ['id', 'client_name'])
+                self.assertEqual([row[1] for row in rows[1:]], ['Martin', 'Lefèvre', 'Dupont'])
+
+    def test_history_export(self):
+        response, content = self.download('/api/proposals/export-history/', {'client_name': 'Lefèvre'})
+        self.assertRegex(response['Content-Disposition'], r'filename="Historique_devis_\d{8}_\d{4}\.csv"')
+        rows = self.rows('csv', content)
+        self.assertEqual(rows[0], ['id', 'proposal_id', 'opportunity_number', 'timestamp', 'user_ip', 'changes'])
+        self.assertEqual([row[2] for row in rows[1:]], ['OPP-1', 'OPP-1'])
+        self.assertEqual(json.loads(rows[2][5])['ouvrage_cost'], {'old': '1E+5', 'new': '5E+3'})
+
+    def test_invalid_format(self):
+        self.assertEqual(self.client.get('/api/proposals/export/', {'file_format': 'ods'}).status_code, 400)
+
+    def test_document_bundles(self):
+        response, content = self.download('/api/proposals/export-documents/', {'doc_type': 'pdf', 'bundle': 'zip'})
+        self.assertRegex(response['Content-Disposition'], r'filename="Propositions_commerciales_\d{8}_\d{4}\.zip"')
+        self.assertEqual(len(zipfile.ZipFile(BytesIO(content)).namelist()), 3)
+        response, content = self.download('/api/proposals/export-documents/', {'doc_type': 'pdf', 'bundle': 'pdf', 'client_name': 'Martin'})
+        self.assertRegex(response['Content-Disposition'], r'filename="Propositions_commerciales_\d{8}_\d{4}\.pdf"')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_invalid_document_bundles(self):
+        for params, status_code in (({'doc_type': 'word', 'bundle': 'pdf'}, 400), ({'bundle': 'tar'}, 400),
+                                    ({'doc_type': 'odt'}, 400), ({'client_name': 'Inconnu'}, 404)):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/proposals/export-documents/', params).status_code, status_code)
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'devis.xlsx')
+        output = StringIO()
+        call_command('export_proposals', '--format', 'xlsx', '--filter', 'client_name=du', '--output', path, stdout=output)
+        self.assertIn('1 lignes exportées', output.getvalue())
+        with open(path, 'rb') as export:
+            rows = self.rows('xlsx', export.read())
+        self.assertEqual(rows[1][2], 'Dupont')
+
+
+class ImportTests(ProposalAPITestCase):
+    HEADER = 'opportunity_number,client_name,guarantee_type,work_type,ouvrage_cost,do_rate,trc_rate,is_vip_client,prime_seule_tarif_duo\n'
+
+    def setUp(self):
+        super().setUp()
+        self.existing = create_proposal('OPP-1', client_name='Dupont')
+        create_proposal('OPP-2', client_name='Martin')
+
+    def upload(self, lines, **options):
+        content = (self.HEADER + ''.join(line + '\n' for line in lines)).encode()
+        response = self.client.post('/api/proposals/import/', {'file': SimpleUploadedFile('devis.csv', content), **options}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response.json()
+
+    def test_creates_updates_and_reports_errors(self):
+        report = self.upload([
+            'OPP-1,Dupont,DO,NEUF,200000.00,0.0100,,oui,999',
+            'OPP-2,Martin,DO,NEUF,100000.00,0.0100,,non,',
+            'OPP-3,Durand,DUO,RENOVATIONLD,1234.56,0.0125,0.0050,,',
+            'OPP-4,Petit,DO,NEUF,1000.00,,,,',
+            'OPP-5,Roux,DO,NEUF,abc,0.01,,,',
+            'OPP-3,Durand,DO,NEUF,1.00,0.01,,,',
+        ], chunk_size=2)
+        self.assertEqual({key: report[key] for key in ('rows', 'created', 'updated', 'unchanged', 'failed')},
+                         {'rows': 6, 'created': 1, 'updated': 1, 'unchanged': 1, 'failed': 3})
+        self.assertEqual(report['ignored_columns'], ['prime_seule_tarif_duo'])
+        self.assertEqual([(error['line'], set(error['errors'])) for error in report['errors']],
+                         [(5, {'do_rate'}), (6, {'ouvrage_cost'}), (7, {'opportunity_number'})])
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.prime_seule_tarif_duo, self.existing.is_vip_client), (Decimal('2000.00'), True))
+        created = Proposal.objects.get(opportunity_number='OPP-3')
+        expected = price_proposal('DUO', Decimal('1234.56'), Decimal('0.0125'), Decimal('0.0050'))
+        self.assertEqual((created.prime_seule_tarif_do, created.prime_seule_tarif_trc, created.prime_seule_tarif_duo),
+                         tuple(value.quantize(Decimal('0.01')) for value in expected))
+        self.assertEqual(created.history_entries.get().changes, CREATION_CHANGES)
+        self.assertEqual(self.existing.history_entries.count(), 2)
+
+    def test_dry_run_writes_nothing(self):
+        report = self.upload(['OPP-1,Durand,DO,NEUF,100000.00,0.0100,,,', 'OPP-9,Petit,DO,NEUF,1.00,0.01,,,'], dry_run=True)
+        self.assertEqual((report['created'], report['updated']), (1, 1))
+        self.assertEqual(Proposal.objects.count(), 2)
+        self.assertEqual(ProposalHistory.objects.count(), 2)
+
+    def test_export_reimports_unchanged(self):
+        content = b''.join(self.client.get('/api/proposals/export/').streaming_content)
+        response = self.client.post('/api/proposals/import/', {'file': SimpleUploadedFile('devis.csv', content)}, format='multipart')
+        self.assertEqual(response.json()['unchanged'], 2)
+        self.assertEqual(ProposalHistory.objects.count(), 2)
+
+    def test_rejected_chunk_is_rolled_back(self):
+        with mock.patch.object(imports, 'bulk_update_rows', side_effect=IntegrityError('conflit')):
+            report = self.upload(['OPP-1,Durand,DO,NEUF,100000.00,0.0100,,,', 'OPP-9,Petit,DO,NEUF,1.00,0.01,,,'])
+        self.assertEqual((report['created'], report['updated'], report['failed']), (0, 0, 2))
+        self.assertFalse(Proposal.objects.filter(opportunity_number='OPP-9').exists())
+        self.assertEqual(ProposalHistory.objects.count(), 2)
+
+    def test_missing_key_column(self):
+        response = self.client.post('/api/proposals/import/', {'file': SimpleUploadedFile('devis.csv', b'client_name\nDupont\n')}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class HistoryStorageTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.proposal = create_proposal('OPP-1', client_name='Dupont')
+
+    def raw_column(self, entry, column):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {column} FROM django_api_proposalhistory WHERE id = %s', [entry.pk])
+            value = cursor.fetchone()[0]
+        return None if value is None else json.loads(value)
+
+    def test_changes_are_stored_compactly(self):
+        self.proposal.ouvrage_cost = Decimal('1234.56')
+        self.proposal.save()
+        entry = self.proposal.history_entries.order_by('-id').first()
+        self.assertEqual(self.raw_column(entry, 'changes'), [[6, 10000000, 123456], [13, 100000, 1235], [14, 100000, 1235]])
+        self.assertEqual(entry.changes['ouvrage_cost'], {'old': '1E+5', 'new': '1234.56'})
+        self.assertEqual(ProposalHistory.objects.get(pk=entry.pk).changes['prime_seule_tarif_duo'], {'old': '1E+3', 'new': '12.35'})
+
+    def test_legacy_entries_are_read_as_is(self):
+        legacy = {'client_name': {'old': 'A', 'new': 'B'}}
+        entry = ProposalHistory.objects.create(proposal=self.proposal, changes=legacy)
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE django_api_proposalhistory SET changes = %s WHERE id = %s', [json.dumps(legacy), entry.pk])
+        self.assertEqual(ProposalHistory.objects.get(pk=entry.pk).changes, legacy)
+
+    @override_settings(HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_snapshot_every_interval(self):
+        for index in range(5):
+            self.proposal.client_name = f'Client {index}'
+            self.proposal.save()
+        entries = list(self.proposal.history_entries.order_by('id'))
+        self.assertEqual([entry.snapshot is not None for entry in entries], [True, False, False, True, False, False])
+        self.assertEqual(entries[3].snapshot['client_name'], 'Client 2')
+        self.assertEqual(entries[3].snapshot['ouvrage_cost'], Decimal('100000.00'))
+
+    def test_endpoint_pages_newest_first(self):
+        for index in range(4):
+            self.proposal.client_name = f'Client {index}'
+            self.proposal.save()
+        url = f'/api/proposals/{self.proposal.pk}/history/'
+        data = self.get_json(url, {'page_size': 2})
+        names = [entry['changes']['client_name']['new'] for entry in data['results']]
+        data = self.get_json(data['next'])
+        names += [entry['changes'].get('client_name', {}).get('new') for entry in data['results']]
+        self.assertEqual(names, ['Client 3', 'Client 2', 'Client 1', 'Client 0'])
+        data = self.get_json(data['next'])
+        self.assertEqual([entry['changes'] for entry in data['results']], [CREATION_CHANGES])
+        self.assertIsNone(data['next'])
+
+    def test_invalid_archive_month(self):
+        self.assertEqual(self.client.get(f'/api/proposals/{self.proposal.pk}/history/', {'archive': '2026-13'}).status_code, 400)
+
+
+@override_settings(HISTORY_SNAPSHOT_INTERVAL=3)
+class AsOfTests(ProposalAPITestCase):
+    START = datetime(2026, 1, 5, 9, 0, tzinfo=timezone.get_current_timezone())
+    COSTS = ['100000.00', '110000.00', '120000.00', '130000.00', '140000.00', '150000.00', '160000.00']
+
+    def setUp(self):
+        super().setUp()
+        self.proposal = create_proposal('OPP-1', ouvrage_cost=Decimal(self.COSTS[0]))
+        for cost in self.COSTS[1:]:
+            self.proposal.ouvrage_cost = Decimal(cost)
+            self.proposal.save()
+        # Une entrée par jour à 9 h à partir du 05/01
+        Proposal.objects.filter(pk=self.proposal.pk).update(created_at=self.START)
+        for day, entry in enumerate(self.proposal.history_entries.order_by('id')):
+            ProposalHistory.objects.filter(pk=entry.pk).update(timestamp=self.START + timedelta(days=day))
+        self.proposal.refresh_from_db()
+
+    def costs_as_of(self):
+        return [proposal_as_of(self.proposal, self.START + timedelta(days=day, hours=1)).ouvrage_cost for day in range(len(self.COSTS))]
+
+    def test_replay_from_snapshots(self):
+        self.assertEqual(self.costs_as_of(), [Decimal(cost) for cost in self.COSTS])
+        historical = proposal_as_of(self.proposal, self.START + timedelta(days=2, hours=1))
+        self.assertEqual((historical.prime_seule_tarif_duo, historical.updated_at), (Decimal('1200.00'), self.START + timedelta(days=2)))
+        self.assertIsNone(proposal_as_of(self.proposal, self.START - timedelta(minutes=1)))
+
+    def test_replay_without_snapshots(self):
+        # Historique antérieur aux instantanés : les différences sont annulées depuis l'état actuel
+        ProposalHistory.objects.update(snapshot=None)
+        self.assertEqual(self.costs_as_of(), [Decimal(cost) for cost in self.COSTS])
+
+    def test_endpoint(self):
+        url = f'/api/proposals/{self.proposal.pk}/'
+        self.assertEqual(self.get_json(url, {'as_of': '2026-01-07T09:30'})['ouvrage_cost'], '120000.00')
+        self.assertEqual(self.get_json(url, {'as_of': '2026-01-06'})['ouvrage_cost'], '110000.00')
+        self.assertEqual(self.get_json(url)['ouvrage_cost'], '160000.00')
+        self.assertEqual(self.client.get(url, {'as_of': '2026-01-04'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'as_of': 'hier'}).status_code, 400)
+
+
+@override_settings(HISTORY_AUDIT_MODE='queue', HISTORY_AUDIT_FLUSH_SECONDS=0.05, HISTORY_AUDIT_BATCH_SIZE=3)
+class AuditQueueTests(TemporaryDirectoriesMixin, TransactionTestCase):
+    def setUp(self):
+        self.use_temporary_generation()
+        self.addCleanup(audit.shutdown_writer)
+
+    def test_entries_are_written_in_batches(self):
+        proposals = [create_proposal(f'OPP-{index}') for index in range(4)]
+        proposals[0].client_name = 'Durand'
+        proposals[0].save()
+        audit.flush_history()
+        self.assertEqual(ProposalHistory.objects.count(), 5)
+        self.assertEqual(proposals[0].history_entries.order_by('id').last().changes, {'client_name': {'old': 'Client OPP-0', 'new': 'Durand'}})
+        stats = self.client.get('/api/audit/status/').json()
+        self.assertEqual((stats['mode'], stats['queue_depth'], stats['written'], stats['dropped']), ('queue', 0, 5, 0))
+        self.assertGreaterEqual(stats['batches'], 2)
+
+    def test_rolled_back_save_records_nothing(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            create_proposal('OPP-1')
+            raise RuntimeError
+        audit.flush_history()
+        self.assertEqual(ProposalHistory.objects.count(), 0)
+        self.assertEqual(audit.audit_stats()['written'], 0)
+
+    def test_entries_of_deleted_proposals_are_dropped(self):
+        kept = create_proposal('OPP-1')
+        # Devis supprimé avant que le writer n'écrive son historique
+        writer = audit.get_writer()
+        deleted = Proposal.objects.bulk_create([Proposal(opportunity_number='OPP-2')])[0]
+        Proposal.objects.filter(pk=deleted.pk).delete()
+        writer.put(ProposalHistory(proposal_id=deleted.pk, changes=CREATION_CHANGES))
+        audit.flush_history()
+        self.assertEqual(list(ProposalHistory.objects.values_list('proposal_id', flat=True)), [kept.pk])
+        self.assertEqual(audit.audit_stats()['dropped'], 1)
+
+
+    def test_failed_batch_is_dropped_without_blocking_flush(self):
+        proposal = create_proposal('OPP-1')
+        audit.flush_history()
+        with mock.patch.object(audit.AuditWriter, 'write', side_effect=RuntimeError('disque plein')), \
+                self.assertLogs('django_api.audit', 'ERROR'):
+            audit.get_writer().put(ProposalHistory(proposal=proposal, changes={}))
+            flusher = threading.Thread(target=audit.flush_history)
+            flusher.start()
+            flusher.join(timeout=5)
+        self.assertFalse(flusher.is_alive())
+        self.assertEqual(audit.audit_stats()['dropped'], 1)
+        # Le thread d'écriture survit à l'erreur
+        proposal.client_name = 'Durand'
+        proposal.save()
+        audit.flush_history()
+        self.assertEqual(ProposalHistory.objects.count(), 2)
+
+class RetentionTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('HISTORY_ARCHIVE_DIR')
+        self.proposal = create_proposal('OPP-1', client_name='Dupont')
+        for name in ('Durand', 'Martin', 'Dupont', 'Petit'):
+            self.proposal.client_name = name
+            self.proposal.save()
+        self.proposal.ouvrage_cost = Decimal('5000.00')
+        self.proposal.save()
+        self.entries = list(self.proposal.history_entries.order_by('id'))
+
+    def move(self, entries, moment):
+        for minute, entry in enumerate(entries):
+            ProposalHistory.objects.filter(pk=entry.pk).update(timestamp=moment + timedelta(minutes=minute))
+        Proposal.objects.filter(pk=self.proposal.pk).update(created_at=min(self.proposal.created_at, moment))
+        self.proposal.refresh_from_db()
+
+    def changes(self):
+        return [entry.changes for entry in self.proposal.history_entries.order_by('timestamp', 'id')]
+
+    def test_rollup_merges_old_days(self):
+        day = timezone.localtime().replace(hour=9, minute=0) - timedelta(days=200)
+        self.move(self.entries[:1], day - timedelta(days=1))
+        self.move(self.entries[1:3], day)
+        report = apply_retention(archive=False)
+        self.assertEqual(report['rollup'], {'days': 1, 'entries_before': 2, 'entries_after': 1})
+        self.assertEqual(self.changes(), [CREATION_CHANGES, {'client_name': {'old': 'Dupont', 'new': 'Martin'}}]
+                         + [entry.changes for entry in self.entries[3:]])
+        # Reconstruction à la résolution de la journée
+        self.assertEqual(proposal_as_of(self.proposal, day - timedelta(hours=1)).client_name, 'Dupont')
+        self.assertEqual(proposal_as_of(self.proposal, day + timedelta(hours=12)).client_name, 'Martin')
+
+    def test_rollup_drops_days_without_net_change(self):
+        self.move(self.entries[1:4], timezone.localtime().replace(hour=9, minute=0) - timedelta(days=200))
+        self.assertEqual(apply_retention(archive=False)['rollup'], {'days': 1, 'entries_before': 3, 'entries_after': 0})
+        self.assertEqual(len(self.changes()), 3)
+
+    def test_archive_round_trip(self):
+        old = timezone.localtime().replace(day=10, hour=9, minute=0) - timedelta(days=500)
+        self.move(self.entries[:4], old)
+        expected = [(entry.pk, entry.changes, entry.snapshot) for entry in reversed(self.entries[:4])]
+
+        output = StringIO()
+        call_command('prune_history', '--skip-rollup', stdout=output)
+        self.assertIn(f"Archivage : 4 entrées ({old:%Y-%m})", output.getvalue())
+        self.assertEqual(self.proposal.history_entries.count(), 2)
+        archive = HistoryArchive.objects.get()
+        self.assertEqual((archive.month, archive.entries), (old.date().replace(day=1), 4))
+        self.assertTrue(os.path.exists(archive.file_path))
+
+        data = self.get_json(f'/api/proposals/{self.proposal.pk}/history/', {'archive': f'{old:%Y-%m}'})
+        self.assertEqual([(entry['id'], entry['changes']) for entry in data['results']], [(pk, changes) for pk, changes, _ in expected])
+        entries = retention.archived_entries(self.proposal, old.date().replace(day=1))
+        self.assertEqual([(entry.pk, entry.changes, entry.snapshot) for entry in entries], expected)
+
+        # L'historique archivé ne sert plus aux reconstructions
+        response = self.client.get(f'/api/proposals/{self.proposal.pk}/', {'as_of': f'{old:%Y-%m-%d}'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_dry_run(self):
+        self.move(self.entries, timezone.localtime() - timedelta(days=500))
+        report = apply_retention(dry_run=True)
+        self.assertEqual((report['rollup']['entries_before'], report['archive']['entries']), (6, 6))
+        self.assertEqual(ProposalHistory.objects.count(), 6)
+        self.assertFalse(HistoryArchive.objects.exists())
+
+
+class ResponseCacheTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.proposal = create_proposal('OPP-1', client_name='Dupont')
+        create_proposal('OPP-2', client_name='Martin')
+
+    def names(self):
+        return [row['client_name'] for row in self.get_json('/api/proposals/')]
+
+    def test_responses_are_served_from_cache(self):
+        detail = f'/api/proposals/{self.proposal.pk}/'
+        self.assertEqual(self.names(), ['Dupont', 'Martin'])
+        self.assertEqual(self.get_json(detail)['client_name'], 'Dupont')
+        # Écriture sans signal : les réponses en cache sont resservies telles quelles
+        Proposal.objects.filter(pk=self.proposal.pk).update(client_name='Durand')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['Dupont', 'Martin'])
+            self.assertEqual(self.get_json(detail)['client_name'], 'Dupont')
+
+    def test_writes_invalidate_the_cache(self):
+        detail = f'/api/proposals/{self.proposal.pk}/'
+        self.assertEqual(self.get_json(detail)['client_name'], 'Dupont')
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(detail, {'client_name': 'Durand'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.names(), ['Durand', 'Martin'])
+        self.assertEqual(self.get_json(detail)['client_name'], 'Durand')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/proposals/reprice/', {'do_rate': '0.0200'}, format='json')
+        self.assertEqual(self.get_json(detail)['prime_seule_tarif_do'], '2000.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(detail).status_code, 204)
+        self.assertEqual(self.names(), ['Martin'])
+        self.assertEqual(self.client.get(detail).status_code, 404)
+
+    def test_page_links_follow_the_request_origin(self):
+        params = {'page_size': 1}
+        self.assertTrue(self.client.get('/api/proposals/', params).json()['next'].startswith('http://testserver/'))
+        for extra, origin in (({'HTTP_HOST': 'localhost'}, 'http://localhost/'), ({'secure': True}, 'https://testserver/')):
+            with self.subTest(origin=origin):
+                response = self.client.get('/api/proposals/', params, **extra)
+                self.assertTrue(response.json()['next'].startswith(origin))
+
+    def test_generation_is_shared_between_processes(self):
+        self.assertEqual(self.names(), ['Dupont', 'Martin'])
+        Proposal.objects.filter(pk=self.proposal.pk).update(client_name='Durand')
+        # Écriture traitée par un autre processus : il a sa propre instance du cache, sur le même fichier
+        other = FileBasedCache(settings.CACHES['proposals_generation']['LOCATION'], {'KEY_PREFIX': 'proposals'})
+        other.set(response_cache.GENERATION_KEY, 'autre-processus', timeout=None)
+        self.assertEqual(self.names(), ['Durand', 'Martin'])
+
+    def test_conditional_requests(self):
+        response = self.client.get('/api/proposals/')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/proposals/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        detail = self.client.get(f'/api/proposals/{self.proposal.pk}/')
+        self.assertIn('Last-Modified', detail)
+        self.assertEqual(self.client.get(f'/api/proposals/{self.proposal.pk}/', HTTP_IF_MODIFIED_SINCE=detail['Last-Modified']).status_code, 304)
+
+        # Après une suppression, ni l'ETag ni la date de la liste ne permettent de resservir l'ancienne version
+        with self.captureOnCommitCallbacks(execute=True):
+            Proposal.objects.get(opportunity_number='OPP-2').delete()
+        response = self.client.get('/api/proposals/', HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=detail['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+
+class SQLiteProfileTests(TemporaryDirectoriesMixin, TestCase):
+    def setUp(self):
+        self.path = os.path.join(self.temporary_directory(), 'db.sqlite3')
+        with closing(sqlite3.connect(self.path)) as database:
+            database.execute('CREATE TABLE devis (id INTEGER PRIMARY KEY)')
+
+    def connect(self):
+        options = settings.DATABASE_PROFILES['production']['default']['OPTIONS']
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, NAME=self.path, OPTIONS=options), 'sqlite_profile')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def journal_mode(self):
+        with closing(sqlite3.connect(self.path)) as database:
+            return database.execute('PRAGMA journal_mode').fetchone()[0]
+
+    def test_connections_leave_the_file_untouched(self):
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        with self.connect().cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM devis')
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(self.journal_mode(), 'delete')
+
+    def test_journal_mode_is_stored_in_the_file(self):
+        wrapper = self.connect()
+        self.assertEqual(set_journal_mode(wrapper, 'wal'), 'wal')
+        wrapper.close()
+        self.assertEqual(self.journal_mode(), 'wal')
+        self.assertEqual(set_journal_mode(self.connect(), 'delete'), 'delete')
+        self.assertEqual(self.journal_mode(), 'delete')
+        # Base en mémoire (tests) : rien à faire
+        self.assertIsNone(set_journal_mode(connection, 'wal'))
+
+    @override_settings(DATABASE_PROFILE='basic')
+    def test_migration_enables_wal_under_any_profile(self):
+        migration = importlib.import_module('django_api.migrations.0009_sqlite_wal')
+        schema_editor = mock.Mock(connection=self.connect())
+        migration.enable_wal(None, schema_editor)
+        schema_editor.connection.close()
+        self.assertEqual(self.journal_mode(), 'wal')
+        migration.disable_wal(None, schema_editor)
+        schema_editor.connection.close()
+        self.assertEqual(self.journal_mode(), 'delete')
+
+    def test_read_database(self):
+        default = mock.Mock(in_atomic_block=False, **{'is_in_memory_db.return_value': False})
+        databases = mock.MagicMock(databases={WRITE_DATABASE: {}, READ_DATABASE: {}})
+        databases.__getitem__.return_value = default
+        with mock.patch('django_api.db_router.connections', databases):
+            self.assertEqual(read_database(), READ_DATABASE)
+            # Une transaction lit ses propres écritures
+            default.in_atomic_block = True
+            self.assertEqual(read_database(), WRITE_DATABASE)
+            default.in_atomic_block = False
+            default.is_in_memory_db.return_value = True
+            self.assertEqual(read_database(), WRITE_DATABASE)
+            default.is_in_memory_db.return_value = False
+            databases.databases = {WRITE_DATABASE: {}}
+            self.assertEqual(read_database(), WRITE_DATABASE)
+
+
+class SearchTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.evry = create_proposal('OPP-EVRY', client_name='Bâtir Sud', address_chantier='12 rue de la Gare, Évry',
+                                    ouvrage_description="Construction d'une résidence de logements collectifs")
+        self.lyon = create_proposal('OPP-LYON', client_name='Évry Promotion', guarantee_type='TRC', do_rate=None,
+                                    trc_rate=Decimal('0.0050'), address_chantier='Lyon')
+        create_proposal('OPP-NICE', client_name='Azur Habitat', ouvrage_description='Maison individuelle')
+
+    def search(self, q, **params):
+        return [row['opportunity_number'] for row in self.get_json('/api/proposals/search/', dict(params, q=q))]
+
+    def test_matches_prefixes_without_case_or_accents(self):
+        self.assertEqual(self.search('log coll'), ['OPP-EVRY'])
+        self.assertEqual(self.search('RESIDENCE'), ['OPP-EVRY'])
+        self.assertEqual(self.search('opp-nice'), ['OPP-NICE'])
+        # Tous les mots doivent être présents
+        self.assertEqual(self.search('logements maison'), [])
+
+    def test_ranks_client_above_address(self):
+        # "Évry" : client de OPP-LYON (poids 5), adresse de OPP-EVRY (poids 2)
+        self.assertEqual(self.search('evry'), ['OPP-LYON', 'OPP-EVRY'])
+        self.assertEqual(self.search('evry', limit=1), ['OPP-LYON'])
+
+    def test_input_is_not_fts_syntax(self):
+        self.assertEqual(self.search('maison OR "lyon" NEAR*'), [])
+        self.assertEqual(self.search('"maison'), ['OPP-NICE'])
+
+    def test_combines_with_list_filters(self):
+        self.assertEqual(self.search('evry', guarantee_type='DO'), ['OPP-EVRY'])
+
+    def test_index_follows_writes(self):
+        self.evry.client_name = 'Constructions Martin'
+        self.evry.save()
+        Proposal.objects.filter(pk=self.lyon.pk).update(address_chantier='Marseille')
+        self.assertEqual(self.search('martin'), ['OPP-EVRY'])
+        self.assertEqual(self.search('marseille'), ['OPP-LYON'])
+        self.assertEqual(self.search('batir'), [])
+        Proposal.objects.filter(opportunity_number='OPP-NICE').delete()
+        self.assertEqual(self.search('maison'), [])
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.client.get('/api/proposals/search/', {'q': ' -- '}).status_code, 400)
+        self.assertEqual(self.client.get('/api/proposals/search/', {'q': 'evry', 'limit': '0'}).status_code, 400)
+        self.assertEqual(len(self.search('o', limit=1000)), 3)
+
+
+BAN_COLUMNS = ['numero', 'rep', 'nom_voie', 'code_postal', 'nom_commune', 'lat', 'lon']
+BAN_ROWS = [
+    ['12', 'bis', 'Rue de la Gare', '91000', 'Évry-Courcouronnes', '48.6290', '2.4410'],
+    ['14', '', 'Rue de la Gare', '91000', 'Évry-Courcouronnes', '48.6300', '2.4420'],
+    ['3', '', 'Rue de la Gare', '69001', 'Lyon', '45.7600', '4.8350'],
+    ['', '', '', '75001', 'Paris', '48.8600', '2.3400'],
+]
+
+
+class AddressIndexTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('ADDRESS_INDEX_DIR')
+        patcher = mock.patch.object(addresses, '_index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.source = os.path.join(self.temporary_directory(), 'adresses-91.csv.gz')
+        self.write_source(BAN_ROWS)
+
+    def write_source(self, rows):
+        with gzip.open(self.source, 'wt', encoding='utf-8', newline='') as output:
+            writer = csv.writer(output, delimiter=';')
+            writer.writerow(BAN_COLUMNS)
+            writer.writerows(rows)
+
+    def build(self):
+        output = StringIO()
+        call_command('build_address_index', self.source, stdout=output)
+        return output.getvalue()
+
+    def labels(self, q, **params):
+        return [row['label'] for row in self.get_json('/api/addresses/search/', dict(params, q=q))]
+
+    def test_missing_index(self):
+        response = self.client.get('/api/addresses/search/', {'q': 'gare'})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('error', response.json())
+
+    def test_build_command(self):
+        self.assertIn("3 adresses et 2 voies indexées", self.build())
+        self.assertIn("1 lignes ignorées", self.build())
+        with self.assertRaises(CommandError):
+            call_command('build_address_index', os.path.join(self.temporary_directory(), 'absent.csv'), stdout=StringIO())
+
+    def test_search(self):
+        self.build()
+        # Sans numéro, la voie passe avant ses adresses ; le dernier mot peut être incomplet
+        self.assertEqual(self.labels('rue de la gare evr'), [
+            'Rue de la Gare 91000 Évry-Courcouronnes',
+            '12bis Rue de la Gare 91000 Évry-Courcouronnes',
+            '14 Rue de la Gare 91000 Évry-Courcouronnes',
+        ])
+        self.assertEqual(self.labels('12 bis gare'), ['12bis Rue de la Gare 91000 Évry-Courcouronnes'])
+        self.assertEqual(self.labels('gare lyon', limit=1), ['Rue de la Gare 69001 Lyon'])
+        self.assertEqual(self.labels('gare marseille'), [])
+        record = self.get_json('/api/addresses/search/', {'q': '14 gare'})[0]
+        self.assertEqual((record['housenumber'], record['postcode']), ('14', '91000'))
+        # Coordonnées stockées en float32
+        self.assertAlmostEqual(record['latitude'], 48.63, places=4)
+
+    def test_sorted_by_distance(self):
+        self.build()
+        self.assertEqual(self.labels('gare', lat='45.75', lon='4.83', limit=2),
+                         ['Rue de la Gare 69001 Lyon', 'Rue de la Gare 91000 Évry-Courcouronnes'])
+        self.assertEqual(self.client.get('/api/addresses/search/', {'q': 'gare', 'lat': '91'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/addresses/search/', {'q': 'gare', 'lon': 'est'}).status_code, 400)
+
+    def test_rebuild_is_picked_up(self):
+        self.build()
+        self.assertEqual(self.labels('gare lyon'), ['Rue de la Gare 69001 Lyon', '3 Rue de la Gare 69001 Lyon'])
+        self.write_source(BAN_ROWS[:2])
+        self.build()
+        self.assertEqual(self.labels('gare lyon'), [])
+
+
+class SummaryTests(ProposalAPITestCase):
+    def analytics(self, **params):
+        return self.get_json('/api/proposals/analytics/', params)
+
+    def assertSummariesExact(self):
+        self.assertEqual(summary_drift(), [])
+
+    def test_half_cent_premium_is_rounded_like_the_database(self):
+        self.assertEqual(to_cents(Decimal('0.005')), 0)
+        self.assertEqual(to_cents(Decimal('0.015')), 2)
+        # 1.00 € x 0.0050 = 0.005 € : enregistré 0.00 (demi-pair)
+        proposal = create_proposal('OPP-1', ouvrage_cost=Decimal('1.00'), do_rate=Decimal('0.0050'))
+        self.assertEqual(proposal.prime_seule_tarif_do, Decimal('0.00'))
+        self.assertSummariesExact()
+        self.assertEqual(self.analytics()['total']['prime_seule_tarif_do'], '0.00')
+        proposal.delete()
+        self.assertSummariesExact()
+        self.assertFalse(ProposalSummary.objects.exists())
+
+    def test_writes_keep_summaries_exact(self):
+        first = create_proposal('OPP-1')
+        create_proposal('OPP-2', guarantee_type='DUO', trc_rate=Decimal('0.0050'), is_vip_client=True)
+        create_proposal('OPP-3', guarantee_type='TRC', do_rate=None, trc_rate=Decimal('0.0033'), rcmo_desired=True)
+        self.assertSummariesExact()
+        # Changement de groupe
+        first.work_type = 'RENOVATIONLD'
+        first.ouvrage_cost = Decimal('123456.78')
+        first.save()
+        self.assertSummariesExact()
+        self.client.post('/api/proposals/reprice/', {'do_rate': '0.0125'}, format='json')
+        self.assertSummariesExact()
+        Proposal.objects.filter(guarantee_type='TRC').delete()
+        self.assertSummariesExact()
+
+    def test_rounding_migration(self):
+        migration = importlib.import_module('django_api.migrations.0010_round_stored_premiums')
+        create_proposal('OPP-1', ouvrage_cost=Decimal('1.50'))
+        create_proposal('OPP-2', guarantee_type='DUO', trc_rate=Decimal('0.0050'), is_vip_client=True)
+        # Primes enregistrées sans arrondi, synthèses désynchronisées
+        Proposal.objects.filter(opportunity_number='OPP-1').update(prime_seule_tarif_do=Decimal('0.015'))
+        ProposalSummary.objects.update(proposal_count=5)
+        migration.round_premiums(apps, mock.Mock(connection=connection))
+        self.assertEqual(Proposal.objects.get(opportunity_number='OPP-1').prime_seule_tarif_do, Decimal('0.02'))
+        self.assertSummariesExact()
+
+    def test_analytics(self):
+        create_proposal('OPP-1')
+        create_proposal('OPP-2', guarantee_type='DUO', trc_rate=Decimal('0.0050'), is_vip_client=True)
+        data = self.analytics()
+        self.assertEqual(data['total']['count'], 2)
+        self.assertEqual(data['total']['ouvrage_cost'], '200000.00')
+        self.assertEqual(data['vip_count'], 1)
+        self.assertEqual([row['guarantee_type'] for row in data['by_guarantee_type']], ['DO', 'DUO'])
+        month = timezone.localtime().strftime('%Y-%m')
+        self.assertEqual(data['monthly'], [dict(data['total'], month=month)])
+        self.assertEqual(self.analytics(guarantee_type='DUO', is_vip_client='true')['total']['count'], 1)
+        self.assertEqual(self.analytics(month_to='2000-01')['total']['count'], 0)
+        for params in ({'guarantee_type': 'XX'}, {'month_from': '2026-13'}, {'prime_price_min': '10'}):
+            self.assertEqual(self.client.get('/api/proposals/analytics/', params).status_code, 400)
+
+    def test_rebuild_command(self):
+        create_proposal('OPP-1')
+        ProposalSummary.objects.update(proposal_count=5)
+        with self.assertRaises(SystemExit):
+            call_command('rebuild_summaries', '--check', stdout=StringIO(), stderr=StringIO())
+        output = StringIO()
+        call_command('rebuild_summaries', stdout=output)
+        self.assertIn('1 groupes recalculés (1 en écart)', output.getvalue())
+        self.assertSummariesExact()
+
+
+class MetricsTests(ProposalAPITestCase):
+    def sample(self, name, **labels):
+        # Valeur d'une série de /metrics (0 si elle n'existe pas encore), étiquettes dans l'ordre de la métrique
+        text = render_metrics()
+        prefix = name + '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+        for line in text.splitlines():
+            if line.startswith(prefix + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_text_format(self):
+        counter = Counter('test_total', "Compteur.", labels=('cache',))
+        counter.inc(cache='ré"ponses')
+        counter.inc(2, cache='ré"ponses')
+        self.assertEqual(counter.collect(), [
+            '# HELP test_total Compteur.', '# TYPE test_total counter', 'test_total{cache="ré\\"ponses"} 3',
+        ])
+        histogram = Histogram('test_seconds', "Durée.", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.collect()[2:], [
+            'test_seconds_bucket{le="0.1"} 2', 'test_seconds_bucket{le="1"} 3', 'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 2.65', 'test_seconds_count 4',
+        ])
+
+    def test_request_metrics(self):
+        create_proposal('OPP-1')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        labels = {'view': 'proposal-list', 'action': 'list'}
+        requests = self.sample('axa_http_request_duration_seconds_count', **labels, method='GET', status='200')
+        misses = self.sample('axa_cache_requests_total', cache='responses', result='miss')
+        hits = self.sample('axa_cache_requests_total', cache='responses', result='hit')
+        self.get_json('/api/proposals/')
+        self.get_json('/api/proposals/')
+        self.assertEqual(self.sample('axa_http_request_duration_seconds_count', **labels, method='GET', status='200'), requests + 2)
+        self.assertEqual(self.sample('axa_cache_requests_total', cache='responses', result='miss'), misses + 1)
+        self.assertEqual(self.sample('axa_cache_requests_total', cache='responses', result='hit'), hits + 1)
+        # La réponse servie par le cache n'a fait aucune requête SQL
+        self.assertGreaterEqual(self.sample('axa_http_request_db_queries_bucket', **labels, le='0'), 1)
+        self.assertGreater(self.sample('axa_http_response_size_bytes_count', **labels), 0)
+        self.client.get('/api/inconnu/')
+        self.assertGreater(self.sample('axa_http_request_duration_seconds_count', view='unmatched', action='',
+                                       method='GET', status='404'), 0)
+
+    def test_slow_requests_are_profiled(self):
+        self.use_temporary_directories('REQUEST_PROFILE_DIR')
+        self.override(REQUEST_PROFILING=True, REQUEST_PROFILE_SAMPLE_RATE=1.0, REQUEST_PROFILE_SLOW_SECONDS=0)
+        profiles = self.sample('axa_slow_request_profiles_total', view='proposal-list')
+        with self.assertLogs('django_api.middleware', 'WARNING'):
+            self.get_json('/api/proposals/')
+        self.assertEqual(self.sample('axa_slow_request_profiles_total', view='proposal-list'), profiles + 1)
+        files = os.listdir(settings.REQUEST_PROFILE_DIR)
+        self.assertTrue(any('proposal-list' in name and name.endswith('.prof') for name in files), files)
+
+
+class AsyncViewTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.use_temporary_directories('DOCUMENT_CACHE_DIR')
+        self.proposals = [create_proposal(f'OPP-{index}', client_name=f'Client {index % 3}') for index in range(5)]
+        self.proposal = self.proposals[0]
+
+    def test_same_responses_as_sync_views(self):
+        for params in ({}, {'ordering': '-ouvrage_cost', 'page_size': 2}, {'client_name': 'Client 1'},
+                       {'fields': 'id,client_name'}):
+            sync = self.get_json('/api/proposals/', params)
+            asynchronous = self.get_json('/api/async/proposals/', params)
+            if isinstance(sync, dict):
+                # Liens de pagination : même curseur, autre URL
+                self.assertEqual(asynchronous['results'], sync['results'])
+                self.assertEqual(asynchronous['next'].split('?')[1], sync['next'].split('?')[1])
+            else:
+                self.assertEqual(asynchronous, sync)
+        self.proposal.client_name = 'Durand'
+        self.proposal.save()
+        detail = f'proposals/{self.proposal.pk}/'
+        self.assertEqual(self.get_json(f'/api/async/{detail}'), self.get_json(f'/api/{detail}'))
+        history = self.get_json(f'/api/{detail}history/', {'page_size': 1})
+        asynchronous = self.get_json(f'/api/async/{detail}history/', {'page_size': 1})
+        self.assertEqual(asynchronous['results'], history['results'])
+
+    def test_errors_use_the_api_format(self):
+        response = self.client.get('/api/async/proposals/999/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(list(response.json()), ['detail'])
+        response = self.client.get('/api/async/proposals/', {'ordering': 'client_name; DROP'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post('/api/async/proposals/').status_code, 405)
+        response = self.client.get(f'/api/async/proposals/{self.proposal.pk}/history/', {'archive': '2026'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        # Flux SSE refusé sous WSGI
+        self.assertEqual(self.client.get('/api/async/proposals/changes/stream/').status_code, 400)
+
+    def test_document(self):
+        url = f'/api/async/proposals/{self.proposal.pk}/document/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, {'doc_type': 'odt'}).status_code, 400)
+
+    def test_full_render_queue_is_refused(self):
+        pool = async_views.RenderPool(workers=1, max_pending=0)
+        pool.pending = 1
+        with mock.patch.object(async_views, 'get_render_pool', return_value=pool):
+            response = self.client.get(f'/api/async/proposals/{self.proposal.pk}/document/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_document_etag(self):
+        url = f'/api/async/proposals/{self.proposal.pk}/document/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag[:-2] + '"').status_code, 200)
+
+    def test_document_job_download(self):
+        job = DocumentJob.objects.create(proposal=self.proposal, doc_type='pdf')
+        url = f'/api/async/document-jobs/{job.pk}/download/'
+        self.assertEqual(self.client.get(url).status_code, 409)
+        DocumentJob.objects.filter(pk=job.pk).update(status=DocumentJob.STATUS_DONE, filename='devis.pdf',
+                                                     file_path=os.path.join(self.temporary_directory(), 'absent.pdf'))
+        self.assertEqual(self.client.get(url).status_code, 410)
+
+    async def test_asgi_streams_documents(self):
+        response = await AsyncClient().get(f'/api/async/proposals/{self.proposal.pk}/document/')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content), int(response['Content-Length']))
+        self.assertTrue(content.startswith(b'%PDF'))
+
+
+class BulkTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.first = create_proposal('OPP-1')
+        self.second = create_proposal('OPP-2')
+
+    def bulk(self, **payload):
+        return self.client.post('/api/proposals/bulk/', payload, format='json')
+
+    def new_item(self, number, **fields):
+        return dict({'opportunity_number': number, 'client_name': 'Nouveau', 'guarantee_type': 'DO',
+                     'work_type': 'NEUF', 'ouvrage_cost': '50000.00', 'do_rate': '0.0200'}, **fields)
+
+    def test_applies_every_operation(self):
+        response = self.bulk(create=[self.new_item('OPP-3')],
+                             update=[{'id': self.first.pk, 'do_rate': '0.0150'}, {'id': self.second.pk, 'client_name': 'Client OPP-2'}])
+        self.assertEqual(response.status_code, 200, response.content)
+        report = response.json()
+        self.assertEqual((report['created'], report['updated'], report['unchanged'], report['failed']), (1, 1, 1, 0))
+        created = Proposal.objects.get(opportunity_number='OPP-3')
+        self.assertEqual(created.prime_seule_tarif_do, Decimal('1000.00'))
+        self.assertEqual(report['results']['create'][0]['id'], created.pk)
+        self.assertEqual(Proposal.objects.get(pk=self.first.pk).prime_seule_tarif_do, Decimal('1500.00'))
+        self.assertEqual(ProposalHistory.objects.filter(proposal=self.first).count(), 2)
+        self.assertEqual(ProposalHistory.objects.filter(proposal=self.second).count(), 1)
+        self.assertEqual(summary_drift(), [])
+
+        response = self.bulk(delete=[self.second.pk], update=[{'id': self.first.pk, 'opportunity_number': 'OPP-2'}])
+        self.assertEqual(response.json()['deleted'], 1)
+        # Numéro libéré par une suppression du même lot
+        self.assertEqual(Proposal.objects.get(pk=self.first.pk).opportunity_number, 'OPP-2')
+        self.assertEqual(summary_drift(), [])
+
+    def test_all_or_nothing(self):
+        response = self.bulk(create=[self.new_item('OPP-3'), self.new_item('OPP-4', guarantee_type='XX')],
+                             update=[{'id': self.first.pk, 'client_name': 'Durand'}],
+                             delete=[self.second.pk])
+        self.assertEqual(response.status_code, 400)
+        report = response.json()
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual([result['status'] for result in report['results']['create']], ['valid', 'error'])
+        self.assertIn('guarantee_type', report['results']['create'][1]['errors'])
+        self.assertEqual(Proposal.objects.count(), 2)
+        self.assertEqual(Proposal.objects.get(pk=self.first.pk).client_name, 'Client OPP-1')
+        self.assertEqual(ProposalHistory.objects.count(), 2)
+
+    def test_item_errors(self):
+        report = self.bulk(
+            create=[self.new_item('OPP-1'), self.new_item('OPP-5'), self.new_item('OPP-5')],
+            update=[{'client_name': 'Sans id'}, {'id': 999}, {'id': self.first.pk}, {'id': self.first.pk}],
+            delete=[999, self.second.pk, self.second.pk],
+        ).json()
+        errors = {kind: [result.get('errors') for result in results] for kind, results in report['results'].items()}
+        self.assertIn('existe déjà', errors['create'][0]['opportunity_number'][0])
+        self.assertIsNone(errors['create'][1])
+        self.assertIn('en double', errors['create'][2]['opportunity_number'][0])
+        self.assertEqual([list(item or {}) for item in errors['update']], [['id'], ['id'], [], ['id']])
+        self.assertEqual([list(item or {}) for item in errors['delete']], [['id'], [], ['id']])
+        self.assertEqual(report['failed'], 7)
+
+    def test_dry_run(self):
+        response = self.bulk(create=[self.new_item('OPP-3')], delete=[self.second.pk], dry_run=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['created'], response.json()['deleted']), (1, 1))
+        self.assertEqual(sorted(Proposal.objects.values_list('opportunity_number', flat=True)), ['OPP-1', 'OPP-2'])
+
+    def test_invalid_batches(self):
+        self.assertEqual(self.bulk().status_code, 400)
+        self.assertEqual(self.bulk(delete=[1] * 1001).status_code, 400)
+        with mock.patch('django_api.batch.write_proposals', side_effect=IntegrityError('UNIQUE constraint failed')):
+            response = self.bulk(create=[self.new_item('OPP-3')])
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Proposal.objects.filter(opportunity_number='OPP-3').exists())
+
+
+class ProjectionTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        create_proposal('OPP-1', ouvrage_description='Long texte ' * 100, address_chantier='Évry')
+        create_proposal('OPP-2', guarantee_type='DUO', trc_rate=Decimal('0.0033'), ouvrage_cost=Decimal('1234.56'))
+        create_proposal('OPP-3', guarantee_type='TRC', do_rate=None, trc_rate=None, ouvrage_destination='')
+
+    def test_same_output_as_the_serializer(self):
+        expected = ProposalSerializer(Proposal.objects.order_by('id'), many=True).data
+        self.assertEqual(self.get_json('/api/proposals/'), json.loads(json.dumps(expected)))
+
+    def test_selected_fields(self):
+        rows = self.get_json('/api/proposals/', {'fields': 'prime_seule_tarif_duo, id,created_at'})
+        # Ordre du sérialiseur, pas celui de la demande
+        self.assertEqual(list(rows[0]), ['id', 'created_at', 'prime_seule_tarif_duo'])
+        self.assertEqual([row['prime_seule_tarif_duo'] for row in rows], ['1000.00', '16.42', '0.00'])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/proposals/', {'fields': 'id,client_name', 'ordering': 'ouvrage_cost'})
+        self.assertNotIn('ouvrage_description', ' '.join(query['sql'] for query in queries))
+
+    def test_pagination_without_the_sort_key(self):
+        params = {'fields': 'opportunity_number', 'ordering': '-ouvrage_cost', 'page_size': 2}
+        page = self.get_json('/api/proposals/', params)
+        # Coûts égaux : départagés par id, dans le sens du tri
+        self.assertEqual(page['results'], [{'opportunity_number': 'OPP-3'}, {'opportunity_number': 'OPP-1'}])
+        page = self.client.get(page['next']).json()
+        self.assertEqual(page['results'], [{'opportunity_number': 'OPP-2'}])
+
+    def test_invalid_fields(self):
+        for value in ('id,mot_de_passe', ' , '):
+            response = self.client.get('/api/proposals/', {'fields': value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('fields', response.json())
+
+
+class ChangeFeedTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.feed = changes.ChangeFeed(size=3)
+        patcher = mock.patch.object(changes, '_feed', self.feed)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cursor = self.read()['cursor']
+
+    def read(self, **params):
+        return self.get_json('/api/proposals/changes/', params)
+
+    def test_writes_are_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            proposal = create_proposal('OPP-1')
+            self.assertEqual(self.read(since=self.cursor)['results'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            proposal.client_name = 'Durand'
+            proposal.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            proposal.delete()
+
+        data = self.read(since=self.cursor)
+        created, updated, deleted = data['results']
+        self.assertEqual([change['type'] for change in data['results']], ['created', 'updated', 'deleted'])
+        self.assertEqual(created['fields']['prime_seule_tarif_do'], '1000.00')
+        self.assertEqual(set(created['fields']), set(ProposalSerializer.Meta.fields))
+        # Champs modifiés seulement, plus la date de modification
+        self.assertEqual(set(updated['fields']), {'client_name', 'updated_at'})
+        self.assertEqual((deleted['id'], deleted['fields']), (created['id'], {}))
+        self.assertEqual(data['cursor'], deleted['cursor'])
+        self.assertEqual(self.read(since=data['cursor'])['results'], [])
+
+    def test_bulk_writes_are_published(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            proposal = create_proposal('OPP-1')
+        cursor = self.read()['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/proposals/bulk/', {'update': [{'id': proposal.pk, 'do_rate': '0.0200'}]}, format='json')
+        (change,) = self.read(since=cursor)['results']
+        self.assertEqual(change['fields']['prime_seule_tarif_do'], '2000.00')
+
+    def test_limit_and_reset(self):
+        for index in range(3):
+            self.feed.publish('updated', index, {})
+        first = self.read(since=self.cursor, limit=2)
+        self.assertEqual([change['id'] for change in first['results']], [0, 1])
+        self.assertEqual([change['id'] for change in self.read(since=first['cursor'])['results']], [2])
+        # Plus de 3 changements de retard, ou curseur d'un autre processus : le client relit la liste
+        self.feed.publish('updated', 3, {})
+        data = self.read(since=self.cursor)
+        self.assertEqual((data['reset'], data['results'], data['cursor']), (True, [], self.feed.cursor(4)))
+        self.assertTrue(self.read(since='autre-2')['reset'])
+
+    def test_invalid_params(self):
+        for params in ({'since': 'abc'}, {'wait': 'long'}, {'limit': '0'}):
+            response = self.client.get('/api/proposals/changes/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_long_polling(self):
+        self.assertEqual(self.read(since=self.cursor, wait='0.05')['results'], [])
+        timer = threading.Timer(0.05, self.feed.publish, args=('updated', 1, {}))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        data = self.read(since=self.cursor, wait='5')
+        self.assertEqual([change['id'] for change in data['results']], [1])
+
+    async def test_async_long_polling(self):
+        threading.Timer(0.05, self.feed.publish, args=('updated', 1, {})).start()
+        data = await changes.aread_changes(self.cursor, 5, 10)
+        self.assertEqual([change['id'] for change in data['results']], [1])
+
+    async def test_server_sent_events(self):
+        self.feed.publish('created', 1, {})
+        with override_settings(CHANGE_FEED_STREAM_SECONDS=0.2, CHANGE_FEED_HEARTBEAT_SECONDS=0.05):
+            response = await AsyncClient().get('/api/async/proposals/changes/stream/',
+                                               headers={'Last-Event-ID': self.cursor})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            messages = ''.join([chunk.decode() async for chunk in response.streaming_content]).split('\n\n')
+        self.assertEqual(messages[0], 'retry: 3000')
+        self.assertEqual(messages[1], f'id: {self.cursor}\nevent: ready\ndata: {{"cursor": "{self.cursor}"}}')
+        self.assertTrue(messages[2].startswith(f'id: {self.feed.cursor(1)}\nevent: created\ndata: {{"cursor"'))
+        self.assertIn(': ping', messages)
+
+
+class SimulationBookTests(ProposalAPITestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(simulation, '_books', type(simulation._books)())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        create_proposal('OPP-1')
+
+    def test_books_of_older_generations_are_released(self):
+        self.assertFalse(simulation.load_book(Proposal.objects.all())[1])
+        self.assertTrue(simulation.load_book(Proposal.objects.all())[1])
+        simulation.load_book(Proposal.objects.filter(guarantee_type='DO'))
+        self.assertEqual(len(simulation._books), 2)
+        response_cache.bump_generation()
+        book, cached = simulation.load_book(Proposal.objects.all())
+        self.assertFalse(cached)
+        self.assertEqual([key[0] for key in simulation._books], [response_cache.current_generation()])
+
+
+class SimulationTests(ProposalAPITestCase):
+    SEGMENTS = [
+        {'work_type': 'RENOVATIONLD', 'existing_presence': True, 'do_rate': '0.0300'},
+        {'guarantee_type': 'DUO', 'trc_rate': '0.0100'},
+        {'guarantee_type': 'DO', 'do_rate': None},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(simulation, '_books', type(simulation._books)())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.proposals = [
+            create_proposal('OPP-1', work_type='RENOVATIONLD', existing_presence=True),
+            create_proposal('OPP-2', guarantee_type='DUO', trc_rate=Decimal('0.0050'), ouvrage_cost=Decimal('1000.00')),
+            create_proposal('OPP-3', ouvrage_cost=Decimal('250000.00')),
+            create_proposal('OPP-4', guarantee_type='TRC', do_rate=None, trc_rate=Decimal('0.0050')),
+        ]
+
+    def simulate(self, segments=None, params=None, **options):
+        url = '/api/proposals/simulate/'
+        if params:
+            url += '?' + '&'.join(f'{name}={value}' for name, value in params.items())
+        response = self.client.post(url, dict(options, segments=segments or self.SEGMENTS), format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def expected_duo(self, proposal, segment):
+        # Taux du segment s'il le fixe (None compris), sinon celui du devis
+        rates = {name: (None if segment[name] is None else Decimal(segment[name])) if name in segment
+                 else getattr(proposal, name) for name in ('do_rate', 'trc_rate')}
+        return round_stored(price_proposal(proposal.guarantee_type, proposal.ouvrage_cost, **rates).duo)
+
+    def test_matches_per_proposal_pricing(self):
+        report = self.simulate()
+        self.assertEqual((report['selected'], report['matched']), (4, 3))
+        # Premier segment correspondant : OPP-1 (DO) prend le premier, pas le troisième
+        assigned = {1: 0, 2: 1, 3: 2}
+        expected = sum(self.expected_duo(self.proposals[index - 1], self.SEGMENTS[segment]) - self.proposals[index - 1].prime_seule_tarif_duo
+                       for index, segment in assigned.items())
+        self.assertEqual(Decimal(report['total_duo_delta']), expected)
+        self.assertEqual([segment['matched'] for segment in report['segments']], [1, 1, 1])
+        self.assertEqual(report['segments'][2]['do_rate'], None)
+        self.assertEqual([change['opportunity_number'] for change in report['top_changes']], ['OPP-3', 'OPP-1', 'OPP-2'])
+        self.assertEqual(report['top_changes'][0]['delta'], '-2500.00')
+        self.assertEqual(report['top_changes'][0]['new_do_rate'], None)
+        self.assertEqual(set(report['delta_percentiles']), {'p1', 'p5', 'p25', 'p50', 'p75', 'p95', 'p99'})
+        # Rien n'est enregistré
+        self.assertEqual(Proposal.objects.get(opportunity_number='OPP-3').prime_seule_tarif_duo, Decimal('2500.00'))
+
+    def test_filters_and_top(self):
+        report = self.simulate(params={'guarantee_type': 'DO'}, top=1)
+        self.assertEqual((report['selected'], report['matched'], report['changed']), (2, 2, 2))
+        self.assertEqual([change['opportunity_number'] for change in report['top_changes']], ['OPP-3'])
+
+    def test_book_is_reused_until_a_write(self):
+        self.assertFalse(self.simulate()['book_cached'])
+        self.assertTrue(self.simulate()['book_cached'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.proposals[2].ouvrage_cost = Decimal('100000.00')
+            self.proposals[2].save()
+        report = self.simulate()
+        self.assertFalse(report['book_cached'])
+        deltas = {change['opportunity_number']: change['delta'] for change in report['top_changes']}
+        self.assertEqual(deltas['OPP-3'], '-1000.00')
+
+    def test_invalid_grids(self):
+        for payload in ({'segments': []}, {'segments': [{'guarantee_type': 'DO'}]},
+                        {'segments': [{'do_rate': '0.00001'}]}, {'segments': [{'work_type': 'XX', 'do_rate': '0.01'}]}):
+            response = self.client.post('/api/proposals/simulate/', payload, format='json')
+            self.assertEqual(response.status_code, 400, payload)
@@ -1,10 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProposalViewSet 
+from . import async_views
+from .views import DocumentJobViewSet, ProposalViewSet, address_search, audit_status
 
 router = DefaultRouter()
 router.register(r'proposals', ProposalViewSet) 
+router.register(r'document-jobs', DocumentJobViewSet)
 
 urlpatterns = [
+    path('audit/status/', audit_status, name='audit-status'),
+    path('addresses/search/', address_search, name='address-search'),
+    # Lectures et téléchargements servis par les vues asynchrones (cf. async_views.py)
+    path('async/proposals/', async_views.proposal_list, name='async-proposal-list'),
+    path('async/proposals/changes/', async_views.proposal_changes, name='async-proposal-changes'),
+    path('async/proposals/changes/stream/', async_views.proposal_change_stream, name='async-proposal-change-stream'),
+    path('async/proposals/<int:pk>/', async_views.proposal_detail, name='async-proposal-detail'),
+    path('async/proposals/<int:pk>/history/', async_views.proposal_history, name='async-proposal-history'),
+    path('async/proposals/<int:pk>/document/', async_views.proposal_document, name='async-proposal-document'),
+    path('async/document-jobs/<uuid:pk>/download/', async_views.document_job_download, name='async-document-job-download'),
     path('', include(router.urls)),
 ]
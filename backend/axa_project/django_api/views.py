@@ -1,36 +1,58 @@
-from django.shortcuts import render
-from rest_framework import viewsets, status
-from rest_framework.decorators import action
+import csv
+import logging
+import os
+import tempfile
+
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.db import IntegrityError
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Proposal, ProposalHistory
-from .serializers import ProposalSerializer, ProposalHistorySerializer
-from docx import Document as DocxDocument
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
-from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
-
-from reportlab.pdfgen import canvas
-from io import BytesIO
-import os
-from django.conf import settings
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch, cm
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from .models import DocumentJob, Proposal, ProposalHistory, ProposalSummary
+from .serializers import DocumentJobSerializer, ProposalBatchSerializer, ProposalImportSerializer, ProposalSerializer, ProposalHistorySerializer, RateSimulationSerializer, RepriceSerializer
+from .filters import ProposalFilterBackend, filter_proposals
+from .pagination import HistoryCursorPagination, ProposalCursorPagination
+from .repricing import RATE_FIELDS, reprice_proposals
+from .simulation import simulate_rates
+from .documents import DOCUMENT_FORMATS, document_filename
+from .document_cache import document_etag, not_modified_response, open_document
+from .document_export import bundle_filename, merged_pdf_file, stream_zip
+from .jobs import submit_document_job
+from .imports import ImportFormatError, import_proposals, open_csv
+from .batch import apply_batch
+from .exports import EXPORT_FORMATS, PROPOSAL_EXPORT_FIELDS, export_filename, history_rows, iter_export, proposal_rows, write_export
+from .as_of import parse_as_of, proposal_as_of
+from .audit import audit_stats
+from .retention import archived_entries
+from .response_cache import cached_response, normalized_params
+from .db_router import read_database
+from .search import match_expression, parse_limit, search_proposals
+from .projection import parse_fields, project_rows, proposal_values
+from .analytics import filter_summaries, portfolio_analytics
+from .changes import feed_params, read_changes
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from .addresses import DEFAULT_ADDRESS_LIMIT, MAX_ADDRESS_LIMIT, get_address_index, parse_coordinate
 
 from datetime import datetime
+from functools import partial
+from django.utils import timezone
 
-def HEXtoRGB(hex_color):
-    hex_color = hex_color.lstrip('#')
-    return RGBColor(int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16))
+logger = logging.getLogger(__name__)
 
 class ProposalViewSet(viewsets.ModelViewSet):
     queryset = Proposal.objects.all()
     serializer_class = ProposalSerializer
+    filter_backends = [ProposalFilterBackend]
+    pagination_class = ProposalCursorPagination
+    # Lectures lourdes servies par la connexion en lecture seule
+    read_only_actions = ('list', 'search', 'export', 'export_history', 'export_documents')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.read_only_actions:
+            queryset = queryset.using(read_database())
+        return queryset
 
     def perform_create(self, serializer):
         user_ip = self.request.META.get('REMOTE_ADDR')
@@ -40,345 +62,283 @@ class ProposalViewSet(viewsets.ModelViewSet):
         user_ip = self.request.META.get('REMOTE_ADDR')
         serializer.save(user_ip=user_ip)
 
+    def cached(self, request, view, *args, **kwargs):
+        # Seul le rendu JSON est mis en cache (pas l'API navigable)
+        build = partial(view, request, *args, **kwargs)
+        if request.accepted_renderer.format != 'json':
+            return build()
+        parts = (self.action, kwargs.get('pk'), normalized_params(request.query_params))
+        return cached_response(request, parts, build)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, self.list_rows)
+
+    def list_rows(self, request):
+        # Lecture rapide (cf. projection.py) : dictionnaires tirés de .values(), ?fields=... pour n'en garder que certains
+        fields = parse_fields(request.query_params.get('fields'))
+        queryset = self.filter_queryset(self.get_queryset())
+        field, _ = self.paginator.get_ordering(request)
+        page = self.paginate_queryset(proposal_values(queryset, fields, extra=('id', field)))
+        if page is None:
+            return Response(project_rows(proposal_values(queryset, fields), fields))
+        return self.get_paginated_response(project_rows(page, fields))
+
+    def retrieve(self, request, *args, **kwargs):
+        # ?as_of=AAAA-MM-JJ[THH:MM] : le devis tel qu'il était à cette date, reconstruit depuis l'historique
+        as_of = parse_as_of(request.query_params.get('as_of'))
+        if as_of is None:
+            return self.cached(request, super().retrieve, *args, **kwargs)
+        proposal = proposal_as_of(self.get_object(), as_of)
+        if proposal is None:
+            return Response({'error': "Le devis n'existait pas à cette date."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(proposal).data)
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        # ?q=... : recherche plein texte classée par pertinence, combinable avec les filtres de la liste
+        query = request.query_params.get('q', '')
+        if not match_expression(query):
+            return Response({'error': 'Aucun mot à rechercher.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = parse_limit(request.query_params.get('limit'))
+        proposals = search_proposals(filter_proposals(self.get_queryset(), request.query_params), query, limit)
+        return Response(self.get_serializer(proposals, many=True).data)
+
+    @action(detail=False, methods=['get'], url_path='analytics')
+    def analytics(self, request):
+        # Totaux du portefeuille lus dans les tables de synthèse (cf. analytics.py), jamais dans les devis
+        summaries = filter_summaries(ProposalSummary.objects.using(read_database()), request.query_params)
+        return Response(portfolio_analytics(summaries))
+
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        # Flux des modifications (cf. changes.py) : ?since=<curseur>&wait=<secondes> ; sous ASGI, préférer /api/async/
+        since, wait, limit = feed_params(request.query_params)
+        return Response(read_changes(since, wait, limit))
+
     @action(detail=True, methods=['post'], url_path='generate-document')
     def generate_document(self, request, pk=None):
         proposal = self.get_object()
         doc_type = request.data.get('doc_type', 'pdf')
+        if doc_type not in DOCUMENT_FORMATS:
+            return Response({'error': 'Type de document non supporté.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        current_time = datetime.now().strftime("%d%m%Y_%H%M")
-        date_generation = datetime.now().strftime("%d/%m/%Y")
-        filename_base = f"Proposition_commerciale_{proposal.opportunity_number}_{current_time}"
+        content_type, _, label = DOCUMENT_FORMATS[doc_type]
+        generated_at = datetime.now()
+        as_of = parse_as_of(request.data.get('as_of') or request.query_params.get('as_of'))
+        if as_of is not None:
+            # Réédition : le devis et la date de simulation tels qu'ils étaient à `as_of`
+            proposal = proposal_as_of(proposal, as_of)
+            if proposal is None:
+                return Response({'error': "Le devis n'existait pas à cette date."}, status=status.HTTP_404_NOT_FOUND)
+            generated_at = timezone.localtime(as_of).replace(tzinfo=None)
+        etag = document_etag(proposal, doc_type, generated_at)
+        not_modified = not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            document, _ = open_document(proposal, doc_type, generated_at)
+        except Exception as e:
+            logger.exception("Échec de la génération du document", extra={'proposal_id': proposal.pk, 'doc_type': doc_type})
+            return Response({'error': f"Erreur lors de la génération {label}: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Document servi depuis le cache disque : FileResponse renseigne Content-Length
+        response = FileResponse(document, content_type=content_type)
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{document_filename(proposal, doc_type, generated_at)}"'
+        return response
+    
+    @action(detail=False, methods=['get'], url_path='export-documents')
+    def export_documents(self, request):
+        # Mêmes filtres et même tri que la liste ; bundle=zip (un fichier par devis) ou bundle=pdf (PDF fusionné)
+        doc_type = request.query_params.get('doc_type', 'pdf')
+        bundle = request.query_params.get('bundle', 'zip')
+        if doc_type not in DOCUMENT_FORMATS:
+            return Response({'error': 'Type de document non supporté.'}, status=status.HTTP_400_BAD_REQUEST)
+        if bundle not in ('zip', 'pdf') or (bundle == 'pdf' and doc_type != 'pdf'):
+            return Response({'error': "Format d'export non supporté."}, status=status.HTTP_400_BAD_REQUEST)
 
-        cost = proposal.ouvrage_cost if proposal.ouvrage_cost is not None else 0
-        logo_path = os.path.join(settings.BASE_DIR, 'static', 'logo.png') 
-        print(f"Corrected Logo path: {logo_path}")
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.exists():
+            return Response({'error': 'Aucun devis ne correspond aux filtres.'}, status=status.HTTP_404_NOT_FOUND)
 
-        if doc_type == 'pdf':
+        generated_at = datetime.now()
+        if bundle == 'pdf':
             try:
-                pdf_buffer = BytesIO()
-                doc_pdf = SimpleDocTemplate(pdf_buffer, pagesize=A4,
-                                            rightMargin=0.75*inch, leftMargin=0.75*inch,
-                                            topMargin=0.5*inch, bottomMargin=0.25*inch)
-                styles = getSampleStyleSheet()
-                story = []
-                style_body = ParagraphStyle('BodyText', parent=styles['Normal'], fontSize=11, leading=12, spaceBefore=5, spaceAfter=5)
-                style_body_blue = ParagraphStyle('BodyBlueText', parent=style_body, textColor="#00008f")
-                style_main_title = ParagraphStyle('MainTitle', parent=styles['h1'], fontSize=11, leading=18, spaceBefore=6, spaceAfter=5, textColor="#00008f")
-                style_section_title = ParagraphStyle('SectionTitle', parent=styles['h2'], fontSize=11, leading=13, fontName='Helvetica-Bold', spaceBefore=10, spaceAfter=10)
-                style_table_text = ParagraphStyle('TableText', parent=styles['Normal'], fontSize=9, leading=11)
-                style_table_cell_text = ParagraphStyle('TableCellText', parent=style_table_text, alignment=TA_RIGHT)
-                style_footnote = ParagraphStyle('Footnote', parent=styles['Normal'], fontSize=10, leading=10, spaceBefore=6)
-                style_footnote_indented = ParagraphStyle('FootnoteIndented', parent=style_footnote, leftIndent=0.27*inch)
-                style_body_html = ParagraphStyle('BodyTextHTML', parent=style_table_text, allowHTMLEscapes=1)
-
-                if logo_path and os.path.exists(logo_path):
-                    logo_img = Image(logo_path, width=0.75*inch, height=0.75*inch)
-                    logo_img.hAlign = 'CENTER'
-                    story.append(logo_img)
-                else:
-                    print(f"Logo PDF non trouvé ou chemin non défini.")
-                
-                story.append(Spacer(1, 0.1*inch))
-                story.append(Paragraph("TARIFICATION INDICATIVE", style_main_title))
-                story.append(Paragraph("Produit chantier", style_body_blue))
-                story.append(Paragraph("Tarification indicative (*) sur la base d'un risque conforme aux paramètres suivants :", style_body))
-
-                params_data = [
-                    (f"Type d'ouvrage:", proposal.get_ouvrage_destination_display() if proposal.ouvrage_destination else "Non Applicable"),
-                    (f"Types de travaux réalisés:", proposal.get_work_type_display() if proposal.work_type else "rénovation légère, rénovation lourde, construction neuve"),
-                    (f"Coût du chantier:", f"{cost:.2f} €" if proposal.ouvrage_cost is not None else "xxxxxxx €"),
-                    (f"Présence d'existant:", "Oui" if proposal.existing_presence else "Non"),
-                    (f"Garantie choisie:", proposal.get_guarantee_type_display() if proposal.guarantee_type else "Non renseigné"),
-                    (f"Description de l'ouvrage :", proposal.ouvrage_description if proposal.ouvrage_description else "Non renseignée"),
-                    (f"Adresse du chantier:", proposal.address_chantier if proposal.address_chantier else "Non renseignée")
-                ]
-                for key, value in params_data:
-                    p_text = f"{key} {value}" 
-                    story.append(Paragraph(p_text, style_body)) 
-
-                story.append(Paragraph("<u>Garanties Tous Risques chantier</u>", style_body_html)) 
-                story.append(Paragraph("MONTANTS DE GARANTIES (exprimés en €)", style_section_title))
-                data_trc = [
-                    [Paragraph("Dommages matériels à l'ouvrage<br/>(Ce montant est épuisable pendant la durée des travaux)", style_body_html), Paragraph("XXXXXXXX", style_table_cell_text)],
-                    [Paragraph("Responsabilité civile (tous dommages confondus)<br/>(Ces montants sont épuisables pendant la durée des travaux)", style_body_html), Paragraph("XXXXXXXXX", style_table_cell_text)],
-                    [Paragraph("Maintenance-visite<br/>(Ce montant est compris dans le montant de la garantie des dommages matériels à l'ouvrage)", style_body_html), Paragraph("XXXXXXXXXXX", style_table_cell_text)],
-                    [Paragraph("Mesure conservatoire", style_table_text), Paragraph("XXXXXXXXXXXX", style_table_cell_text)]
-                ]
-                table_trc = Table(data_trc)
-                table_trc.setStyle(TableStyle([
-                    ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                    ('GRID', (0,0), (-1,-1), 0.75, colors.black),
-                    ('LEFTPADDING', (0,0), (-1,-1), 5),
-                    ('RIGHTPADDING', (0,0), (-1,-1), 5),
-                    ('TOPPADDING', (0,0), (-1,-1), 3),
-                    ('BOTTOMPADDING', (0,0), (-1,-1), 3),
-                ]))
-                story.append(table_trc)
-
-                story.append(Paragraph("MONTANTS DE FRANCHISES (par sinistre exprimés en €)", style_section_title))
-                data_franchises = [
-                    [Paragraph("Dommages subis par les ouvrages de bâtiment", style_table_text), Paragraph("XXXXXXXXXXX", style_table_cell_text)],
-                    [Paragraph("Catastrophes naturelles", style_table_text), Paragraph("Montant déterminé par la loi ou par ses textes d'application", style_table_cell_text)],
-                    [Paragraph("Responsabilité civile (1)", style_body_html), ""],
-                    [Paragraph("- Assuré maître d'ouvrage", style_table_text), Paragraph("XXXXXXXXXXX", style_table_cell_text)],
-                    [Paragraph("- Assurés intervenants", style_table_text), Paragraph("SANS", style_table_cell_text)],
-                    [Paragraph("Maintenance-visite", style_table_text), Paragraph("XXXXXXXXXXX", style_table_cell_text)]
-                ]
-                table_franchises = Table(data_franchises)
-                table_franchises.setStyle(TableStyle([
-                    ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                    ('GRID', (0,0), (-1,-1), 0.75, colors.black),
-                    ('LEFTPADDING', (0,0), (-1,-1), 5),
-                    ('RIGHTPADDING', (0,0), (-1,-1), 5),
-                    ('TOPPADDING', (0,0), (-1,-1), 3),
-                    ('BOTTOMPADDING', (0,0), (-1,-1), 3),
-                    ('SPAN', (1,2), (1,2)),
-                    ('LEFTPADDING', (0,3), (0,4), 20),
-                ]))
-                story.append(table_franchises)
-                story.append(Paragraph("(1) Ces franchises s'appliquent pour des dommages autres que corporels", style_footnote_indented))
-                story.append(Spacer(1, 0.2*inch))
-                story.append(Paragraph(f"Date de simulation de tarif: le {date_generation}", style_body))
-                story.append(Paragraph("(*) Cette tarification est faite sous réserve d'acceptation du risque par la compagnie", style_footnote))
-
-                doc_pdf.build(story)
-                pdf_value = pdf_buffer.getvalue()
-                pdf_buffer.close()
-                response = HttpResponse(pdf_value, content_type='application/pdf')
-                response['Content-Disposition'] = f'attachment; filename="{filename_base}.pdf"'
-                return response
+                document = merged_pdf_file(queryset, generated_at)
             except Exception as e:
+                logger.exception("Échec de la génération du PDF fusionné")
                 return Response({'error': f"Erreur lors de la génération du PDF: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        elif doc_type == 'word':
-            try:
-                word_buffer = BytesIO()
-                doc_word = DocxDocument()
-
-                sections = doc_word.sections
-                for section in sections:
-                    section.top_margin = Inches(0.5)
-                    section.bottom_margin = Inches(0.25)
-                    section.left_margin = Inches(0.75)
-                    section.right_margin = Inches(0.75)
-
-                # Fonctions d'aide pour formater le texte et les paragraphes
-                def set_run_font(run, name='Calibri', size_pt=11, bold=False, italic=False, color_rgb=None, underline=False):
-                    font = run.font
-                    font.name = name
-                    font.size = Pt(size_pt)
-                    font.bold = bold
-                    font.italic = italic
-                    if color_rgb:
-                        font.color.rgb = color_rgb
-                    font.underline = underline
-
-                def set_paragraph_format(paragraph, alignment=None, space_before_pt=None, space_after_pt=None, 
-                                         line_spacing_rule=None, line_spacing_value=None, left_indent_inches=None, keep_with_next=False):
-                    p_fmt = paragraph.paragraph_format
-                    if alignment:
-                        p_fmt.alignment = alignment
-                    if space_before_pt:
-                        p_fmt.space_before = Pt(space_before_pt)
-                    if space_after_pt:
-                        p_fmt.space_after = Pt(space_after_pt)
-                    if line_spacing_rule: 
-                        p_fmt.line_spacing_rule = line_spacing_rule
-                    if line_spacing_value:
-                        p_fmt.line_spacing = line_spacing_value
-                    if left_indent_inches:
-                        p_fmt.left_indent = Inches(left_indent_inches)
-                    if keep_with_next:
-                        p_fmt.keep_with_next = True
-                
-                style_normal_word = doc_word.styles['Normal']
-                font_normal = style_normal_word.font
-                font_normal.name = 'Calibri'
-                font_normal.size = Pt(11)
-                p_fmt_normal = style_normal_word.paragraph_format
-                p_fmt_normal.space_before = Pt(5)
-                p_fmt_normal.space_after = Pt(5)
-                p_fmt_normal.line_spacing_rule = None
-                p_fmt_normal.line_spacing = 1
-
-                if logo_path and os.path.exists(logo_path):
-                    p_logo = doc_word.add_paragraph()
-                    set_paragraph_format(p_logo, alignment=WD_ALIGN_PARAGRAPH.CENTER, space_before_pt=0, space_after_pt=0)
-                    run_logo = p_logo.add_run()
-                    run_logo.add_picture(logo_path, width=Inches(0.75))
-                else:
-                    print(f"Logo Word non trouvé ou chemin non défini.")
-
-
-                p_main_title = doc_word.add_paragraph()
-                set_paragraph_format(p_main_title, alignment=WD_ALIGN_PARAGRAPH.LEFT, 
-                                     space_before_pt=6, space_after_pt=5, 
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
-                run_main_title = p_main_title.add_run("TARIFICATION INDICATIVE")
-                set_run_font(run_main_title, name='Calibri', size_pt=13, bold=False, color_rgb=HEXtoRGB("#00008f"))
-
-
-                p_subtitle = doc_word.add_paragraph()
-                set_paragraph_format(p_subtitle, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                                     space_before_pt=5, space_after_pt=5, 
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
-                run_subtitle = p_subtitle.add_run("Produit chantier")
-                set_run_font(run_subtitle, name='Calibri', size_pt=11, color_rgb=HEXtoRGB("#00008f"))
-
-                p_intro = doc_word.add_paragraph()
-                set_paragraph_format(p_intro, space_before_pt=5, space_after_pt=5, 
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
-                run_intro = p_intro.add_run("Tarification indicative (*) sur la base d'un risque conforme aux paramètres suivants :")
-                set_run_font(run_intro, name='Calibri', size_pt=11)
-
-                params_data_word = [
-                    ("Type d'ouvrage:", proposal.get_ouvrage_destination_display() if proposal.ouvrage_destination else "Non Applicable"),
-                    ("Types de travaux réalisés:", proposal.get_work_type_display() if proposal.work_type else "rénovation légère, rénovation lourde, construction neuve"),
-                    ("Coût du chantier:", f"{cost:.2f} €" if proposal.ouvrage_cost is not None else "xxxxxxx €"),
-                    ("Présence d'existant:", "Oui" if proposal.existing_presence else "Non"),
-                    ("Garantie choisie:", proposal.get_guarantee_type_display() if proposal.guarantee_type else "DO/TRC/ DO + TRC"),
-                    ("Description de l'ouvrage :", proposal.ouvrage_description if proposal.ouvrage_description else "Non renseignée"),
-                    ("Adresse du chantier:", proposal.address_chantier if proposal.address_chantier else "Non renseignée")
-                ]
-                for key, value in params_data_word:
-                    p_param = doc_word.add_paragraph()
-                    set_paragraph_format(p_param, space_before_pt=5, space_after_pt=5, 
-                                         line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
-                    run_param_key = p_param.add_run(key + " ") 
-                    set_run_font(run_param_key, name='Calibri', size_pt=11)
-                    run_param_value = p_param.add_run(value)
-                    set_run_font(run_param_value, name='Calibri', size_pt=11)
-
-                p_garanties_text = doc_word.add_paragraph()
-                set_paragraph_format(p_garanties_text, space_before_pt=5, space_after_pt=5, 
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1.22) 
-                run_garanties_text = p_garanties_text.add_run("Garanties Tous Risques chantier")
-                set_run_font(run_garanties_text, name='Calibri', size_pt=9, underline=True)
-                
-                p_montants_title = doc_word.add_paragraph()
-                set_paragraph_format(p_montants_title, space_before_pt=10, space_after_pt=10,
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1.18) 
-                run_montants_title = p_montants_title.add_run("MONTANTS DE GARANTIES (exprimés en €)")
-                set_run_font(run_montants_title, name='Calibri', size_pt=11, bold=True)
-
-                # Helper pour formater les cellules de tableau
-                def format_table_cell(cell, text, font_name='Calibri', size_pt=9, bold=False, 
-                                      alignment=None, left_indent_inches=None, is_html_like=False,
-                                      cell_v_align=WD_CELL_VERTICAL_ALIGNMENT.TOP):
-                    cell.vertical_alignment = cell_v_align
-                    if cell.paragraphs and not cell.paragraphs[0].text.strip():
-                         p = cell.paragraphs[0]
-                         p.clear()
-                         set_paragraph_format(p, space_before_pt=0, space_after_pt=0, line_spacing_rule=WD_LINE_SPACING.SINGLE)
-
-                    else:
-                        p = cell.add_paragraph()
-                        set_paragraph_format(p, space_before_pt=0, space_after_pt=0, line_spacing_rule=WD_LINE_SPACING.SINGLE)
-
-
-                    if alignment:
-                        p.alignment = alignment
-                    if left_indent_inches:
-                        p.paragraph_format.left_indent = Inches(left_indent_inches)
-                    
-                    
-                    lines = text.split('<br/>') if is_html_like and isinstance(text, str) else [text]
-                    for i, line_text in enumerate(lines):
-                        run = p.add_run(line_text)
-                        set_run_font(run, name=font_name, size_pt=size_pt, bold=bold)
-                        if i < len(lines) - 1:
-                            run.add_break() 
-
-                table_data_trc_word = [
-                    ("Dommages matériels à l'ouvrage (Ce montant est épuisable pendant la durée des travaux)", "XXXXXXXX"),
-                    ("Responsabilité civile (tous dommages confondus)<br/>(Ces montants sont épuisables pendant la durée des travaux)", "XXXXXXXXX"),
-                    ("Maintenance-visite (Ce montant est compris dans le montant de la garantie des dommages matériels à l'ouvrage)", "XXXXXXXXXXX"),
-                    ("Mesure conservatoire", "XXXXXXXXXXXX")
-                ]
-                table_trc_word = doc_word.add_table(rows=len(table_data_trc_word), cols=2)
-                table_trc_word.style = 'TableGrid' 
-                table_trc_word.autofit = True
-
-
-                for i, (item, value) in enumerate(table_data_trc_word):
-                    cell1 = table_trc_word.cell(i, 0)
-                    format_table_cell(cell1, item, size_pt=9, is_html_like=True)
-                    
-                    cell2 = table_trc_word.cell(i, 1)
-                    format_table_cell(cell2, value, size_pt=9, alignment=WD_ALIGN_PARAGRAPH.RIGHT)
-
-                p_franch_title = doc_word.add_paragraph()
-                set_paragraph_format(p_franch_title, space_before_pt=10, space_after_pt=10,
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1.18)
-                run_franch_title = p_franch_title.add_run("MONTANTS DE FRANCHISES (par sinistre exprimés en €)")
-                set_run_font(run_franch_title, name='Calibri', size_pt=11, bold=True)
-
-                table_data_franchises_word = [
-                    ("Dommages subis par les ouvrages de bâtiment", "XXXXXXXXXXX"), 
-                    ("Catastrophes naturelles", "Montant déterminé par la loi ou par ses textes d'application"),
-                    ("Responsabilité civile (1)", ""), 
-                    ("- Assuré maître d'ouvrage", "XXXXXXXXXXX"),
-                    ("- Assurés intervenants", "SANS"),
-                    ("Maintenance-visite", "XXXXXXXXXXX")
-                ]
-
-                table_franchises_doc = doc_word.add_table(rows=len(table_data_franchises_word), cols=2)
-                table_franchises_doc.style = 'TableGrid'
-                table_franchises_doc.autofit = True
-
-                for i, (item, value) in enumerate(table_data_franchises_word):
-                    cell1 = table_franchises_doc.cell(i, 0)
-                    cell2 = table_franchises_doc.cell(i, 1)
-                    
-                    indent = 0
-                    if item.startswith("- "): 
-                        indent = 0.27
-
-                    format_table_cell(cell1, item, size_pt=9, left_indent_inches=indent)
-                    
-                    if item == "Responsabilité civile (1)":
-                        cell1.merge(cell2) 
-                    else:
-                        format_table_cell(cell2, value, size_pt=9, alignment=WD_ALIGN_PARAGRAPH.RIGHT)
-
-                p_footnote = doc_word.add_paragraph()
-                set_paragraph_format(p_footnote, space_before_pt=6, space_after_pt=0, 
-                                     line_spacing_rule=WD_LINE_SPACING.SINGLE) 
-                run_footnote = p_footnote.add_run("     (1) Ces franchises s'appliquent pour des dommages autres que corporels")
-                set_run_font(run_footnote, name='Calibri', size_pt=10)
-
-
-                p_spacer_after_footnote = doc_word.add_paragraph()
-                set_paragraph_format(p_spacer_after_footnote, space_before_pt=0, space_after_pt=1)
-
-                p_date = doc_word.add_paragraph()
-                set_paragraph_format(p_date, space_before_pt=5, space_after_pt=5,
-                                     line_spacing_rule=WD_LINE_SPACING.MULTIPLE, line_spacing_value=1)
-                run_date = p_date.add_run(f"Date de simulation de tarif: le {date_generation}")
-                set_run_font(run_date, name='Calibri', size_pt=11)
-
-                p_reserve = doc_word.add_paragraph()
-                set_paragraph_format(p_reserve, space_before_pt=6, space_after_pt=1,
-                                     line_spacing_rule=WD_LINE_SPACING.SINGLE)
-                run_reserve = p_reserve.add_run("(*) Cette tarification est faite sous réserve d'acceptation du risque par la compagnie")
-                set_run_font(run_reserve, name='Calibri', size_pt=10)
-
-                doc_word.save(word_buffer)
-                word_value = word_buffer.getvalue()
-                word_buffer.close()
-                response = HttpResponse(word_value, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-                response['Content-Disposition'] = f'attachment; filename="{filename_base}.docx"'
-                return response
-            except Exception as e:
-                return Response({'error': f"Erreur lors de la génération du document Word: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
+            response = FileResponse(document, content_type=DOCUMENT_FORMATS['pdf'][0])
         else:
+            response = StreamingHttpResponse(stream_zip(queryset, doc_type, generated_at), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{bundle_filename(bundle, generated_at)}"'
+        return response
+
+    @action(detail=True, methods=['post'], url_path='document-jobs')
+    def create_document_job(self, request, pk=None):
+        # Variante asynchrone de generate-document : renvoie tout de suite l'id du job
+        proposal = self.get_object()
+        doc_type = request.data.get('doc_type', 'pdf')
+        if doc_type not in DOCUMENT_FORMATS:
             return Response({'error': 'Type de document non supporté.'}, status=status.HTTP_400_BAD_REQUEST)
-    
+
+        job = submit_document_job(proposal, doc_type)
+        serializer = DocumentJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': serializer.data['status_url']})
+
     @action(detail=True, methods=['get'], url_path='history')
     def history(self, request, pk=None):
         proposal = get_object_or_404(Proposal, pk=pk)
-        history_entries = ProposalHistory.objects.filter(proposal=proposal).order_by('-timestamp')
+        archive = request.query_params.get('archive')
+        if archive:
+            # ?archive=AAAA-MM : entrées du mois lues dans le fichier d'archive (une par jour au plus)
+            try:
+                month = datetime.strptime(archive, '%Y-%m').date()
+            except ValueError:
+                return Response({'error': "Mois d'archive invalide (format AAAA-MM)."}, status=status.HTTP_400_BAD_REQUEST)
+            serializer = ProposalHistorySerializer(archived_entries(proposal, month), many=True)
+            return Response({'next': None, 'results': serializer.data})
+
+        paginator = HistoryCursorPagination()
+        history_entries = paginator.paginate_queryset(
+            ProposalHistory.objects.filter(proposal=proposal).order_by('-timestamp', '-id'), request, view=self
+        )
+        for entry in history_entries:
+            # Toutes les entrées portent sur le devis déjà chargé : aucune requête par ligne
+            entry.proposal = proposal
         serializer = ProposalHistorySerializer(history_entries, many=True)
-        return Response(serializer.data)
-
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='reprice')
+    def reprice(self, request):
+        # Les devis visés sont sélectionnés avec les mêmes filtres (query string) que la liste
+        serializer = RepriceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        rates = {field: options[field] for field in RATE_FIELDS if field in options}
+        report = reprice_proposals(
+            self.filter_queryset(self.get_queryset()),
+            rates=rates,
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+            user_ip=request.META.get('REMOTE_ADDR'),
+        )
+        return Response(report)
+
+    @action(detail=False, methods=['post'], url_path='simulate')
+    def simulate(self, request):
+        # Grille de taux par segment appliquée en mémoire aux devis filtrés (query string) : rien n'est enregistré
+        serializer = RateSimulationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        queryset = self.filter_queryset(self.get_queryset()).using(read_database())
+        return Response(simulate_rates(queryset, options['segments'], top=options['top']))
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        # {"create": [...], "update": [{"id": ..., ...}], "delete": [id, ...], "dry_run": false} : tout ou rien
+        serializer = ProposalBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        try:
+            report = apply_batch(
+                creates=options['create'],
+                updates=options['update'],
+                deletes=options['delete'],
+                dry_run=options['dry_run'],
+                user_ip=request.META.get('REMOTE_ADDR'),
+            )
+        except IntegrityError as e:
+            # Devis créé ou renuméroté entre-temps par une autre requête
+            return Response({'error': f"Lot rejeté : {str(e)}"}, status=status.HTTP_409_CONFLICT)
+        return Response(report, status=status.HTTP_400_BAD_REQUEST if report['failed'] else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_csv(self, request):
+        # Fichier CSV envoyé en multipart (champ 'file') ; rapport ligne à ligne des erreurs
+        serializer = ProposalImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        try:
+            report = import_proposals(
+                open_csv(options['file'].file),
+                chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'],
+                user_ip=request.META.get('REMOTE_ADDR'),
+            )
+        except (ImportFormatError, UnicodeDecodeError, csv.Error) as e:
+            return Response({'error': f"Fichier CSV invalide : {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+    def export_response(self, header, rows, prefix, title):
+        file_format = self.request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response({'error': "Format d'export non supporté."}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = EXPORT_FORMATS[file_format][0]
+        if file_format == 'xlsx':
+            # Le format XLSX est une archive ZIP : il est écrit sur disque avant d'être envoyé
+            output = tempfile.TemporaryFile()
+            try:
+                write_export(header, rows, file_format, output, title=title)
+            except Exception:
+                output.close()
+                raise
+            output.seek(0)
+            response = FileResponse(output, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(iter_export(header, rows, file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(prefix, file_format)}"'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        # file_format=csv|xlsx|jsonl ; mêmes filtres et même tri que la liste, ?fields=... pour choisir les colonnes
+        fields = parse_fields(request.query_params.get('fields'), PROPOSAL_EXPORT_FIELDS)
+        header, rows = proposal_rows(self.filter_queryset(self.get_queryset()), fields)
+        return self.export_response(header, rows, 'Devis', 'Devis')
+
+    @action(detail=False, methods=['get'], url_path='export-history')
+    def export_history(self, request):
+        header, rows = history_rows(self.filter_queryset(self.get_queryset()))
+        return self.export_response(header, rows, 'Historique_devis', 'Historique')
+
+
+class DocumentJobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = DocumentJob.objects.all()
+    serializer_class = DocumentJobSerializer
+
+    @action(detail=True, methods=['get'], url_path='download')
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != DocumentJob.STATUS_DONE:
+            return Response({'error': "Le document n'est pas encore disponible.", 'status': job.status}, status=status.HTTP_409_CONFLICT)
+        if not os.path.exists(job.file_path):
+            return Response({'error': "Le document généré n'existe plus."}, status=status.HTTP_410_GONE)
+        content_type = DOCUMENT_FORMATS[job.doc_type][0]
+        return FileResponse(open(job.file_path, 'rb'), as_attachment=True, filename=job.filename, content_type=content_type)
+
+
+@api_view(['GET'])
+def audit_status(request):
+    # Profondeur de la file d'écriture différée de l'historique et compteurs du writer
+    return Response(audit_stats())
+
+
+def metrics(request):
+    # Format texte Prometheus, hors DRF (ni négociation de contenu ni API navigable)
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api_view(['GET'])
+def address_search(request):
+    # Autocomplétion de l'adresse du chantier depuis l'index local de la BAN
+    index = get_address_index()
+    if index is None:
+        return Response({'error': "Index d'adresses absent : lancer `manage.py build_address_index`."},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    latitude = parse_coordinate('lat', request.query_params.get('lat'), 90)
+    longitude = parse_coordinate('lon', request.query_params.get('lon'), 180)
+    limit = parse_limit(request.query_params.get('limit'), DEFAULT_ADDRESS_LIMIT, MAX_ADDRESS_LIMIT)
+    return Response(index.search(request.query_params.get('q', ''), latitude, longitude, limit))
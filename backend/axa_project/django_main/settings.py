@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  
+    'django_api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,12 +76,47 @@ WSGI_APPLICATION = 'django_main.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Profil de connexion (DATABASE_PROFILE) :
+# - 'production' (défaut) : synchronous=NORMAL, attente du verrou d'écriture au lieu de "database is locked",
+#   transactions IMMEDIATE, connexions persistantes, et une connexion en lecture seule
+#   'readonly' pour les lectures lourdes (liste, exports ; cf. django_api/db_router.py) ;
+# - 'basic' : configuration SQLite par défaut de Django.
+# Dans les deux cas, le fichier est en journal WAL (les lectures n'attendent plus les
+# écritures) : la migration 0009 l'y enregistre une fois pour toutes.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'production')
+
+SQLITE_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    # SQLITE_PATH : autre fichier de base (ex. base jetable des tests de charge)
+    'NAME': os.environ.get('SQLITE_PATH') or BASE_DIR / 'db.sqlite3',
 }
+SQLITE_PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 10000',
+    'PRAGMA cache_size = -20000',  # 20 Mo par connexion
+    'PRAGMA mmap_size = 268435456',  # 256 Mo
+    'PRAGMA temp_store = MEMORY',
+]
+PERSISTENT_CONNECTION = {'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True}
+
+DATABASE_PROFILES = {
+    'basic': {
+        'default': SQLITE_DATABASE,
+    },
+    'production': {
+        'default': dict(SQLITE_DATABASE, **PERSISTENT_CONNECTION, OPTIONS={
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            # Verrou d'écriture pris dès le début de la transaction : pas d'échec immédiat
+            # quand une transaction de lecture veut écrire alors qu'un autre écrivain est actif
+            'transaction_mode': 'IMMEDIATE',
+        }),
+        'readonly': dict(SQLITE_DATABASE, **PERSISTENT_CONNECTION, OPTIONS={
+            'init_command': ';'.join(SQLITE_PRAGMAS + ['PRAGMA query_only = ON']),
+        }, TEST={'MIRROR': 'default'}),
+    },
+}
+DATABASES = DATABASE_PROFILES[DATABASE_PROFILE]
+DATABASE_ROUTERS = ['django_api.db_router.ReadWriteRouter']
 
 
 # Password validation
@@ -130,6 +166,106 @@ CORS_ALLOWED_ORIGINS = [
     "http://192.168.0.18:3000",  # Autoriser le frontend React sur l'IP locale
 ]
 
-CORS_EXPOSE_HEADERS = ['Content-Disposition']
+CORS_EXPOSE_HEADERS = ['Content-Disposition', 'ETag']
+
+
+
+# Génération asynchrone des documents (cf. django_api/jobs.py)
+# DOCUMENT_JOB_EXECUTOR : 'thread', 'process' ou 'sync' (rendu immédiat, utile pour les tests)
+DOCUMENT_JOB_EXECUTOR = os.environ.get('DOCUMENT_JOB_EXECUTOR', 'thread')
+DOCUMENT_JOB_WORKERS = int(os.environ.get('DOCUMENT_JOB_WORKERS', '2'))
+DOCUMENT_JOB_DIR = BASE_DIR / 'generated_documents'
+# Un rendu "en cours" depuis plus longtemps est considéré comme abandonné et remis en file
+DOCUMENT_JOB_TIMEOUT_SECONDS = 300
+# Les jobs terminés (et leurs fichiers) sont supprimés au-delà de ce délai
+DOCUMENT_JOB_RETENTION_SECONDS = int(os.environ.get('DOCUMENT_JOB_RETENTION_SECONDS', str(24 * 3600)))
+# Rendu des documents par les vues asynchrones (service ASGI, cf. django_api/async_views.py) :
+# au-delà de N demandes en attente, réponse 503 plutôt qu'une file sans limite
+ASYNC_DOCUMENT_WORKERS = int(os.environ.get('ASYNC_DOCUMENT_WORKERS', str(DOCUMENT_JOB_WORKERS)))
+ASYNC_DOCUMENT_MAX_PENDING = int(os.environ.get('ASYNC_DOCUMENT_MAX_PENDING', '32'))
+
+# Flux des modifications de devis (cf. django_api/changes.py) : N derniers changements gardés en mémoire
+CHANGE_FEED_SIZE = int(os.environ.get('CHANGE_FEED_SIZE', '10000'))
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_WAIT_SECONDS = 30
+CHANGE_FEED_HEARTBEAT_SECONDS = 15
+CHANGE_FEED_STREAM_SECONDS = int(os.environ.get('CHANGE_FEED_STREAM_SECONDS', '300'))
+
+# Cache disque des documents générés (cf. django_api/document_cache.py)
+DOCUMENT_CACHE_DIR = BASE_DIR / 'document_cache'
+DOCUMENT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Historique des devis : un instantané complet toutes les N entrées, point de départ
+# des reconstructions `as_of` (cf. django_api/as_of.py)
+HISTORY_SNAPSHOT_INTERVAL = 20
+# Écriture de l'historique (cf. django_api/audit.py) : 'sync' (dans la transaction du
+# save, utile pour les tests) ou 'queue' (différée, par lots, par un thread d'écriture)
+HISTORY_AUDIT_MODE = os.environ.get('HISTORY_AUDIT_MODE', 'sync')
+HISTORY_AUDIT_BATCH_SIZE = 500
+HISTORY_AUDIT_FLUSH_SECONDS = 1.0
+HISTORY_AUDIT_MAX_PENDING = 10000
+
+# Rétention de l'historique (cf. django_api/retention.py et `manage.py prune_history`) :
+# regroupement quotidien au-delà de N jours, archivage JSON lines compressé au-delà de N mois
+HISTORY_ROLLUP_AFTER_DAYS = 90
+HISTORY_ARCHIVE_AFTER_MONTHS = 12
+HISTORY_ARCHIVE_DIR = BASE_DIR / 'history_archive'
+
+# Cache des réponses de la liste et du détail des devis (cf. django_api/response_cache.py)
+# PROPOSAL_CACHE_BACKEND : 'locmem' (mémoire de chaque processus),
+# 'file' (répertoire partagé entre processus) ou 'dummy' (désactivé)
+PROPOSAL_CACHE_BACKEND = os.environ.get('PROPOSAL_CACHE_BACKEND', 'locmem')
+PROPOSAL_CACHE_TIMEOUT = 300
+PROPOSAL_CACHE_BACKENDS = {
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'proposals', 'OPTIONS': {'MAX_ENTRIES': 2000}},
+    'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'response_cache'},
+    'dummy': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'proposals': dict(PROPOSAL_CACHE_BACKENDS[PROPOSAL_CACHE_BACKEND], KEY_PREFIX='proposals'),
+    # Génération du cache, partagée par tous les processus quel que soit PROPOSAL_CACHE_BACKEND
+    'proposals_generation': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'response_generation',
+        'KEY_PREFIX': 'proposals',
+    },
+}
 
+# Index local d'adresses pour l'autocomplétion (cf. django_api/addresses.py et
+# `manage.py build_address_index`), construit à partir des exports CSV de la BAN
+ADDRESS_INDEX_DIR = BASE_DIR / 'address_index'
+
+# Journaux : niveau (LOG_LEVEL, DEBUG pour le détail des primes calculées et de chaque
+# requête) et format (LOG_FORMAT : 'text' ou 'json', une ligne JSON par événement)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {
+            '()': 'django_api.log_format.KeyValueFormatter',
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+        'json': {'()': 'django_api.log_format.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': LOG_FORMAT},
+    },
+    'root': {'handlers': ['console'], 'level': 'WARNING'},
+    'loggers': {
+        'django_api': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
 
+# Métriques Prometheus (GET /metrics, cf. django_api/metrics.py) et profilage des
+# requêtes lentes (cf. django_api/middleware.py) : avec REQUEST_PROFILING=1, une
+# requête sur REQUEST_PROFILE_SAMPLE_RATE passe sous cProfile, et son profil est
+# enregistré si elle dure plus de REQUEST_PROFILE_SLOW_SECONDS
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', '0') == '1'
+REQUEST_PROFILE_SAMPLE_RATE = float(os.environ.get('REQUEST_PROFILE_SAMPLE_RATE', '0.1'))
+REQUEST_PROFILE_SLOW_SECONDS = float(os.environ.get('REQUEST_PROFILE_SLOW_SECONDS', '0.5'))
+REQUEST_PROFILE_DIR = BASE_DIR / 'profiles'
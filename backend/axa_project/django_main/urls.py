@@ -2,10 +2,12 @@ from django.contrib import admin
 from django.urls import path, include 
 from django.conf import settings
 from django.conf.urls.static import static 
+from django_api.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('django_api.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
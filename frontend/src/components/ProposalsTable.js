@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import { useNavigate } from 'react-router-dom';
 import proposalService from '../services/proposalService';
 import './ProposalsTable.css';
@@ -43,6 +43,41 @@ const booleanOptionsFilter = [
 	{ value: 'false', label: 'Non' },
 ];
 
+// Colonnes lues par le tableau et ses filtres : la liste ne renvoie que celles-ci
+const TABLE_FIELDS = [
+	'id',
+	'opportunity_number',
+	'client_name',
+	'guarantee_type',
+	'ouvrage_destination',
+	'work_type',
+	'ouvrage_cost',
+	'existing_presence',
+	'is_vip_client',
+	'rcmo_desired',
+	'prime_seule_tarif_duo',
+];
+
+// Devis par page : filtres, tri et pagination sont faits par le serveur
+const PAGE_SIZE = 50;
+
+// Délai avant de relancer l'écoute des modifications après une erreur réseau
+const CHANGES_RETRY_DELAY = 5000;
+
+// Applique aux devis affichés les modifications et suppressions reçues du flux. Une création
+// n'est pas insérée ici : sa place dépend des filtres et du tri du serveur (cf. fetchProposals)
+const applyChanges = (proposals, changes) => {
+	const byId = new Map(proposals.map((proposal) => [proposal.id, proposal]));
+	changes.forEach((change) => {
+		if (change.type === 'deleted') {
+			byId.delete(change.id);
+		} else if (byId.has(change.id)) {
+			byId.set(change.id, { ...byId.get(change.id), ...change.fields });
+		}
+	});
+	return Array.from(byId.values());
+};
+
 const initialFilters = {
 	opportunity_number: '',
 	client_name: '',
@@ -56,15 +91,36 @@ const initialFilters = {
 	rcmo_desired: '',
 };
 
+const initialSort = { key: 'opportunity_number', direction: 'descending' };
+
+// Filtres renseignés, au format des paramètres de la liste
+const filterParams = (filters) => Object.fromEntries(Object.entries(filters).filter(([, value]) => value !== '' && value !== null));
+
+const listParams = (filters, sortConfig) => {
+	const params = { ...filterParams(filters), fields: TABLE_FIELDS.join(','), page_size: PAGE_SIZE };
+	if (sortConfig.key !== null) {
+		params.ordering = (sortConfig.direction === 'descending' ? '-' : '') + sortConfig.key;
+	}
+	return params;
+};
+
 const ProposalsTable = () => {
 	const [proposals, setProposals] = useState([]);
 	const navigate = useNavigate();
-	const [sortConfig, setSortConfig] = useState({ key: null, direction: 'descending' });
+	// Lien vers la page suivante de la liste (null : tout est chargé)
+	const [nextPage, setNextPage] = useState(null);
+	const [sortConfig, setSortConfig] = useState(initialSort);
 	const [showFilterPanel, setShowFilterPanel] = useState(false);
 	const [activeFilters, setActiveFilters] = useState(initialFilters);
 	const [showHistoryModal, setShowHistoryModal] = useState(false);
 	const [historyData, setHistoryData] = useState([]);
+	const [historyNext, setHistoryNext] = useState(null);
 	const [selectedProposalForHistory, setSelectedProposalForHistory] = useState(null);
+	const [searchQuery, setSearchQuery] = useState('');
+	// Résultats de la recherche serveur (null : pas de recherche en cours)
+	const [searchResults, setSearchResults] = useState(null);
+	// Curseur du flux des modifications, relevé juste avant le chargement de la liste
+	const [changesCursor, setChangesCursor] = useState(null);
 
 	// Fonctions pour obtenir les libellés
 
@@ -73,13 +129,37 @@ const ProposalsTable = () => {
 		return option ? option.label : value;
 	};
 
-	const fetchProposals = () => {
+	// Première page de la liste, avec les filtres et le tri courants
+	const fetchProposals = useCallback(() => {
+		// Curseur relevé avant la liste : aucune modification n'est perdue entre les deux
+		return proposalService
+			.getProposalChanges()
+			.then((response) => response.data.cursor)
+			.catch(() => null)
+			.then((cursor) => proposalService.getAllProposals(listParams(activeFilters, sortConfig)).then((response) => [cursor, response]))
+			.then(([cursor, response]) => {
+				setProposals(response.data.results);
+				setNextPage(response.data.next);
+				setChangesCursor(cursor);
+			})
+			.catch((error) => {
+				console.error('Erreur lors de la récupération des devis:', error);
+				toast.error('Erreur lors de la récupération des devis.');
+			});
+	}, [activeFilters, sortConfig]);
+
+	useEffect(() => {
+		// On attend la fin de la frappe dans les filtres avant d'interroger le serveur
+		const timer = setTimeout(fetchProposals, 300);
+		return () => clearTimeout(timer);
+	}, [fetchProposals]);
+
+	const handleLoadMoreProposals = () => {
 		proposalService
-			.getAllProposals()
+			.getAllProposals(null, nextPage)
 			.then((response) => {
-				setProposals(response.data);
-				setSortConfig({ key: 'opportunity_number', direction: 'descending' });
-				setActiveFilters(initialFilters);
+				setProposals((current) => [...current, ...response.data.results]);
+				setNextPage(response.data.next);
 			})
 			.catch((error) => {
 				console.error('Erreur lors de la récupération des devis:', error);
@@ -87,61 +167,66 @@ const ProposalsTable = () => {
 			});
 	};
 
+	// Modifications des autres utilisateurs appliquées au fil de l'eau, sans relire toute la liste
 	useEffect(() => {
-		fetchProposals();
-	}, []);
-
-	const filteredAndSortedProposals = useMemo(() => {
-		let processedProposals = [...proposals];
-
-		// Filtrage
-		Object.keys(activeFilters).forEach((key) => {
-			const filterValue = activeFilters[key];
-			if (filterValue === '' || filterValue === null) return;
-
-			processedProposals = processedProposals.filter((proposal) => {
-				const proposalValue = proposal[key];
-				if (key === 'prime_price_min') {
-					return parseFloat(proposal['prime_seule_tarif_duo'] ? parseFloat(proposal['prime_seule_tarif_duo']).toFixed(2) : 0) >= parseFloat(filterValue);
-				}
-				if (key === 'prime_price_max') {
-					return parseFloat(proposal['prime_seule_tarif_duo'] ? parseFloat(proposal['prime_seule_tarif_duo']).toFixed(2) : 0) <= parseFloat(filterValue);
-				}
-				if (typeof proposalValue === 'boolean') {
-					return String(proposalValue) === filterValue;
-				}
-				if (typeof proposalValue === 'number' || typeof proposalValue === 'string') {
-					return String(proposalValue).toLowerCase().includes(String(filterValue).toLowerCase());
-				}
-				return false;
-			});
-		});
+		if (!changesCursor) return;
+		let cancelled = false;
+		let timer = null;
+		const listen = (since) => {
+			proposalService
+				.getProposalChanges(since, 25)
+				.then((response) => {
+					if (cancelled) return;
+					const { cursor, reset, results } = response.data;
+					if (reset || results.some((change) => change.type === 'created')) {
+						// Serveur redémarré, trop de retard ou nouveau devis : la première page est relue
+						fetchProposals();
+						return;
+					}
+					if (results.length) {
+						setProposals((current) => applyChanges(current, results));
+					}
+					listen(cursor);
+				})
+				.catch(() => {
+					if (!cancelled) timer = setTimeout(() => listen(since), CHANGES_RETRY_DELAY);
+				});
+		};
+		listen(changesCursor);
+		return () => {
+			cancelled = true;
+			clearTimeout(timer);
+		};
+	}, [changesCursor, fetchProposals]);
 
-		// Tri
-		if (sortConfig.key !== null) {
-			processedProposals.sort((a, b) => {
-				let valA = a[sortConfig.key];
-				let valB = b[sortConfig.key];
-
-				if (sortConfig.key === 'prime_seule_tarif_duo') {
-					valA = parseFloat(valA) || 0;
-					valB = parseFloat(valB) || 0;
-				} else {
-					valA = String(valA || '').toLowerCase();
-					valB = String(valB || '').toLowerCase();
-				}
-
-				if (valA < valB) {
-					return sortConfig.direction === 'ascending' ? -1 : 1;
-				}
-				if (valA > valB) {
-					return sortConfig.direction === 'ascending' ? 1 : -1;
-				}
-				return 0;
-			});
+	useEffect(() => {
+		const query = searchQuery.trim();
+		if (!query) {
+			setSearchResults(null);
+			return;
 		}
-		return processedProposals;
-	}, [proposals, sortConfig, activeFilters]);
+		let cancelled = false;
+		// On attend la fin de la frappe avant d'interroger le serveur
+		const timer = setTimeout(() => {
+			// Mêmes filtres que la liste ; les résultats arrivent classés par pertinence
+			proposalService
+				.searchProposals(query, { limit: 100, ...filterParams(activeFilters) })
+				.then((response) => {
+					if (!cancelled) setSearchResults(response.data);
+				})
+				.catch((error) => {
+					console.error('Erreur lors de la recherche:', error);
+					toast.error('Erreur lors de la recherche.');
+				});
+		}, 300);
+		return () => {
+			cancelled = true;
+			clearTimeout(timer);
+		};
+	}, [searchQuery, activeFilters]);
+
+	const displayedProposals = searchResults !== null ? searchResults : proposals;
+	const hasCriteria = Object.keys(filterParams(activeFilters)).length > 0 || searchQuery.trim() !== '';
 
 	const toggleFilterPanel = () => {
 		const filterPanel = document.querySelector('.filter-panel');
@@ -178,7 +263,8 @@ const ProposalsTable = () => {
 
 	const resetFiltersAndSort = () => {
 		setActiveFilters(initialFilters);
-		setSortConfig({ key: null, direction: 'ascending' });
+		setSortConfig(initialSort);
+		setSearchQuery('');
 		setShowFilterPanel(false);
 	};
 
@@ -258,7 +344,8 @@ const ProposalsTable = () => {
 		setSelectedProposalForHistory(proposal);
 		try {
 			const response = await proposalService.getProposalHistory(proposal.id);
-			setHistoryData(response.data);
+			setHistoryData(response.data.results);
+			setHistoryNext(response.data.next);
 			setShowHistoryModal(true);
 		} catch (error) {
 			console.error("Erreur lors de la récupération de l'historique:", error);
@@ -266,6 +353,17 @@ const ProposalsTable = () => {
 		}
 	};
 
+	const handleLoadMoreHistory = async () => {
+		try {
+			const response = await proposalService.getProposalHistory(selectedProposalForHistory.id, historyNext);
+			setHistoryData((entries) => [...entries, ...response.data.results]);
+			setHistoryNext(response.data.next);
+		} catch (error) {
+			console.error("Erreur lors de la récupération de l'historique:", error);
+			toast.error("Erreur lors de la récupération de l'historique.");
+		}
+	};
+
 	const renderHistoryChanges = (changes) => {
 		return Object.entries(changes).map(([field, change]) => {
 			let oldValue = change.old;
@@ -289,7 +387,7 @@ const ProposalsTable = () => {
 		});
 	};
 
-	if (!proposals.length && !filteredAndSortedProposals.length) {
+	if (!displayedProposals.length && !hasCriteria) {
 		return (
 			<div className="proposals-table-container">
 				<div className="table-actions">
@@ -312,6 +410,13 @@ const ProposalsTable = () => {
 				<button onClick={() => toggleFilterPanel()} className="button-have-icon button button-secondary filter-toggle-button s">
 					Filtres {showFilterPanel ? <MdClose /> : <MdFilterList />}
 				</button>
+				<input
+					type="search"
+					className="search-input"
+					placeholder="Rechercher : client, n° d'opportunité, description, adresse..."
+					value={searchQuery}
+					onChange={(e) => setSearchQuery(e.target.value)}
+				/>
 				<button onClick={handleNewProposal} className="button button-primary button-have-icon m">
 					Nouveau Devis
 					<MdAddBox />
@@ -407,10 +512,8 @@ const ProposalsTable = () => {
 				</div>
 			)}
 
-			{filteredAndSortedProposals.length === 0 && proposals.length > 0 ? (
+			{displayedProposals.length === 0 ? (
 				<p className="no-proposals-message">Aucun devis ne correspond aux critères actuels.</p>
-			) : filteredAndSortedProposals.length === 0 && proposals.length === 0 ? (
-				<p className="no-proposals-message">Aucun devis à afficher pour le moment.</p>
 			) : (
 				<div className="proposals-table">
 					<table>
@@ -436,7 +539,7 @@ const ProposalsTable = () => {
 							</tr>
 						</thead>
 						<tbody>
-							{filteredAndSortedProposals.map((proposal) => (
+							{displayedProposals.map((proposal) => (
 								<tr key={proposal.id}>
 									<td>{proposal.opportunity_number}</td>
 									<td>{proposal.client_name}</td>
@@ -470,6 +573,11 @@ const ProposalsTable = () => {
 							))}
 						</tbody>
 					</table>
+					{searchResults === null && nextPage && (
+						<button onClick={handleLoadMoreProposals} className="button button-secondary">
+							Afficher plus
+						</button>
+					)}
 				</div>
 			)}
 
@@ -492,6 +600,11 @@ const ProposalsTable = () => {
 							) : (
 								<p>Aucun historique trouvé pour ce devis.</p>
 							)}
+							{historyNext && (
+								<button onClick={handleLoadMoreHistory} className="button button-secondary">
+									Afficher plus
+								</button>
+							)}
 						</div>
 						<button onClick={() => setShowHistoryModal(false)} className="button button-primary">
 							Fermer
@@ -2,8 +2,10 @@ import axios from 'axios';
 
 const API_URL = 'http://localhost:8000/api/proposals/';
 
-const getAllProposals = () => {
-	return axios.get(API_URL);
+// Filtres, tri (`ordering`) et `page_size` appliqués par le serveur ; `nextUrl` est le lien `next`
+// de la page précédente, qui porte déjà ces paramètres
+const getAllProposals = (params, nextUrl) => {
+	return nextUrl ? axios.get(nextUrl) : axios.get(API_URL, { params });
 };
 
 const getProposal = (id) => {
@@ -32,8 +34,53 @@ const generateDocument = (id, docType) => {
 	);
 };
 
-const getProposalHistory = (id) => {
-	return axios.get(API_URL + id + '/history/');
+// L'historique est paginé : `nextUrl` est le lien `next` de la page précédente
+const getProposalHistory = (id, nextUrl) => {
+	return axios.get(nextUrl || API_URL + id + '/history/');
+};
+
+// Recherche plein texte côté serveur, classée par pertinence
+const searchProposals = (query, params) => {
+	return axios.get(API_URL + 'search/', { params: { q: query, ...params } });
+};
+
+// Flux des modifications : sans `since`, renvoie seulement le curseur courant ;
+// avec `wait`, le serveur garde la requête jusqu'au prochain changement (long polling)
+const getProposalChanges = (since, wait) => {
+	return axios.get(API_URL + 'changes/', { params: { since, wait } });
+};
+
+// Source de l'autocomplétion des adresses : 'local' (index BAN servi par le backend, par défaut)
+// ou 'ban' (api-adresse.data.gouv.fr, depuis le navigateur)
+const ADDRESS_SEARCH_SOURCE = process.env.REACT_APP_ADDRESS_SEARCH_SOURCE || 'local';
+const ADDRESS_API_URL = 'http://localhost:8000/api/addresses/search/';
+
+const searchAddressLocal = async (params) => {
+	const response = await axios.get(ADDRESS_API_URL, { params });
+	// Le backend renvoie déjà les champs utiles : on ajoute seulement les clés attendues par le formulaire
+	const formattedSuggestions = response.data.map((address) => ({
+		...address,
+		place_id: (address.housenumber || '') + address.latitude + address.longitude,
+		value: address.label,
+	}));
+	return { ...response, data: formattedSuggestions };
+};
+
+const searchAddressBan = async (params) => {
+	const response = await axios.get('https://api-adresse.data.gouv.fr/search/', { params });
+	// Permet de renvoyer un résultat formatté
+	const formattedSuggestions = response.data.features.map((feature) => ({
+		place_id: feature.properties.housenumber + feature.geometry.coordinates[1] + feature.geometry.coordinates[0],
+		label: feature.properties.label,
+		value: feature.properties.label,
+		latitude: feature.geometry.coordinates[1],
+		longitude: feature.geometry.coordinates[0],
+		housenumber: feature.properties.housenumber,
+		street: feature.properties.street,
+		city: feature.properties.city,
+		postcode: feature.properties.postcode,
+	}));
+	return { ...response, data: formattedSuggestions };
 };
 
 const searchAddressAdresseData = async (query) => {
@@ -44,22 +91,9 @@ const searchAddressAdresseData = async (query) => {
 		limit: 5,
 	};
 	try {
-		const response = await axios.get('https://api-adresse.data.gouv.fr/search/', { params });
-		// Permet de renvoyer un résultat formatté
-		const formattedSuggestions = response.data.features.map((feature) => ({
-			place_id: feature.properties.housenumber + feature.geometry.coordinates[1] + feature.geometry.coordinates[0],
-			label: feature.properties.label,
-			value: feature.properties.label,
-			latitude: feature.geometry.coordinates[1],
-			longitude: feature.geometry.coordinates[0],
-			housenumber: feature.properties.housenumber,
-			street: feature.properties.street,
-			city: feature.properties.city,
-			postcode: feature.properties.postcode,
-		}));
-		return { ...response, data: formattedSuggestions };
+		return ADDRESS_SEARCH_SOURCE === 'ban' ? await searchAddressBan(params) : await searchAddressLocal(params);
 	} catch (error) {
-		console.error("Erreur lors de la recherche d'adresse Nominatim:", error);
+		console.error("Erreur lors de la recherche d'adresse:", error);
 		throw error;
 	}
 };
@@ -73,5 +107,7 @@ export default {
 	deleteProposal,
 	generateDocument,
 	getProposalHistory,
+	searchProposals,
+	getProposalChanges,
 	searchAddressAdresseData,
 };